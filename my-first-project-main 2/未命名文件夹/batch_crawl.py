@@ -0,0 +1,174 @@
+"""
+无界面批量爬取（不经过 HTTP 层，适合定时任务）
+
+输入每行一个 "关键词 笔记数 评论数"（与 crawl 子命令格式相同，空行和 # 开头的行忽略），
+来自文件或标准输入；每保存一条笔记就向标准输出（或 --out 文件）写一行 JSON，日志写到标准错误。
+
+--workers N 时把关键词轮流分成 N 片，每片一个子进程：子进程使用浏览器配置目录的一份副本
+（data/batch_profiles/worker_<序号>，不含缓存和锁文件，登录 Cookie 随之复制），
+以无界面模式运行，父进程按到达顺序合并各子进程输出的行。
+
+退出码：0 表示每个关键词都至少保存了一条笔记；1 表示有关键词爬取失败或一条也没有保存，
+或者遇到登录墙（登录失效后剩下的关键词不再爬取，需要重新登录）；2 表示没有可爬取的关键词。
+
+    python cli.py batch -f keywords.txt --workers 3 --out notes.jsonl
+    echo "露营 20 5" | python cli.py batch --headless
+"""
+from typing import IO, List, Optional, Tuple
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+PROFILES_DIR = os.path.join(BASE_DIR, "data", "batch_profiles")
+
+# 复制配置目录时跳过的缓存目录和 Chromium 单实例锁文件
+PROFILE_IGNORE = ("Cache", "Code Cache", "GPUCache", "GrShaderCache", "ShaderCache", "DawnCache",
+                  "CacheStorage", "ScriptCache", "Crashpad", "SingletonLock", "SingletonCookie",
+                  "SingletonSocket", "lockfile")
+
+Spec = Tuple[str, int, int]
+
+
+def read_specs(lines) -> List[Spec]:
+    """解析关键词规格，格式不对的行打印到标准错误后跳过"""
+    from xiaohongshu_mcp import parse_user_input
+    specs = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        keywords, note_limit, comment_limit = parse_user_input(line)
+        if not keywords:
+            print(f"[日志] 无法解析的关键词行，已跳过: {line}", file=sys.stderr)
+            continue
+        specs.append((keywords, note_limit, comment_limit))
+    return specs
+
+
+def copy_profile(src: str, dest: str) -> str:
+    """把浏览器配置目录复制一份给子进程（每次运行都重新复制，带上最新的登录状态）"""
+    if os.path.exists(dest):
+        shutil.rmtree(dest, ignore_errors=True)
+    if os.path.isdir(src):
+        shutil.copytree(src, dest, ignore=shutil.ignore_patterns(*PROFILE_IGNORE), symlinks=True)
+    else:
+        os.makedirs(dest, exist_ok=True)
+    return dest
+
+
+async def crawl_specs(specs: List[Spec], out: IO[str]) -> int:
+    """在本进程中依次爬取每个关键词，每条笔记写一行 JSON；返回退出码"""
+    import xiaohongshu_mcp as core
+
+    async def emit(note):
+        out.write(json.dumps(note, ensure_ascii=False) + "\n")
+        out.flush()
+
+    # 核心模块的日志打印到标准输出，这里改到标准错误，标准输出只留 JSONL
+    with contextlib.redirect_stdout(sys.stderr):
+        if not await core.ensure_browser():
+            print("[日志] 浏览器配置目录中没有登录状态，请先运行一次有界面的登录", file=sys.stderr)
+            return 1
+        failed = 0
+        for keywords, note_limit, comment_limit in specs:
+            start = time.monotonic()
+            try:
+                count = await core.crawl_notes_by_click(core.main_page, keywords, note_limit, comment_limit,
+                                                        on_note=emit)
+                print(f"[日志] 关键词 {keywords} 完成：{count}/{note_limit} 条，耗时 {time.monotonic() - start:.0f}s")
+                if count == 0 and note_limit > 0:
+                    failed += 1
+                    print(f"[日志] 关键词 {keywords} 没有保存任何笔记")
+            except Exception as e:
+                failed += 1
+                print(f"[日志] 关键词 {keywords} 爬取失败: {e}")
+            if not core.is_logged_in:
+                # 爬取中遇到登录墙：剩下的关键词同样会被拦住
+                failed += 1
+                print("[日志] 登录已失效，停止批量爬取，请先运行一次有界面的登录")
+                break
+        await core.close_browser()
+    return 1 if failed else 0
+
+
+def _pump(stream, lines: "queue.Queue", worker: int) -> None:
+    for line in stream:
+        lines.put(line)
+    lines.put((worker, None))
+
+
+def run_sharded(specs: List[Spec], workers: int, out: IO[str]) -> int:
+    """按关键词分片启动子进程，合并各子进程的输出；返回退出码（任一子进程失败即为 1）"""
+    import xiaohongshu_mcp as core
+
+    shards = [specs[i::workers] for i in range(workers)]
+    lines: "queue.Queue" = queue.Queue()
+    procs = []
+    for i, shard in enumerate(shards):
+        profile = copy_profile(core.BROWSER_DATA_DIR, os.path.join(PROFILES_DIR, f"worker_{i}"))
+        env = dict(os.environ, XHS_BROWSER_DATA_DIR=profile, XHS_HEADLESS="1", PYTHONIOENCODING="utf-8")
+        proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--worker"], env=env,
+                                stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, encoding="utf-8")
+        proc.stdin.write("".join(f"{k} {n} {c}\n" for k, n, c in shard))
+        proc.stdin.close()
+        threading.Thread(target=_pump, args=(proc.stdout, lines, i), daemon=True).start()
+        procs.append(proc)
+        print(f"[日志] 子进程 {i}（pid {proc.pid}）负责 {len(shard)} 个关键词", file=sys.stderr)
+    running = len(procs)
+    count = 0
+    while running:
+        line = lines.get()
+        if isinstance(line, tuple):
+            running -= 1
+            continue
+        out.write(line)
+        out.flush()
+        count += 1
+    codes = [proc.wait() for proc in procs]
+    print(f"[日志] 批量爬取结束：共 {count} 条笔记，子进程退出码 {codes}", file=sys.stderr)
+    return 1 if any(codes) else 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="无界面批量爬取，按 JSONL 输出每条笔记")
+    parser.add_argument("-f", "--file", default="-", help="关键词规格文件，每行 \"关键词 笔记数 评论数\"；- 表示标准输入")
+    parser.add_argument("--workers", type=int, default=1, help="子进程数，大于 1 时按关键词分片")
+    parser.add_argument("--out", default=None, help="输出文件（默认标准输出）")
+    parser.add_argument("--headless", action="store_true", help="单进程时也以无界面模式运行（子进程总是无界面）")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.headless:
+        # 必须在导入核心模块之前设置
+        os.environ["XHS_HEADLESS"] = "1"
+
+    if args.file == "-":
+        specs = read_specs(sys.stdin)
+    else:
+        with open(args.file, "r", encoding="utf-8") as f:
+            specs = read_specs(f)
+    if not specs:
+        print("没有可爬取的关键词", file=sys.stderr)
+        return 2
+
+    out = open(args.out, "a", encoding="utf-8") if args.out else sys.stdout
+    try:
+        workers = max(1, min(args.workers, len(specs)))
+        if args.worker or workers == 1:
+            return asyncio.run(crawl_specs(specs, out))
+        return run_sharded(specs, workers, out)
+    finally:
+        if args.out:
+            out.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
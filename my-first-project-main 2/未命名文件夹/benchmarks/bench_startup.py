@@ -0,0 +1,98 @@
+"""
+启动耗时与导入开销基准
+
+对每个入口模块在全新的解释器中重复导入，统计导入耗时，
+并检查导入后是否加载了不该加载的重量级依赖（pandas / Playwright / Flask / FastMCP）。
+
+用法：python benchmarks/bench_startup.py [--repeat 5] [--importtime]
+"""
+from typing import Dict, List
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ["pandas", "playwright", "flask", "flask_cors", "fastmcp", "jieba"]
+
+# 入口模块 -> 允许加载的重量级依赖
+ENTRY_POINTS: Dict[str, List[str]] = {
+    "xiaohongshu_mcp": [],
+    "cli": [],
+    "mcp_server": ["fastmcp"],
+    "http_api": ["flask", "flask_cors"],
+}
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+try:
+    import {module}
+    error = None
+except Exception as e:
+    error = f"{{type(e).__name__}}: {{e}}"
+elapsed = time.perf_counter() - start
+heavy = [m for m in {heavy!r} if m in sys.modules]
+print(json.dumps({{"seconds": elapsed, "heavy": heavy, "error": error}}))
+"""
+
+
+def measure(module: str, repeat: int) -> Dict:
+    samples = []
+    heavy: List[str] = []
+    error = None
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, "-c", PROBE.format(module=module, heavy=HEAVY_MODULES)],
+            cwd=PROJECT_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip().splitlines()[-1]
+        result = json.loads(out)
+        samples.append(result["seconds"])
+        heavy = result["heavy"]
+        error = result["error"]
+    unexpected = [m for m in heavy if m not in ENTRY_POINTS[module]]
+    return {
+        "模块": module,
+        "导入耗时ms_中位数": round(statistics.median(samples) * 1000, 2),
+        "导入耗时ms_最小": round(min(samples) * 1000, 2),
+        "已加载重量级依赖": heavy,
+        "意外加载": unexpected,
+        "错误": error,
+    }
+
+
+def importtime_top(module: str, top: int = 10) -> List[Dict]:
+    """用 -X importtime 找出累计导入耗时最高的模块"""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          cwd=PROJECT_DIR, capture_output=True, text=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append({"模块": name.strip(), "自身us": int(self_us), "累计us": int(cumulative_us)})
+    rows.sort(key=lambda r: -r["累计us"])
+    return rows[:top]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="入口模块启动耗时基准")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--importtime", action="store_true", help="同时输出每个入口最慢的导入项")
+    args = parser.parse_args()
+
+    failed = False
+    for module in ENTRY_POINTS:
+        result = measure(module, args.repeat)
+        if args.importtime:
+            result["最慢导入"] = importtime_top(module)
+        print(json.dumps(result, ensure_ascii=False))
+        failed = failed or bool(result["意外加载"])
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
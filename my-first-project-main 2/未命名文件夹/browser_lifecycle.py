@@ -0,0 +1,254 @@
+"""
+长时间运行的浏览器会话的生命周期管理
+
+- 页面回收：同一个页面处理满 max_notes_per_page 条笔记，或页面 JS 堆超过阈值时，换一个新页面
+- 浏览器重启：整个浏览器进程树的 RSS 超过阈值时重启浏览器（关闭单个页面降不下来）；
+  重启后冷却 rss_restart_cooldown 秒内不再因 RSS 重启，避免内存降不下来时反复重启
+- 卡死检测：页面在 health_timeout 秒内无法执行一段最简单的脚本时，视为浏览器卡死，由调用方重启浏览器
+- 定期清理：运行中定期通过 CDP 清空 HTTP 缓存；浏览器关闭期间清理 browser_data 中可再生的缓存目录
+每次回收/重启/清理都会记录到 metrics。
+"""
+from typing import Any, Dict, Optional
+import asyncio
+import json
+import os
+import shutil
+import time
+
+import metrics
+
+# browser_data 中可以安全删除、浏览器会自动重建的缓存目录（相对于 Default 配置目录或根目录）
+PROFILE_CACHE_DIRS = [
+    "Cache",
+    "Code Cache",
+    "GPUCache",
+    "DawnCache",
+    "DawnGraphiteCache",
+    "DawnWebGPUCache",
+    "GrShaderCache",
+    "GraphiteDawnCache",
+    "ShaderCache",
+    "Service Worker/CacheStorage",
+    "Service Worker/ScriptCache",
+    "blob_storage",
+    "Crashpad",
+]
+
+
+class LifecycleConfig:
+    """生命周期阈值，均可通过环境变量覆盖"""
+
+    def __init__(self):
+        self.max_notes_per_page = int(os.environ.get("XHS_MAX_NOTES_PER_PAGE", 50))
+        self.max_js_heap_mb = float(os.environ.get("XHS_MAX_JS_HEAP_MB", 512))
+        self.max_rss_mb = float(os.environ.get("XHS_MAX_BROWSER_RSS_MB", 3072))
+        self.rss_check_interval = float(os.environ.get("XHS_RSS_CHECK_INTERVAL", 30))
+        self.rss_restart_cooldown = float(os.environ.get("XHS_RSS_RESTART_COOLDOWN", 600))
+        self.health_timeout = float(os.environ.get("XHS_HEALTH_TIMEOUT", 10))
+        self.health_check_interval = float(os.environ.get("XHS_HEALTH_CHECK_INTERVAL", 30))
+        self.cache_clear_interval = float(os.environ.get("XHS_CACHE_CLEAR_INTERVAL", 1800))
+        self.profile_cleanup_interval = float(os.environ.get("XHS_PROFILE_CLEANUP_INTERVAL", 86400))
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def browser_rss_mb() -> Optional[float]:
+    """
+    当前进程所有子进程（Playwright 驱动与 Chromium）的 RSS 总和（MB）；
+    优先使用 psutil，Linux 下退化为读取 /proc，都不可用时返回 None
+    """
+    try:
+        import psutil
+        total = 0
+        for child in psutil.Process().children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except psutil.Error:
+                continue
+        return total / 1024 / 1024
+    except ImportError:
+        pass
+    if not os.path.isdir("/proc"):
+        return None
+    parents: Dict[int, int] = {}
+    rss_pages: Dict[int, int] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            parents[int(entry)] = int(fields[1])
+            rss_pages[int(entry)] = int(fields[21])
+        except (OSError, IndexError, ValueError):
+            continue
+    me = os.getpid()
+    total_pages = 0
+    for pid in parents:
+        parent = parents.get(pid)
+        while parent and parent != me and parent in parents:
+            parent = parents[parent]
+        if parent == me:
+            total_pages += rss_pages.get(pid, 0)
+    return total_pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+
+
+async def js_heap_mb(page) -> Optional[float]:
+    """页面 JS 堆已用大小（MB），非 Chromium 或获取失败时返回 None"""
+    try:
+        used = await page.evaluate("() => performance.memory ? performance.memory.usedJSHeapSize : null")
+        return used / 1024 / 1024 if used else None
+    except Exception:
+        return None
+
+
+async def is_responsive(page, timeout: float) -> bool:
+    """页面能否在 timeout 秒内执行一段最简单的脚本"""
+    if page is None or page.is_closed():
+        return False
+    try:
+        return await asyncio.wait_for(page.evaluate("() => 1"), timeout) == 1
+    except Exception:
+        return False
+
+
+def cleanup_profile(profile_dir: str) -> int:
+    """
+    删除浏览器配置目录中的缓存目录，返回释放的字节数；必须在浏览器关闭时调用
+    """
+    freed = 0
+    for base in (profile_dir, os.path.join(profile_dir, "Default")):
+        for rel in PROFILE_CACHE_DIRS:
+            path = os.path.join(base, rel)
+            if os.path.isdir(path):
+                size = _dir_size(path)
+                shutil.rmtree(path, ignore_errors=True)
+                freed += size
+    metrics.inc("browser_profile_cleanups_total")
+    metrics.inc("browser_profile_cleanup_bytes_total", freed)
+    metrics.record_event("profile_cleanup", freed_mb=round(freed / 1024 / 1024, 1))
+    print(f"[日志] 已清理浏览器缓存目录，释放 {freed / 1024 / 1024:.1f}MB")
+    return freed
+
+
+class PageLifecycle:
+    """
+    记录每个页面处理过的笔记数，并决定何时回收页面、检查健康、清理缓存
+    """
+
+    def __init__(self, profile_dir: str, state_path: str, config: Optional[LifecycleConfig] = None):
+        self.profile_dir = profile_dir
+        self.state_path = state_path
+        self.config = config or LifecycleConfig()
+        self._notes_on_page: Dict[int, int] = {}
+        self._last_health_check = 0.0
+        self._last_rss_check = 0.0
+        self._last_restart = time.monotonic()
+        self._last_cache_clear = time.monotonic()
+
+    def _load_state(self) -> Dict[str, Any]:
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self, state: Dict[str, Any]) -> None:
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        with open(self.state_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+
+    def note_done(self, page) -> int:
+        """页面处理完一条笔记，返回该页面累计处理数"""
+        count = self._notes_on_page.get(id(page), 0) + 1
+        self._notes_on_page[id(page)] = count
+        return count
+
+    def forget(self, page) -> None:
+        self._notes_on_page.pop(id(page), None)
+
+    async def recycle_reason(self, page) -> Optional[str]:
+        """判断页面是否需要回收，返回原因（notes / js_heap），不需要时返回 None"""
+        if self._notes_on_page.get(id(page), 0) >= self.config.max_notes_per_page:
+            return "notes"
+        heap = await js_heap_mb(page)
+        if heap is not None:
+            metrics.set_gauge("page_js_heap_mb", round(heap, 1))
+            if heap >= self.config.max_js_heap_mb:
+                return "js_heap"
+        return None
+
+    async def restart_reason(self) -> Optional[str]:
+        """
+        判断是否需要重启整个浏览器，返回原因（rss），不需要时返回 None；
+        每 rss_check_interval 秒最多检查一次，上次重启后的冷却时间内不会返回 rss
+        """
+        now = time.monotonic()
+        if now - self._last_rss_check < self.config.rss_check_interval:
+            return None
+        self._last_rss_check = now
+        # 遍历 /proc（或 psutil）在线程中执行，不阻塞浏览器所在的事件循环
+        rss = await asyncio.to_thread(browser_rss_mb)
+        if rss is None:
+            return None
+        metrics.set_gauge("browser_rss_mb", round(rss, 1))
+        if rss < self.config.max_rss_mb:
+            return None
+        if now - self._last_restart < self.config.rss_restart_cooldown:
+            metrics.inc("browser_rss_restart_suppressed_total")
+            return None
+        return "rss"
+
+    def mark_restarted(self) -> None:
+        """浏览器重启后调用：各页面的计数清零，重新开始 RSS 冷却"""
+        self._notes_on_page.clear()
+        self._last_restart = time.monotonic()
+
+    def health_check_due(self) -> bool:
+        return time.monotonic() - self._last_health_check >= self.config.health_check_interval
+
+    async def check_health(self, page) -> bool:
+        self._last_health_check = time.monotonic()
+        healthy = await is_responsive(page, self.config.health_timeout)
+        if not healthy:
+            metrics.inc("browser_hang_detected_total")
+        return healthy
+
+    async def maybe_clear_cache(self, page) -> bool:
+        """运行期间按计划通过 CDP 清空 HTTP 缓存"""
+        if time.monotonic() - self._last_cache_clear < self.config.cache_clear_interval:
+            return False
+        self._last_cache_clear = time.monotonic()
+        try:
+            session = await page.context.new_cdp_session(page)
+            await session.send("Network.clearBrowserCache")
+            await session.detach()
+            metrics.inc("browser_cache_clears_total")
+            print("[日志] 已按计划清空浏览器 HTTP 缓存")
+            return True
+        except Exception as e:
+            print(f"[日志] 清空浏览器缓存失败: {e}")
+            return False
+
+    def profile_cleanup_due(self) -> bool:
+        last = self._load_state().get("last_profile_cleanup", 0)
+        return time.time() - last >= self.config.profile_cleanup_interval
+
+    def cleanup_profile_if_due(self) -> int:
+        """浏览器关闭期间调用：到期时清理配置目录缓存"""
+        if not os.path.isdir(self.profile_dir) or not self.profile_cleanup_due():
+            return 0
+        freed = cleanup_profile(self.profile_dir)
+        state = self._load_state()
+        state["last_profile_cleanup"] = time.time()
+        self._save_state(state)
+        return freed
@@ -0,0 +1,171 @@
+"""
+只读搜索结果卡片的快速列表模式
+
+搜索结果页的卡片上已经有标题、作者、封面、点赞数和笔记ID，趋势监控只需要这些时不必逐条打开笔记详情。
+这里边滚动结果流边提取：每一轮用一次 evaluate 取回当前渲染的全部卡片（提取规则 cards 段），
+按笔记ID去掉已经取过的，滚动一屏等待下一批加载；连续几轮没有新卡片时认为已到底。
+结果流是虚拟列表，滚出视口的卡片会被移除，所以每滚一轮就提取一次，而不是滚到底再统一提取。
+
+结果逐批追加到 data/listings/<关键词>_<时间>.jsonl。
+"""
+from typing import Any, AsyncIterator, Dict, List, Optional
+from datetime import datetime
+import argparse
+import asyncio
+import json
+import os
+import re
+import sys
+import time
+import urllib.parse
+
+import metrics
+from extraction_rules import extract_page, get_rules
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+LISTINGS_DIR = os.path.join(DATA_DIR, "listings")
+
+# 最多滚动几轮
+MAX_SCROLL_ROUNDS = int(os.environ.get("XHS_CARD_MAX_SCROLLS", 60))
+# 每次滚动后等待结果流加载的时间（秒）
+SCROLL_PAUSE = float(os.environ.get("XHS_CARD_SCROLL_PAUSE", 1.0))
+# 连续几轮滚动都没有新卡片时认为结果已到底
+MAX_IDLE_ROUNDS = 3
+
+
+def search_url(keywords: str) -> str:
+    """搜索结果页地址；关键词做 URL 编码（空格、&、#、中文等）"""
+    return f"https://www.xiaohongshu.com/search_result?keyword={urllib.parse.quote(keywords.strip(), safe='')}"
+
+
+async def wait_for_cards(page, timeout: float = 15) -> bool:
+    """等待第一批卡片渲染出来（代替固定等待），超时返回 False"""
+    try:
+        await page.wait_for_selector(", ".join(get_rules().config["cards"]["items"]), timeout=timeout * 1000)
+        return True
+    except Exception:
+        return False
+
+
+async def query_cards(page) -> list:
+    """按提取规则（cards.items）取回搜索结果页上当前渲染的卡片元素，点击爬取与 stream_cards 对卡片的认定一致"""
+    return await page.query_selector_all(", ".join(get_rules().config["cards"]["items"]))
+
+
+async def read_card_title(card) -> Optional[str]:
+    """按提取规则（cards.title）的顺序读取卡片元素的标题，取不到时返回 None"""
+    for selector in get_rules().config["cards"]["title"]:
+        el = await card.query_selector(selector)
+        title = (await el.text_content() or "").strip() if el else ""
+        if title:
+            return title
+    return None
+
+
+async def read_card_link(card) -> str:
+    """按提取规则（cards.links / note_id_pattern）读取卡片元素指向的笔记链接（绝对地址），取不到时返回空字符串"""
+    K = get_rules().config["cards"]
+    for selector in K["links"]:
+        for a in await card.query_selector_all(selector):
+            href = await a.get_attribute("href") or ""
+            if re.search(K["note_id_pattern"], href):
+                return href if href.startswith("http") else f"https://www.xiaohongshu.com{href}"
+    return ""
+
+
+async def stream_cards(page, limit: Optional[int] = None,
+                       rounds: int = MAX_SCROLL_ROUNDS) -> AsyncIterator[List[Dict[str, Any]]]:
+    """
+    逐轮产出新出现的卡片（按笔记ID去重，位置从 1 开始编号）；
+    limit 为总条数上限（None 表示不限），最多滚动 rounds 轮
+    """
+    seen = set()
+    idle = 0
+    for _ in range(rounds + 1):
+        data = await extract_page(page, fields=False, cards=True)
+        batch = []
+        for card in data.get("卡片", []):
+            if card["笔记ID"] in seen:
+                continue
+            seen.add(card["笔记ID"])
+            card["位置"] = len(seen)
+            batch.append(card)
+            if limit is not None and len(seen) >= limit:
+                break
+        if batch:
+            idle = 0
+            metrics.inc("card_batches_total")
+            yield batch
+        else:
+            idle += 1
+            if idle >= MAX_IDLE_ROUNDS:
+                break
+        if limit is not None and len(seen) >= limit:
+            break
+        await page.evaluate("window.scrollBy(0, window.innerHeight * 2)")
+        await asyncio.sleep(SCROLL_PAUSE)
+
+
+class ListingFile:
+    """
+    一次列表抓取的结果文件（JSON Lines），每批追加
+    """
+
+    def __init__(self, keywords: str, root: Optional[str] = None):
+        root = root or LISTINGS_DIR
+        os.makedirs(root, exist_ok=True)
+        safe = re.sub(r'\W+', '_', keywords)[:30] or "listing"
+        self.path = os.path.join(root, f"{safe}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl")
+        self.count = 0
+
+    def append(self, batch: List[Dict[str, Any]]) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            for card in batch:
+                f.write(json.dumps(card, ensure_ascii=False) + "\n")
+        self.count += len(batch)
+
+
+async def collect_cards(page, keywords: str, limit: Optional[int] = None,
+                        rounds: int = MAX_SCROLL_ROUNDS) -> Dict[str, Any]:
+    """
+    在已打开的搜索结果页上收集卡片：逐批写入列表文件，返回全部卡片、文件路径和耗时
+    """
+    start = time.monotonic()
+    listing = ListingFile(keywords)
+    crawled_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    cards: List[Dict[str, Any]] = []
+    async for batch in stream_cards(page, limit, rounds):
+        for card in batch:
+            card["关键词"] = keywords
+            card["抓取时间"] = crawled_at
+        listing.append(batch)
+        cards.extend(batch)
+    metrics.inc("cards_listed_total", len(cards))
+    return {"关键词": keywords, "笔记数": len(cards), "文件": listing.path,
+            "耗时s": round(time.monotonic() - start, 2), "笔记": cards}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="只读搜索结果卡片的快速列表（不打开笔记详情）")
+    parser.add_argument("keywords", help="搜索关键词")
+    parser.add_argument("--limit", type=int, default=200, help="最多列出的笔记数")
+    parser.add_argument("--rounds", type=int, default=MAX_SCROLL_ROUNDS, help="最多滚动几轮")
+    args = parser.parse_args(argv)
+
+    import xiaohongshu_mcp as core
+
+    async def run():
+        if not await core.ensure_browser():
+            print("请先在打开的浏览器中登录小红书账号", file=sys.stderr)
+            return None
+        return await core.list_notes_on_page(core.main_page, args.keywords, args.limit, args.rounds)
+    result = asyncio.run(run())
+    if result is None:
+        return 1
+    result.pop("笔记")
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
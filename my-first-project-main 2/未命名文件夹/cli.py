@@ -0,0 +1,87 @@
+"""
+小红书爬虫命令行入口
+
+用法：
+    python cli.py crawl "关键词 笔记数 评论数"
+    python cli.py list "关键词" [--limit 200]
+    python cli.py batch [-f 关键词文件] [--workers 3] [--out notes.jsonl] [--headless]
+    python cli.py classify [--summary]
+    python cli.py keywords update | extract "文本"
+    python cli.py export [--format csv] [--full]
+    python cli.py stats rebuild | show
+    python cli.py archive list | reextract [--out 文件]
+    python cli.py dedup rebuild | clusters
+    python cli.py search rebuild | query "检索词" | stats
+    python cli.py time backfill | recent [关键词] [--days 7] | parse "3天前"
+    python cli.py traces list [--job 任务] | prune [--budget-mb 500]
+    python cli.py engagement track 笔记ID... | list | capture [--force] | run | show [笔记ID...] [--hours 72]
+
+各子命令只导入自己需要的模块，不会加载 Flask / FastMCP。
+"""
+from typing import List, Optional
+import asyncio
+import importlib
+import sys
+
+# 子命令 -> (模块, 说明)；模块需提供 main(argv)
+SUBCOMMANDS = {
+    "list": ("card_listing", "只读搜索结果卡片的快速列表（不打开笔记详情）"),
+    "batch": ("batch_crawl", "无界面批量爬取，按 JSONL 输出每条笔记"),
+    "classify": ("domain_classifier", "对已爬取笔记批量做领域分类"),
+    "keywords": ("keyword_extractor", "关键词提取 / 语料 IDF 统计"),
+    "export": ("dataset_export", "导出 Parquet/CSV 数据集"),
+    "stats": ("note_stats", "语料统计聚合"),
+    "archive": ("html_archive", "HTML 快照归档与离线重新提取"),
+    "dedup": ("near_duplicates", "近重复笔记索引与聚类"),
+    "search": ("search_index", "本地全文检索索引"),
+    "time": ("time_index", "发布时间规整与按时间查询"),
+    "engagement": ("engagement", "笔记互动数时间序列"),
+    "traces": ("trace_capture", "失败现场的 Playwright 追踪文件"),
+}
+
+
+def run_crawl(argv: List[str]) -> int:
+    """按 "关键词 笔记数 评论数" 格式爬取一个关键词"""
+    import xiaohongshu_mcp as core
+
+    keywords, note_limit, comment_limit = core.parse_user_input(" ".join(argv))
+    if not keywords:
+        print('用法: python cli.py crawl "关键词 笔记数 评论数"', file=sys.stderr)
+        return 2
+
+    async def run_crawler():
+        if not await core.ensure_browser():
+            print("请先在打开的浏览器中登录小红书账号", file=sys.stderr)
+            return 1
+        await core.crawl_notes_by_click(core.main_page, keywords, note_limit, comment_limit)
+        return 0
+
+    return asyncio.run(run_crawler())
+
+
+def print_usage() -> None:
+    print(__doc__.strip())
+    print("\n子命令：")
+    print("  crawl      爬取一个关键词并保存到 scraped_notes")
+    for name, (_, help_text) in SUBCOMMANDS.items():
+        print(f"  {name:<10} {help_text}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if not argv or argv[0] in ("-h", "--help"):
+        print_usage()
+        return 0
+    command, rest = argv[0], argv[1:]
+    if command == "crawl":
+        return run_crawl(rest)
+    if command not in SUBCOMMANDS:
+        print(f"未知子命令: {command}", file=sys.stderr)
+        print_usage()
+        return 2
+    module = importlib.import_module(SUBCOMMANDS[command][0])
+    return module.main(rest)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
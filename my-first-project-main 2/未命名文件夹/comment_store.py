@@ -0,0 +1,198 @@
+"""
+树形评论的存储与查询
+
+评论按 (笔记ID, 评论ID) 存放在 data/comments.db 中，每条记录父评论ID和所属楼层（thread），
+用户名和用户ID只在 users 表中存一份，评论表只存整数引用；threads 表汇总每个楼层的
+楼主点赞数、回复数和总点赞数，并在 (笔记ID, 点赞数) 上建索引，
+"按点赞取前 N 个楼层" 只需要一次索引扫描，与笔记的评论总数无关。
+"""
+from typing import Any, Dict, Iterable, List, Optional
+import hashlib
+import os
+import sqlite3
+import threading
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+COMMENTS_DB_PATH = os.path.join(DATA_DIR, "comments.db")
+
+# 抓取时的默认树形限制：回复层数和每条评论最多保留的直接回复数
+MAX_DEPTH = int(os.environ.get("XHS_COMMENT_MAX_DEPTH", 2))
+MAX_FANOUT = int(os.environ.get("XHS_COMMENT_MAX_FANOUT", 50))
+
+
+def synthetic_comment_id(note_id: str, comment: Dict[str, Any]) -> str:
+    """页面上没有评论ID时，按笔记、用户和内容生成稳定的ID"""
+    raw = f"{note_id}|{comment.get('用户名', '')}|{comment.get('内容', '')}"
+    return "h" + hashlib.blake2b(raw.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def build_tree(comments: Iterable[Dict[str, Any]], max_depth: Optional[int] = None,
+               max_fanout: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    把带父评论ID的扁平评论列表组装成嵌套树（回复放在 "回复" 字段中）；
+    超过 max_depth 层或超过 max_fanout 条的直接回复会被丢弃，找不到父评论的当作顶层评论
+    """
+    nodes = {}
+    order = []
+    for c in comments:
+        node = dict(c, 回复=[])
+        nodes[node["评论ID"]] = node
+        order.append(node)
+    roots = []
+    for node in order:
+        parent = nodes.get(node.get("父评论ID") or "")
+        if parent is None or parent is node:
+            node["深度"] = 0
+            roots.append(node)
+            continue
+        node["深度"] = parent["深度"] + 1
+        if max_depth is not None and node["深度"] > max_depth:
+            continue
+        if max_fanout is not None and len(parent["回复"]) >= max_fanout:
+            continue
+        parent["回复"].append(node)
+    return roots
+
+
+class CommentStore:
+    """
+    按笔记保存评论树
+    """
+
+    def __init__(self, db_path: str = COMMENTS_DB_PATH):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY, user_id TEXT NOT NULL, name TEXT NOT NULL, UNIQUE (user_id, name));
+            CREATE TABLE IF NOT EXISTS comments (
+                note_id TEXT NOT NULL, comment_id TEXT NOT NULL, parent_id TEXT, thread_id TEXT NOT NULL,
+                user INTEGER, content TEXT, time_text TEXT, ts INTEGER, likes INTEGER NOT NULL DEFAULT 0,
+                depth INTEGER NOT NULL DEFAULT 0, seq INTEGER NOT NULL,
+                PRIMARY KEY (note_id, comment_id)) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_comments_thread ON comments (note_id, thread_id, seq);
+            CREATE TABLE IF NOT EXISTS threads (
+                note_id TEXT NOT NULL, thread_id TEXT NOT NULL, likes INTEGER NOT NULL, replies INTEGER NOT NULL,
+                total_likes INTEGER NOT NULL, PRIMARY KEY (note_id, thread_id)) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_threads_likes ON threads (note_id, likes DESC);
+        """)
+        self._user_ids: Dict[tuple, int] = {}
+
+    def _user(self, user_id: str, name: str) -> int:
+        key = (user_id or "", name or "")
+        uid = self._user_ids.get(key)
+        if uid is None:
+            self.conn.execute("INSERT OR IGNORE INTO users (user_id, name) VALUES (?, ?)", key)
+            uid = self.conn.execute("SELECT id FROM users WHERE user_id = ? AND name = ?", key).fetchone()[0]
+            self._user_ids[key] = uid
+        return uid
+
+    def _insert(self, note_id: str, comments: List[Dict[str, Any]], start_seq: int = 0) -> int:
+        """写入一批评论并重算涉及楼层的汇总（调用方持有锁和事务）"""
+        rows = []
+        thread_of: Dict[str, str] = {}
+        for seq, c in enumerate(comments, start_seq):
+            cid = c.get("评论ID") or synthetic_comment_id(note_id, c)
+            parent = c.get("父评论ID") or ""
+            thread = thread_of.get(parent) if parent else cid
+            if thread is None:
+                # 父评论在之前的批次里时从库中查所属楼层，查不到时当作独立楼层
+                row = self.conn.execute("SELECT thread_id FROM comments WHERE note_id = ? AND comment_id = ?",
+                                        (note_id, parent)).fetchone()
+                thread = row[0] if row else cid
+            thread_of[cid] = thread
+            rows.append((note_id, cid, parent or None, thread, self._user(c.get("用户ID", ""), c.get("用户名", "")),
+                         c.get("内容", ""), c.get("时间", ""), c.get("时间戳"), int(c.get("点赞数") or 0),
+                         int(c.get("深度") or 0), seq))
+        # 同一评论ID重复写入时评论行被替换，汇总不能再累加一次：按 comments 表重算涉及的楼层（含被替换评论原来的楼层）
+        touched = set(thread_of.values())
+        ids = list(thread_of)
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            touched.update(r[0] for r in self.conn.execute(
+                f"SELECT thread_id FROM comments WHERE note_id = ? AND comment_id IN ({','.join('?' * len(chunk))})",
+                (note_id, *chunk)))
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO comments (note_id, comment_id, parent_id, thread_id, user, content, "
+            "time_text, ts, likes, depth, seq) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        for thread in touched:
+            self.conn.execute("DELETE FROM threads WHERE note_id = ? AND thread_id = ?", (note_id, thread))
+            self.conn.execute(
+                "INSERT INTO threads (note_id, thread_id, likes, replies, total_likes) "
+                "SELECT note_id, thread_id, COALESCE(MAX(CASE WHEN comment_id = thread_id THEN likes END), 0), "
+                "SUM(comment_id != thread_id), SUM(likes) FROM comments "
+                "WHERE note_id = ? AND thread_id = ? GROUP BY note_id, thread_id", (note_id, thread))
+        return len(rows)
+
+    def save(self, note_id: str, comments: List[Dict[str, Any]]) -> int:
+        """
+        保存一条笔记的评论（扁平列表，含 评论ID/父评论ID），替换该笔记已有的评论树，返回保存条数
+        """
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM comments WHERE note_id = ?", (note_id,))
+            self.conn.execute("DELETE FROM threads WHERE note_id = ?", (note_id,))
+            return self._insert(note_id, comments)
+
+    def append(self, note_id: str, comments: List[Dict[str, Any]], start_seq: int) -> int:
+        """
+        追加一批评论（流式抓取时每批调用一次，每批一个事务），start_seq 为这批第一条的序号
+        """
+        with self._lock, self.conn:
+            return self._insert(note_id, comments, start_seq)
+
+    def clear(self, note_id: str) -> None:
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM comments WHERE note_id = ?", (note_id,))
+            self.conn.execute("DELETE FROM threads WHERE note_id = ?", (note_id,))
+
+    def _rows(self, sql: str, params: tuple) -> List[Dict[str, Any]]:
+        cursor = self.conn.execute(
+            "SELECT c.comment_id, c.parent_id, u.name, u.user_id, c.content, c.time_text, c.ts, c.likes, c.depth "
+            "FROM comments c LEFT JOIN users u ON u.id = c.user " + sql, params)
+        return [{"评论ID": r[0], "父评论ID": r[1] or "", "用户名": r[2] or "", "用户ID": r[3] or "",
+                 "内容": r[4], "时间": r[5], "时间戳": r[6], "点赞数": r[7], "深度": r[8]} for r in cursor]
+
+    def get_tree(self, note_id: str, max_depth: Optional[int] = None,
+                 max_fanout: Optional[int] = None) -> List[Dict[str, Any]]:
+        """返回一条笔记的完整评论树"""
+        with self._lock:
+            rows = self._rows("WHERE c.note_id = ? ORDER BY c.seq", (note_id,))
+        return build_tree(rows, max_depth, max_fanout)
+
+    def top_threads(self, note_id: str, n: int = 10, replies_per_thread: Optional[int] = None) -> List[Dict[str, Any]]:
+        """按楼主点赞数取前 n 个楼层，每个楼层附带其回复树"""
+        with self._lock:
+            thread_rows = self.conn.execute(
+                "SELECT thread_id, replies, total_likes FROM threads WHERE note_id = ? ORDER BY likes DESC LIMIT ?",
+                (note_id, n)).fetchall()
+            threads = [(self._rows("WHERE c.note_id = ? AND c.thread_id = ? ORDER BY c.seq", (note_id, thread_id)),
+                        replies, total_likes) for thread_id, replies, total_likes in thread_rows]
+        result = []
+        for rows, replies, total_likes in threads:
+            tree = build_tree(rows, max_fanout=replies_per_thread)
+            if tree:
+                root = tree[0]
+                root["回复数"] = replies
+                root["楼层总点赞"] = total_likes
+                result.append(root)
+        return result
+
+    def count(self, note_id: str) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM comments WHERE note_id = ?", (note_id,)).fetchone()[0]
+
+
+_store: Optional[CommentStore] = None
+_store_lock = threading.Lock()
+
+
+def get_comment_store() -> CommentStore:
+    """获取全局评论库（首次调用时打开）"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = CommentStore()
+    return _store
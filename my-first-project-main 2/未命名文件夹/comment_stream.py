@@ -0,0 +1,155 @@
+"""
+流式评论抓取
+
+评论区按批提取：每次 evaluate 只取还没有取过的评论（取过的节点在页面上打了本次抓取的标记），
+取完页面上已有的再点击 "查看更多" / "展开回复" 加载下一页。按节点标记而不是按位置继续，
+展开回复插入的新节点不会让后面的评论被跳过或重复。stream_comments 是一个异步生成器，
+每批评论产出后即可写入评论库或追加到 data/comment_spool/<笔记ID>.jsonl（每批 fsync 一次），
+内存里只保留当前一批；进程中途退出时已写入的批次仍在磁盘上。
+"""
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+import asyncio
+import json
+import os
+import uuid
+
+import metrics
+from comment_store import MAX_DEPTH, MAX_FANOUT
+from extraction_rules import extract_page, get_rules
+from post_processing import get_post_processor
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+SPOOL_DIR = os.path.join(DATA_DIR, "comment_spool")
+
+COMMENT_BATCH = int(os.environ.get("XHS_COMMENT_BATCH", 50))
+# 最多点击几轮 "查看更多"
+MAX_LOAD_ROUNDS = int(os.environ.get("XHS_COMMENT_MAX_ROUNDS", 8))
+# 连续几轮加载都没有新评论时认为评论区已到底
+MAX_IDLE_ROUNDS = 3
+
+
+async def scroll_to_comments(page) -> None:
+    """按提取规则中的文本定位评论区并滚动过去"""
+    for text in get_rules().action("comment_section"):
+        try:
+            locator = page.get_by_text(text, exact=False).first
+            if await locator.count() > 0:
+                await locator.scroll_into_view_if_needed(timeout=5000)
+                await asyncio.sleep(2)
+                break
+        except Exception:
+            continue
+
+
+async def load_more_comments(page) -> None:
+    """向下滚动一段，并点击规则中的 "查看更多评论" / "展开回复" 按钮"""
+    rules = get_rules()
+    try:
+        await page.evaluate("window.scrollBy(0, 500)")
+        await asyncio.sleep(1)
+        for text in rules.action("more_comments") + rules.action("more_replies"):
+            try:
+                more_btn = page.locator(f"text={text}").first
+                if await more_btn.count() > 0 and await more_btn.is_visible():
+                    await more_btn.click()
+                    await asyncio.sleep(2)
+            except Exception:
+                continue
+    except Exception:
+        pass
+
+
+async def stream_comments(page, batch_size: int = COMMENT_BATCH, rounds: int = MAX_LOAD_ROUNDS,
+                          limit: Optional[int] = None,
+                          tree: bool = False) -> AsyncIterator[Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]]:
+    """
+    逐批产出 (评论, 评论树节点)，每批最多 batch_size 条评论；最多加载 rounds 轮 "更多"，
+    limit 为总条数上限（None 表示不限）。tree 为 True 时同一次提取还返回这批新出现的评论树节点
+    （带评论ID、父评论ID，可以直接追加到评论库），否则节点列表为空
+    """
+    await scroll_to_comments(page)
+    mark, selector = uuid.uuid4().hex[:12], None
+    total, loaded, idle = 0, 0, 0
+    while limit is None or total < limit:
+        want = batch_size if limit is None else min(batch_size, limit - total)
+        data = await extract_page(page, fields=False, comments=True, comment_limit=want, tree=tree,
+                                  max_depth=MAX_DEPTH, max_fanout=MAX_FANOUT,
+                                  comment_mark=mark, comment_selector=selector)
+        batch = data["评论"]
+        nodes = data.get("评论树") or []
+        selector = data["评论选择器"] or selector
+        if batch or nodes:
+            total += len(batch)
+            idle = 0
+            metrics.inc("comment_batches_total")
+            yield batch, nodes
+        if len(batch) >= want:
+            # 这一批取满了，页面上可能还有没取的，先不加载
+            continue
+        if loaded >= rounds:
+            break
+        idle = idle if batch or nodes else idle + 1
+        if idle >= MAX_IDLE_ROUNDS:
+            break
+        await load_more_comments(page)
+        loaded += 1
+
+
+class CommentSpool:
+    """
+    一条笔记的评论追加文件（JSON Lines），每批写入后 fsync
+    """
+
+    def __init__(self, note_id: str, root: str = SPOOL_DIR, truncate: bool = True):
+        os.makedirs(root, exist_ok=True)
+        self.path = os.path.join(root, f"{note_id or 'unknown'}.jsonl")
+        self.count = 0
+        if truncate:
+            open(self.path, "w", encoding="utf-8").close()
+
+    def append(self, batch: List[Dict[str, Any]]) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            for c in batch:
+                f.write(json.dumps(c, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.count += len(batch)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        """逐条读回已写入的评论；崩溃时写了一半的最后一行会被跳过"""
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+async def collect_comments(page, note_id: str, limit: Optional[int] = None, preview: int = 0,
+                           rounds: int = MAX_LOAD_ROUNDS, to_store: bool = False) -> Dict[str, Any]:
+    """
+    流式抓取评论：每批追加到追加文件（to_store 为 True 时同时把这批的评论树节点追加到评论库，
+    替换该笔记原有评论），返回总数、文件路径和前 preview 条评论
+    """
+    spool = CommentSpool(note_id)
+    store = None
+    if to_store and note_id:
+        from comment_store import get_comment_store
+        store = get_comment_store()
+        store.clear(note_id)
+    head: List[Dict[str, Any]] = []
+    post = get_post_processor()
+    stored = 0
+    async for batch, nodes in stream_comments(page, rounds=rounds, limit=limit, tree=store is not None):
+        # 写文件 + fsync 和写评论库在后处理线程池中执行
+        if batch:
+            await post.run(spool.append, batch, label="comment_spool")
+        if store is not None and nodes:
+            try:
+                stored += await post.run(store.append, note_id, nodes, stored, label="comment_store")
+            except Exception as e:
+                print(f"[日志] 评论写入评论库失败: {e}")
+        if len(head) < preview:
+            head.extend(batch[:preview - len(head)])
+    metrics.inc("comments_streamed_total", spool.count)
+    return {"笔记ID": note_id, "评论数": spool.count, "文件": spool.path, "评论": head}
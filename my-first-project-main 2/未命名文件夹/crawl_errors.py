@@ -0,0 +1,199 @@
+"""
+抓取错误分类、重试策略和熔断器
+
+- 错误分类：导航超时、登录墙、选择器未命中、弹窗关不掉，其余归为未知错误
+- 重试：按错误类型决定是否重试、最多几次，退避时间带随机抖动（full jitter）
+- 熔断：一段时间内失败次数过多时暂停整个任务，冷却后放行一次试探请求，成功才恢复
+"""
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+from collections import deque
+import asyncio
+import os
+import random
+import time
+
+import metrics
+
+# 同一条笔记最多尝试几次，超过后记为已处理并跳过，避免反复卡在同一张卡片上
+MAX_NOTE_ATTEMPTS = int(os.environ.get("XHS_MAX_NOTE_ATTEMPTS", 3))
+
+
+class CrawlError(Exception):
+    """抓取错误基类；kind 用于重试策略和指标标签"""
+    kind = "unknown"
+    retryable = True
+
+
+class NavigationTimeout(CrawlError):
+    """页面导航或等待加载超时"""
+    kind = "navigation_timeout"
+
+
+class LoginWallError(CrawlError):
+    """落在登录墙上，需要重新登录，重试没有意义"""
+    kind = "login_wall"
+    retryable = False
+
+
+class SelectorMiss(CrawlError):
+    """页面加载了但找不到需要的元素（卡片、标题、正文等）"""
+    kind = "selector_miss"
+
+
+class ModalStuck(CrawlError):
+    """笔记弹窗无法关闭，需要重新打开搜索页恢复"""
+    kind = "modal_stuck"
+
+
+def classify_error(exc: BaseException) -> CrawlError:
+    """把任意异常归类为 CrawlError（Playwright 的超时按类名识别，避免导入 playwright）"""
+    if isinstance(exc, CrawlError):
+        return exc
+    if isinstance(exc, asyncio.TimeoutError) or type(exc).__name__ == "TimeoutError":
+        error: CrawlError = NavigationTimeout(str(exc))
+    else:
+        error = CrawlError(f"{type(exc).__name__}: {exc}")
+    error.__cause__ = exc
+    return error
+
+
+class RetryPolicy:
+    """
+    按错误类型配置的重试次数和退避时间
+
+    Args:
+        max_attempts: 每种错误类型的最大尝试次数（含第一次）
+        base_delay: 第 n 次重试前等待 random(0, min(max_delay, base_delay * 2^(n-1))) 秒
+    """
+
+    DEFAULT_ATTEMPTS = {
+        NavigationTimeout.kind: 3,
+        SelectorMiss.kind: 2,
+        ModalStuck.kind: 2,
+        CrawlError.kind: 2,
+    }
+
+    def __init__(self, max_attempts: Optional[Dict[str, int]] = None, base_delay: float = 2.0,
+                 max_delay: float = 30.0):
+        self.max_attempts = dict(self.DEFAULT_ATTEMPTS, **(max_attempts or {}))
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def attempts_for(self, error: CrawlError) -> int:
+        if not error.retryable:
+            return 1
+        return self.max_attempts.get(error.kind, self.max_attempts[CrawlError.kind])
+
+    def delay(self, attempt: int) -> float:
+        """第 attempt 次失败后的退避时间（full jitter）"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+class CircuitBreaker:
+    """
+    失败率熔断器：window 秒内失败达到 threshold 次即打开，暂停 cooldown 秒；
+    冷却结束后进入半开状态放行一次试探，成功则关闭，失败则重新打开
+    """
+
+    def __init__(self, name: str, threshold: Optional[int] = None, window: Optional[float] = None,
+                 cooldown: Optional[float] = None):
+        self.name = name
+        self.threshold = threshold or int(os.environ.get("XHS_BREAKER_THRESHOLD", 5))
+        self.window = window or float(os.environ.get("XHS_BREAKER_WINDOW", 60))
+        self.cooldown = cooldown or float(os.environ.get("XHS_BREAKER_COOLDOWN", 120))
+        self.state = "closed"
+        self._failures: Deque[float] = deque()
+        self._opened_at = 0.0
+        self._probe_at = 0.0
+        self._report()
+
+    def _report(self) -> None:
+        metrics.set_gauge("circuit_open", 0 if self.state == "closed" else 1, breaker=self.name)
+
+    def _open(self) -> None:
+        self.state = "open"
+        self._opened_at = time.monotonic()
+        metrics.inc("circuit_opens_total", breaker=self.name)
+        metrics.record_event("circuit_open", breaker=self.name, failures=len(self._failures))
+        print(f"[日志] 失败过多，熔断器 {self.name} 打开，暂停 {self.cooldown:.0f} 秒")
+        self._report()
+
+    def remaining(self) -> float:
+        """打开状态下距离可以试探还有几秒"""
+        if self.state != "open":
+            return 0.0
+        return max(0.0, self._opened_at + self.cooldown - time.monotonic())
+
+    async def wait(self) -> None:
+        """
+        熔断器打开时等待冷却结束；冷却结束后第一个调用方作为试探放行，
+        其余调用方等到试探有结果（试探方一直没有结果时，过一个冷却期再放行下一个）
+        """
+        while self.state != "closed":
+            now = time.monotonic()
+            if self.state == "open" and self.remaining() <= 0 or \
+                    self.state == "half_open" and now - self._probe_at >= self.cooldown:
+                self.state = "half_open"
+                self._probe_at = now
+                print(f"[日志] 熔断器 {self.name} 冷却结束，试探恢复")
+                return
+            await asyncio.sleep(min(self.remaining() or 1, 5))
+
+    def record_success(self) -> None:
+        if self.state != "closed":
+            print(f"[日志] 熔断器 {self.name} 已恢复")
+        self.state = "closed"
+        self._failures.clear()
+        self._report()
+
+    def record_failure(self) -> None:
+        now = time.monotonic()
+        if self.state == "half_open":
+            self._open()
+            return
+        self._failures.append(now)
+        while self._failures and now - self._failures[0] > self.window:
+            self._failures.popleft()
+        if self.state == "closed" and len(self._failures) >= self.threshold:
+            self._open()
+
+
+async def call_with_retry(func: Callable[[], Awaitable[Any]], label: str = "",
+                          policy: Optional[RetryPolicy] = None,
+                          breaker: Optional[CircuitBreaker] = None,
+                          on_error: Optional[Callable[[CrawlError], Awaitable[None]]] = None) -> Any:
+    """
+    调用 func，失败时按错误类型重试；每次尝试前等待熔断器放行。
+    最终失败时抛出归类后的 CrawlError。on_error 可用于在重试前做恢复（如重新打开页面）
+    """
+    policy = policy or default_policy
+    attempt = 0
+    while True:
+        attempt += 1
+        if breaker is not None:
+            await breaker.wait()
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error = classify_error(e)
+            metrics.inc("crawl_errors_total", kind=error.kind)
+            if breaker is not None:
+                breaker.record_failure()
+            if attempt >= policy.attempts_for(error):
+                metrics.inc("crawl_gave_up_total", kind=error.kind)
+                raise error
+            delay = policy.delay(attempt)
+            print(f"[日志] {label} 第{attempt}次失败（{error.kind}: {e}），{delay:.1f}s 后重试")
+            metrics.inc("crawl_retries_total", kind=error.kind)
+            if on_error is not None:
+                await on_error(error)
+            await asyncio.sleep(delay)
+            continue
+        if breaker is not None:
+            breaker.record_success()
+        return result
+
+
+default_policy = RetryPolicy(base_delay=float(os.environ.get("XHS_RETRY_BASE_DELAY", 2)))
@@ -0,0 +1,295 @@
+"""
+把已爬取语料导出为列式数据集（Parquet / CSV）
+
+- 笔记、评论、标签分三张表，每张表按抓取日期分区：exports/<表>/crawl_date=YYYY-MM-DD/part-*.parquet
+- 逐条读取笔记、按块写出，内存占用只与 chunk_size 有关，与语料规模无关
+- 增量导出按文件记录清单（文件名 -> 修改时间、大小、抓取日期）：笔记新增、修改、被覆盖或删除时，
+  重写受影响日期分区中本格式的全部分区文件，分区里不会留下旧版本的行
+- 新分区先写到暂存目录，再把“待提交”记录原子写入状态文件后替换到位；中途崩溃时未提交的暂存直接丢弃，
+  已记录待提交的在下次导出时先补完替换，数据集不会出现写了一半的分区
+"""
+from typing import Any, Dict, List, Optional, Tuple
+import argparse
+import json
+import os
+import shutil
+import sys
+from datetime import datetime
+
+import pandas as pd
+
+from notes_corpus import NOTES_DIR, crawl_date, list_note_files, load_note_file
+from time_index import format_utc, normalize_time, to_epoch
+
+EXPORT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "exports")
+EXPORT_STATE_FILE = "_export_state.json"
+STAGING_DIR = "_staging"
+TABLES = ("notes", "comments", "tags")
+EXPORT_FORMATS = ("parquet", "csv")
+DEFAULT_CHUNK_SIZE = 5000
+
+
+def _note_rows(note: Dict[str, Any]) -> Dict[str, List[Dict[str, Any]]]:
+    """把一条笔记记录拆成三张表的行"""
+    filename = note["文件名"]
+    crawled = to_epoch(note.get("抓取时间")) or note["mtime"]
+    published, precision = normalize_time(note.get("发布时间"), crawled)
+    note_row = {
+        "文件名": filename,
+        "笔记ID": note.get("笔记ID", ""),
+        "标题": note.get("标题", ""),
+        "作者": note.get("作者", ""),
+        "发布时间": note.get("发布时间", ""),
+        "发布时间UTC": format_utc(published),
+        "发布时间精度": precision,
+        "搜索关键词": note.get("搜索关键词", ""),
+        "链接": note.get("链接", ""),
+        "抓取时间": note.get("抓取时间", ""),
+        "内容": note.get("内容", ""),
+        "标签数": len(note.get("标签") or []),
+        "评论数": len(note.get("评论") or []),
+        "图片": "、".join(note.get("图片") or []),
+        "文件修改时间": datetime.fromtimestamp(note["mtime"]).strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    comment_rows = []
+    for i, c in enumerate(note.get("评论") or [], 1):
+        c_time, c_precision = normalize_time(c.get("时间"), crawled)
+        comment_rows.append({"文件名": filename, "笔记ID": note_row["笔记ID"], "序号": i,
+                             "用户名": c.get("用户名", ""), "时间": c.get("时间", ""),
+                             "时间UTC": format_utc(c_time), "时间精度": c_precision, "内容": c.get("内容", "")})
+    tag_rows = [
+        {"文件名": filename, "笔记ID": note_row["笔记ID"], "标签": tag}
+        for tag in note.get("标签") or []
+    ]
+    return {"notes": [note_row], "comments": comment_rows, "tags": tag_rows}
+
+
+class _PartitionWriter:
+    """
+    按 (表, 抓取日期) 缓冲行，缓冲总行数达到 chunk_size 时全部落盘
+    """
+
+    def __init__(self, out_dir: str, fmt: str, chunk_size: int, run_id: str):
+        self.out_dir = out_dir
+        self.fmt = fmt
+        self.chunk_size = chunk_size
+        self.run_id = run_id
+        self.buffers: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+        self.buffered = 0
+        self.part_seq: Dict[Tuple[str, str], int] = {}
+        self.files: List[str] = []
+        self.rows: Dict[str, int] = {table: 0 for table in TABLES}
+
+    def add(self, table: str, date: str, rows: List[Dict[str, Any]]) -> None:
+        if not rows:
+            return
+        self.buffers.setdefault((table, date), []).extend(rows)
+        self.buffered += len(rows)
+        self.rows[table] += len(rows)
+        if self.buffered >= self.chunk_size:
+            self.flush()
+
+    def flush(self) -> None:
+        for key, rows in self.buffers.items():
+            if rows:
+                self._write(key, rows)
+        self.buffers = {}
+        self.buffered = 0
+
+    def _write(self, key: Tuple[str, str], rows: List[Dict[str, Any]]) -> None:
+        table, date = key
+        part_dir = os.path.join(self.out_dir, table, f"crawl_date={date}")
+        os.makedirs(part_dir, exist_ok=True)
+        seq = self.part_seq.get(key, 0)
+        self.part_seq[key] = seq + 1
+        path = os.path.join(part_dir, f"part-{self.run_id}-{seq:05d}.{self.fmt}")
+        df = pd.DataFrame(rows)
+        if self.fmt == "parquet":
+            df.to_parquet(path, index=False)
+        else:
+            df.to_csv(path, index=False, encoding="utf-8-sig")
+        self.files.append(path)
+
+
+def _load_state(out_dir: str) -> Dict[str, Any]:
+    path = os.path.join(out_dir, EXPORT_STATE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_state(out_dir: str, state: Dict[str, Any]) -> None:
+    path = os.path.join(out_dir, EXPORT_STATE_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _check_format(fmt: str) -> None:
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"不支持的导出格式: {fmt}，可选: {', '.join(EXPORT_FORMATS)}")
+    if fmt == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            try:
+                import fastparquet  # noqa: F401
+            except ImportError:
+                raise ValueError("导出 Parquet 需要安装 pyarrow 或 fastparquet，或改用 csv 格式")
+
+
+def _file_key(path: str) -> List[int]:
+    """判断文件是否变化的依据：纳秒修改时间 + 大小（同一时间刻内重写的文件也能发现）"""
+    st = os.stat(path)
+    return [st.st_mtime_ns, st.st_size]
+
+
+def _existing_dates(out_dir: str) -> List[str]:
+    """数据集中已有的全部日期分区"""
+    dates = set()
+    for table in TABLES:
+        table_dir = os.path.join(out_dir, table)
+        if os.path.isdir(table_dir):
+            dates.update(name.split("=", 1)[1] for name in os.listdir(table_dir) if name.startswith("crawl_date="))
+    return sorted(dates)
+
+
+def _apply_pending(out_dir: str, fmt: str, state: Dict[str, Any]) -> None:
+    """
+    把暂存目录中已提交的分区替换到数据集中，然后写入新清单；可重复执行（崩溃后补完）
+    """
+    pending = state[fmt]["pending"]
+    staging = os.path.join(out_dir, STAGING_DIR, pending["run_id"])
+    for table in TABLES:
+        for date in pending["dates"]:
+            rel = os.path.join(table, f"crawl_date={date}")
+            live_dir = os.path.join(out_dir, rel)
+            new_files = set(pending["files"].get(rel, []))
+            if os.path.isdir(live_dir):
+                for name in os.listdir(live_dir):
+                    if name.endswith(f".{fmt}") and name not in new_files:
+                        os.remove(os.path.join(live_dir, name))
+            for name in new_files:
+                staged = os.path.join(staging, rel, name)
+                if os.path.exists(staged):
+                    os.makedirs(live_dir, exist_ok=True)
+                    os.replace(staged, os.path.join(live_dir, name))
+            if os.path.isdir(live_dir) and not os.listdir(live_dir):
+                os.rmdir(live_dir)
+    state[fmt] = {"files": pending["manifest"], "last_run": pending["run_id"]}
+    _save_state(out_dir, state)
+    shutil.rmtree(staging, ignore_errors=True)
+
+
+def export_dataset(fmt: str = "parquet", incremental: bool = True, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                   notes_dir: Optional[str] = None, out_dir: Optional[str] = None) -> Dict[str, Any]:
+    """
+    导出笔记、评论、标签三张表，返回本次导出的统计信息
+
+    Args:
+        fmt: parquet 或 csv
+        incremental: 为 True 时只重写有笔记新增、修改或删除的日期分区
+        chunk_size: 每次落盘的缓冲行数上限
+    """
+    _check_format(fmt)
+    out_dir = out_dir or EXPORT_DIR
+    os.makedirs(out_dir, exist_ok=True)
+    state = _load_state(out_dir)
+    if state.get(fmt, {}).get("pending"):
+        print("[日志] 补完上次中断的导出提交")
+        _apply_pending(out_dir, fmt, state)
+    # 上次崩溃在提交之前留下的暂存直接丢弃
+    shutil.rmtree(os.path.join(out_dir, STAGING_DIR), ignore_errors=True)
+    # 旧版本按水位线导出的数据集没有清单，第一次按全量重写
+    old_manifest: Dict[str, Dict[str, Any]] = state.get(fmt, {}).get("files") if incremental else None
+    full = old_manifest is None
+    old_manifest = old_manifest or {}
+
+    # 第一遍：找出新增、修改和删除的文件及其所在日期
+    manifest: Dict[str, Dict[str, Any]] = {}
+    paths: Dict[str, str] = {}
+    affected = set(_existing_dates(out_dir)) if full else set()
+    changed_notes = 0
+    for path in list_note_files(notes_dir or NOTES_DIR):
+        name = os.path.basename(path)
+        try:
+            key = _file_key(path)
+            old = old_manifest.get(name)
+            if old and old["key"] == key:
+                manifest[name] = old
+            else:
+                manifest[name] = {"key": key, "date": crawl_date(load_note_file(path))}
+                changed_notes += 1
+                affected.add(manifest[name]["date"])
+                if old:
+                    affected.add(old["date"])
+        except (OSError, UnicodeDecodeError) as e:
+            print(f"[日志] 导出时读取笔记失败 {path}: {e}")
+            continue
+        paths[name] = path
+    removed = [name for name in old_manifest if name not in manifest]
+    affected.update(old_manifest[name]["date"] for name in removed)
+    if full:
+        affected.update(entry["date"] for entry in manifest.values())
+
+    # 第二遍：受影响日期分区的全部笔记写入暂存目录
+    run_id = datetime.now().strftime("%Y%m%d%H%M%S%f")
+    staging = os.path.join(out_dir, STAGING_DIR, run_id)
+    writer = _PartitionWriter(staging, fmt, max(1, chunk_size), run_id)
+    exported_notes = 0
+    for name, entry in manifest.items():
+        if entry["date"] not in affected:
+            continue
+        try:
+            note = load_note_file(paths[name])
+        except (OSError, UnicodeDecodeError) as e:
+            print(f"[日志] 导出时读取笔记失败 {paths[name]}: {e}")
+            continue
+        for table, rows in _note_rows(note).items():
+            writer.add(table, entry["date"], rows)
+        exported_notes += 1
+    writer.flush()
+
+    # 提交：先原子记录待提交的分区和新清单，再替换分区
+    files: Dict[str, List[str]] = {}
+    for path in writer.files:
+        rel = os.path.relpath(os.path.dirname(path), staging)
+        files.setdefault(rel, []).append(os.path.basename(path))
+    state[fmt] = {**state.get(fmt, {}), "pending": {"run_id": run_id, "dates": sorted(affected),
+                                                     "files": files, "manifest": manifest}}
+    _save_state(out_dir, state)
+    _apply_pending(out_dir, fmt, state)
+    result = {
+        "格式": fmt,
+        "增量": not full,
+        "变化笔记数": changed_notes,
+        "删除笔记数": len(removed),
+        "重写分区": sorted(affected),
+        "导出笔记数": exported_notes,
+        "行数": writer.rows,
+        "文件数": len(writer.files),
+        "输出目录": out_dir,
+    }
+    print(f"[日志] 数据集导出完成: {json.dumps(result, ensure_ascii=False)}")
+    return result
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="把已爬取笔记导出为 Parquet/CSV 数据集")
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="parquet")
+    parser.add_argument("--full", action="store_true", help="全量重写（默认只重写有笔记变化的日期分区）")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--notes-dir", default=None)
+    parser.add_argument("--out-dir", default=None)
+    args = parser.parse_args(argv)
+    export_dataset(args.format, incremental=not args.full, chunk_size=args.chunk_size,
+                   notes_dir=args.notes_dir, out_dir=args.out_dir)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,253 @@
+"""
+基于 Aho–Corasick 自动机的笔记领域分类
+
+领域词典从 domain_keywords.json 读取（文件不存在时使用内置默认词典），
+词典文件修改后会在下一次分类时自动重新编译，无需重启服务。
+整篇文本只需小写一次、扫描一遍即可得到所有领域的命中情况。
+"""
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from collections import deque
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+DOMAIN_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "domain_keywords.json")
+
+# 内置默认词典，与 analyze_note 原先使用的热门领域关键词一致
+DEFAULT_DOMAIN_CONFIG: Dict[str, Any] = {
+    "version": 1,
+    "title_weight": 2.0,
+    "default_domain": "生活",
+    "domains": {
+        "美妆": ["口红", "粉底", "眼影", "护肤", "美妆", "化妆", "保湿", "精华", "面膜"],
+        "穿搭": ["穿搭", "衣服", "搭配", "时尚", "风格", "单品", "衣橱", "潮流"],
+        "美食": ["美食", "好吃", "食谱", "餐厅", "小吃", "甜点", "烘焙", "菜谱"],
+        "旅行": ["旅行", "旅游", "景点", "出行", "攻略", "打卡", "度假", "酒店"],
+        "母婴": ["宝宝", "母婴", "育儿", "儿童", "婴儿", "辅食", "玩具"],
+        "数码": ["数码", "手机", "电脑", "相机", "智能", "设备", "科技"],
+        "家居": ["家居", "装修", "家具", "设计", "收纳", "布置", "家装"],
+        "健身": ["健身", "运动", "瘦身", "减肥", "训练", "塑形", "肌肉"],
+        "AI": ["AI", "人工智能", "大模型", "编程", "开发", "技术", "Claude", "GPT"]
+    }
+}
+
+
+class AhoCorasick:
+    """
+    多模式串匹配自动机，构建一次后可对任意文本做单遍扫描
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns: List[str] = []
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[int]] = [[]]
+        for pattern in patterns:
+            if pattern:
+                self._add(pattern)
+        self._build()
+
+    def _add(self, pattern: str) -> None:
+        node = 0
+        for ch in pattern:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        self._out[node].append(len(self.patterns))
+        self.patterns.append(pattern)
+
+    def _build(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(ch, 0)
+                self._fail[child] = target if target != child else 0
+                # 合并后缀节点的输出，扫描时无需再沿 fail 链回溯
+                self._out[child].extend(self._out[self._fail[child]])
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int]]:
+        """产出 (结束位置, 模式串下标)"""
+        goto, fail, out = self._goto, self._fail, self._out
+        node = 0
+        for pos, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                for idx in out[node]:
+                    yield pos, idx
+
+    def count(self, text: str) -> List[int]:
+        """返回每个模式串在文本中的命中次数"""
+        counts = [0] * len(self.patterns)
+        for _, idx in self.iter_matches(text):
+            counts[idx] += 1
+        return counts
+
+
+class DomainClassifier:
+    """
+    把领域词典编译成一个自动机，按标题/正文加权统计各领域命中
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        self.version = config.get("version", 1)
+        self.title_weight = float(config.get("title_weight", 2.0))
+        self.default_domain = config.get("default_domain", "生活")
+        self.domains: Dict[str, List[str]] = dict(config.get("domains", {}))
+        # 同一个词可能属于多个领域，模式串去重后记录它对应的领域列表
+        keyword_domains: Dict[str, List[str]] = {}
+        for domain, keywords in self.domains.items():
+            for key in keywords:
+                key = key.lower().strip()
+                if key and domain not in keyword_domains.setdefault(key, []):
+                    keyword_domains[key].append(domain)
+        self._automaton = AhoCorasick(keyword_domains.keys())
+        self._pattern_domains = [keyword_domains[p] for p in self._automaton.patterns]
+
+    def _tally(self, text: str, weight: float, hits: Dict[str, Dict[str, Any]]) -> None:
+        if not text:
+            return
+        counts = self._automaton.count(text.lower())
+        for idx, n in enumerate(counts):
+            if not n:
+                continue
+            keyword = self._automaton.patterns[idx]
+            for domain in self._pattern_domains[idx]:
+                entry = hits.setdefault(domain, {"命中数": 0, "命中词": {}, "_weighted": 0.0})
+                entry["命中数"] += n
+                entry["命中词"][keyword] = entry["命中词"].get(keyword, 0) + n
+                entry["_weighted"] += n * weight
+
+    def classify(self, title: str = "", content: str = "") -> List[Dict[str, Any]]:
+        """
+        返回按得分降序排列的领域列表，每项包含 领域、命中数、命中词、得分；
+        没有任何命中时返回默认领域（得分为0）
+        """
+        hits: Dict[str, Dict[str, Any]] = {}
+        self._tally(title, self.title_weight, hits)
+        self._tally(content, 1.0, hits)
+        if not hits:
+            return [{"领域": self.default_domain, "命中数": 0, "命中词": {}, "得分": 0.0}]
+        total = sum(entry["_weighted"] for entry in hits.values())
+        results = []
+        for domain, entry in hits.items():
+            results.append({
+                "领域": domain,
+                "命中数": entry["命中数"],
+                "命中词": entry["命中词"],
+                "得分": round(entry["_weighted"] / total, 4)
+            })
+        results.sort(key=lambda r: (-r["得分"], -r["命中数"], r["领域"]))
+        return results
+
+    def classify_note(self, note: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """对笔记记录分类，标签视为正文的一部分参与匹配"""
+        tags = " ".join(note.get("标签") or [])
+        return self.classify(note.get("标题", ""), f"{note.get('内容', '')} {tags}")
+
+    def classify_batch(self, notes: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """
+        批量分类，逐条产出 {文件名, 标题, 领域, 领域详情}
+        """
+        for note in notes:
+            details = self.classify_note(note)
+            yield {
+                "文件名": note.get("文件名"),
+                "标题": note.get("标题"),
+                "领域": [d["领域"] for d in details],
+                "领域详情": details
+            }
+
+
+def load_domain_config(path: Optional[str] = None) -> Dict[str, Any]:
+    """读取领域词典配置，文件不存在时返回内置默认词典"""
+    path = path or DOMAIN_CONFIG_PATH
+    if not os.path.exists(path):
+        return DEFAULT_DOMAIN_CONFIG
+    with open(path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    if not isinstance(config.get("domains"), dict):
+        raise ValueError(f"领域词典格式错误，缺少 domains 字段: {path}")
+    return config
+
+
+# 已编译分类器的缓存，按配置文件路径和修改时间失效
+_classifier_cache: Dict[str, Tuple[Optional[float], DomainClassifier]] = {}
+_classifier_lock = threading.Lock()
+_last_check: Dict[str, float] = {}
+RELOAD_CHECK_INTERVAL = 1.0
+
+
+def get_classifier(path: Optional[str] = None) -> DomainClassifier:
+    """
+    获取已编译的分类器；词典文件变更后自动热加载，
+    为避免频繁 stat，同一路径每秒最多检查一次
+    """
+    path = path or DOMAIN_CONFIG_PATH
+    now = time.monotonic()
+    cached = _classifier_cache.get(path)
+    if cached and now - _last_check.get(path, 0) < RELOAD_CHECK_INTERVAL:
+        return cached[1]
+    with _classifier_lock:
+        _last_check[path] = now
+        mtime = os.path.getmtime(path) if os.path.exists(path) else None
+        cached = _classifier_cache.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        try:
+            classifier = DomainClassifier(load_domain_config(path))
+        except (OSError, ValueError) as e:
+            # 词典改坏时继续使用上一次成功编译的版本
+            if cached:
+                print(f"[日志] 领域词典加载失败，继续使用旧版本: {e}")
+                return cached[1]
+            raise
+        _classifier_cache[path] = (mtime, classifier)
+        if cached:
+            print(f"[日志] 领域词典已重新加载: {path}")
+        return classifier
+
+
+def classify_corpus(notes_dir: Optional[str] = None, config_path: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """对已爬取的全部笔记做一遍分类"""
+    from notes_corpus import iter_notes
+    classifier = get_classifier(config_path)
+    return classifier.classify_batch(iter_notes(notes_dir))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="对已爬取的笔记批量做领域分类，按行输出 JSON")
+    parser.add_argument("--notes-dir", default=None, help="笔记目录，默认 scraped_notes")
+    parser.add_argument("--config", default=None, help="领域词典 JSON，默认 domain_keywords.json")
+    parser.add_argument("--summary", action="store_true", help="只输出各领域的笔记数量")
+    args = parser.parse_args(argv)
+
+    distribution: Dict[str, int] = {}
+    total = 0
+    for result in classify_corpus(args.notes_dir, args.config):
+        total += 1
+        for domain in result["领域"]:
+            distribution[domain] = distribution.get(domain, 0) + 1
+        if not args.summary:
+            sys.stdout.write(json.dumps(result, ensure_ascii=False) + "\n")
+    if args.summary:
+        print(json.dumps({"笔记数": total, "领域分布": distribution}, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
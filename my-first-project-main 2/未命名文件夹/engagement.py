@@ -0,0 +1,356 @@
+"""
+笔记互动数（点赞 / 收藏 / 评论 / 分享）的时间序列
+
+被跟踪的笔记登记在 data/engagement/tracked.db 中，每条笔记分配一个固定的整数槽位；
+采样数据按列追加到定长的二进制文件（每列一个 .u32 文件，每个值 4 字节）：
+    ts.u32  slot.u32  likes.u32  collects.u32  comments.u32  shares.u32
+同一行号在各列文件中对应同一次采样，行按采样时间递增追加（进程内线程锁 + 跨进程文件锁 write.lock，
+http_api 和 mcp_server 同时采样时各列的行仍然对齐），
+查询时对 ts 列二分查找时间范围，只映射并扫描这一段，按 (槽位, 时间桶) 取桶内最后一个值完成降采样。
+缺失的计数记为 MISSING（0xFFFFFFFF），输出为 None。
+
+采样由 xiaohongshu_mcp.capture_engagement 通过轻量抓取（不渲染页面）完成，
+track_notes / get_engagement 工具和 cli.py engagement 子命令用于登记和查询。
+"""
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from array import array
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import argparse
+import json
+import mmap
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows 上没有 fcntl，只做进程内加锁
+    fcntl = None
+
+from notes_corpus import note_id_from_url
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+ENGAGEMENT_DIR = os.path.join(DATA_DIR, "engagement")
+
+# 列名 -> 输出字段名；ts 和 slot 之后的列与 fast_fetch 记录中 "互动" 的键一一对应
+COLUMNS = ("ts", "slot", "likes", "collects", "comments", "shares")
+COUNTERS = {"likes": "点赞", "collects": "收藏", "comments": "评论", "shares": "分享"}
+MISSING = 0xFFFFFFFF
+DEFAULT_INTERVAL = int(os.environ.get("XHS_ENGAGEMENT_INTERVAL", 3600))
+
+
+def _iso(epoch: int) -> str:
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class EngagementStore:
+    """
+    跟踪登记表 + 列式定长时间序列
+    """
+
+    def __init__(self, root: str = ENGAGEMENT_DIR):
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(root, "tracked.db"), check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS tracked (
+                note_id TEXT PRIMARY KEY, slot INTEGER NOT NULL UNIQUE, url TEXT NOT NULL,
+                interval INTEGER NOT NULL, added INTEGER NOT NULL, last_capture INTEGER NOT NULL DEFAULT 0,
+                active INTEGER NOT NULL DEFAULT 1);
+            CREATE INDEX IF NOT EXISTS idx_tracked_due ON tracked (active, last_capture);
+        """)
+        self._repair()
+
+    def _path(self, column: str) -> str:
+        return os.path.join(self.root, f"{column}.u32")
+
+    @contextmanager
+    def _write_lock(self):
+        """进程内线程锁 + 跨进程文件锁：读取最后一行、追加各列的整个过程互斥"""
+        with self._lock, open(os.path.join(self.root, "write.lock"), "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _repair(self) -> None:
+        """写入中途退出时各列长度可能不一致，截断到最短的完整行数（持有写锁，不会截断其他进程正在追加的行）"""
+        with self._write_lock():
+            sizes = [os.path.getsize(self._path(c)) if os.path.exists(self._path(c)) else 0 for c in COLUMNS]
+            rows = min(sizes) // 4
+            for column, size in zip(COLUMNS, sizes):
+                if size != rows * 4:
+                    with open(self._path(column), "r+b" if size else "wb") as f:
+                        f.truncate(rows * 4)
+                    print(f"[日志] 互动序列列 {column} 长度不一致，已截断到 {rows} 行")
+
+    @property
+    def rows(self) -> int:
+        """完整的行数（写入进行中时各列长度可能暂时不同，取最短的一列）"""
+        return min(os.path.getsize(self._path(c)) if os.path.exists(self._path(c)) else 0 for c in COLUMNS) // 4
+
+    # ---------- 登记 ----------
+
+    def track(self, items: Iterable[str], interval: int = DEFAULT_INTERVAL) -> List[str]:
+        """登记要跟踪的笔记（链接或笔记ID），已登记的更新采样间隔并重新启用，返回笔记ID列表"""
+        added = []
+        now = int(time.time())
+        with self._lock, self.conn:
+            next_slot = self.conn.execute("SELECT COALESCE(MAX(slot) + 1, 0) FROM tracked").fetchone()[0]
+            for item in items:
+                item = (item or "").strip()
+                note_id = note_id_from_url(item) or (item if item and "/" not in item else "")
+                if not note_id:
+                    continue
+                url = item if item.startswith("http") else f"https://www.xiaohongshu.com/explore/{note_id}"
+                updated = self.conn.execute(
+                    "UPDATE tracked SET interval = ?, active = 1, url = ? WHERE note_id = ?",
+                    (interval, url, note_id)).rowcount
+                if not updated:
+                    self.conn.execute(
+                        "INSERT INTO tracked (note_id, slot, url, interval, added) VALUES (?, ?, ?, ?, ?)",
+                        (note_id, next_slot, url, interval, now))
+                    next_slot += 1
+                added.append(note_id)
+        return added
+
+    def untrack(self, note_ids: Iterable[str]) -> int:
+        """停止跟踪（槽位和已有数据保留，重新登记时继续使用）"""
+        ids = [note_id_from_url(i) or i for i in note_ids]
+        with self._lock, self.conn:
+            return self.conn.executemany("UPDATE tracked SET active = 0 WHERE note_id = ?",
+                                         [(i,) for i in ids]).rowcount
+
+    def due(self, now: Optional[float] = None, force: bool = False) -> List[Tuple[str, str]]:
+        """到了采样时间的笔记 [(笔记ID, 链接)]；force 时返回全部启用的笔记"""
+        now = int(now or time.time())
+        if force:
+            rows = self.conn.execute("SELECT note_id, url FROM tracked WHERE active = 1")
+        else:
+            rows = self.conn.execute("SELECT note_id, url FROM tracked WHERE active = 1 AND last_capture + interval <= ?",
+                                     (now,))
+        return rows.fetchall()
+
+    def tracked(self) -> List[Dict[str, Any]]:
+        cursor = self.conn.execute(
+            "SELECT note_id, slot, url, interval, added, last_capture, active FROM tracked ORDER BY slot")
+        return [{"笔记ID": r[0], "槽位": r[1], "链接": r[2], "采样间隔s": r[3], "登记时间": _iso(r[4]),
+                 "最近采样": _iso(r[5]) if r[5] else "", "启用": bool(r[6])} for r in cursor]
+
+    def _slots(self, note_ids: Optional[Iterable[str]] = None) -> Dict[int, str]:
+        if note_ids is None:
+            rows = self.conn.execute("SELECT slot, note_id FROM tracked")
+            return dict(rows.fetchall())
+        result = {}
+        for item in note_ids:
+            note_id = note_id_from_url(item) or item
+            row = self.conn.execute("SELECT slot FROM tracked WHERE note_id = ?", (note_id,)).fetchone()
+            if row:
+                result[row[0]] = note_id
+        return result
+
+    # ---------- 写入 ----------
+
+    def record(self, samples: List[Tuple[str, int, Dict[str, Any]]]) -> int:
+        """
+        追加一批采样 [(笔记ID, 采样时间, 互动dict)]，互动dict 的键为 点赞/收藏/评论/分享；返回写入行数
+        """
+        samples = sorted(samples, key=lambda s: s[1])
+        with self._write_lock():
+            slot_of = dict(self.conn.execute("SELECT note_id, slot FROM tracked").fetchall())
+            columns = {c: array("I") for c in COLUMNS}
+            captured = []
+            # 各列按行号对齐，采样时间不能早于已写入的最后一行，否则二分查找失效
+            last_ts = self._last_ts()
+            for note_id, ts, counts in samples:
+                if note_id not in slot_of:
+                    continue
+                ts = max(int(ts), last_ts)
+                columns["ts"].append(ts)
+                columns["slot"].append(slot_of[note_id])
+                for column, name in COUNTERS.items():
+                    value = counts.get(name)
+                    columns[column].append(MISSING if value is None else max(0, min(int(value), MISSING - 1)))
+                captured.append((ts, note_id))
+            if not captured:
+                return 0
+            for column in COLUMNS:
+                with open(self._path(column), "ab") as f:
+                    columns[column].tofile(f)
+            with self.conn:
+                self.conn.executemany("UPDATE tracked SET last_capture = ? WHERE note_id = ?", captured)
+        return len(captured)
+
+    def mark_attempted(self, note_ids: Iterable[str], when: Optional[float] = None) -> None:
+        """采样失败的笔记同样推迟到下一个间隔，避免每个调度周期都重试"""
+        with self._lock, self.conn:
+            self.conn.executemany("UPDATE tracked SET last_capture = ? WHERE note_id = ?",
+                                  [(int(when or time.time()), i) for i in note_ids])
+
+    def _last_ts(self) -> int:
+        path = self._path("ts")
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if size < 4:
+            return 0
+        with open(path, "rb") as f:
+            f.seek(size - 4)
+            return array("I", f.read(4))[0]
+
+    # ---------- 查询 ----------
+
+    def series(self, note_ids: Optional[Iterable[str]] = None, since: Optional[float] = None,
+               until: Optional[float] = None, step: int = 3600) -> Dict[str, Any]:
+        """
+        降采样后的互动序列：每 step 秒一个点，取桶内最后一次采样；
+        返回 {笔记ID: {"时间": [...], "点赞": [...], ..., "增长": {...}}}
+        """
+        slot_to_note = self._slots(note_ids)
+        n = self.rows
+        if not slot_to_note or not n:
+            return {}
+        step = max(1, int(step))
+        maps = []
+        views: Dict[str, memoryview] = {}
+        try:
+            for column in COLUMNS:
+                with open(self._path(column), "rb") as f:
+                    mm = mmap.mmap(f.fileno(), n * 4, access=mmap.ACCESS_READ)
+                maps.append(mm)
+                views[column] = memoryview(mm).cast("I")
+            ts = views["ts"]
+            lo = self._bisect(ts, since, n) if since is not None else 0
+            hi = self._bisect(ts, until, n) if until is not None else n
+            result: Dict[str, Any] = {}
+            stamps: Dict[int, str] = {}
+            for (slot, bucket), i in _last_per_bucket(maps[0], maps[1], views, lo, hi, set(slot_to_note), step):
+                entry = result.setdefault(slot_to_note[slot], {"时间": [], **{name: [] for name in COUNTERS.values()}})
+                if bucket not in stamps:
+                    stamps[bucket] = _iso(bucket * step)
+                entry["时间"].append(stamps[bucket])
+                for column, name in COUNTERS.items():
+                    value = views[column][i]
+                    entry[name].append(None if value == MISSING else value)
+            for entry in result.values():
+                entry["增长"] = {}
+                for name in COUNTERS.values():
+                    values = [v for v in entry[name] if v is not None]
+                    entry["增长"][name] = values[-1] - values[0] if values else None
+            return result
+        finally:
+            for view in views.values():
+                view.release()
+            for mm in maps:
+                mm.close()
+
+    @staticmethod
+    def _bisect(ts, value: float, n: int) -> int:
+        """第一个采样时间 >= value 的行号"""
+        lo, hi = 0, n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if ts[mid] < value:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def summary(self) -> Dict[str, Any]:
+        active = self.conn.execute("SELECT COUNT(*) FROM tracked WHERE active = 1").fetchone()[0]
+        total = self.conn.execute("SELECT COUNT(*) FROM tracked").fetchone()[0]
+        return {"跟踪中": active, "已登记": total, "采样行数": self.rows, "存储字节": self.rows * 4 * len(COLUMNS)}
+
+
+def _last_per_bucket(ts_map, slot_map, views: Dict[str, memoryview], lo: int, hi: int, wanted: set,
+                     step: int) -> List[Tuple[Tuple[int, int], int]]:
+    """
+    [((槽位, 时间桶), 桶内最后一行的行号)]，按槽位、时间桶排序；
+    装了 numpy（随 pandas 安装）时向量化计算，否则逐行扫描
+    """
+    try:
+        import numpy as np
+    except ImportError:
+        np = None
+    if np is None:
+        last: Dict[Tuple[int, int], int] = {}
+        for i, t, slot in zip(range(lo, hi), views["ts"][lo:hi], views["slot"][lo:hi]):
+            if slot in wanted:
+                last[(slot, t // step)] = i
+        return sorted(last.items())
+    ts = np.frombuffer(ts_map, dtype=np.uint32, count=hi, offset=0)[lo:hi]
+    slots = np.frombuffer(slot_map, dtype=np.uint32, count=hi, offset=0)[lo:hi]
+    rows = np.nonzero(np.isin(slots, np.fromiter(wanted, dtype=np.uint32)))[0]
+    keys = (slots[rows].astype(np.uint64) << np.uint64(32)) | (ts[rows] // step).astype(np.uint64)
+    # 行按时间递增，反转后 unique 取到的第一次出现即每个桶的最后一行
+    unique_keys, first = np.unique(keys[::-1], return_index=True)
+    last_rows = rows[::-1][first] + lo
+    return [((int(k >> 32), int(k & 0xFFFFFFFF)), int(i)) for k, i in zip(unique_keys.tolist(), last_rows.tolist())]
+
+
+_store: Optional[EngagementStore] = None
+_store_lock = threading.Lock()
+
+
+def get_engagement_store() -> EngagementStore:
+    """获取全局互动序列存储（首次调用时打开）"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = EngagementStore()
+    return _store
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="笔记互动数时间序列")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_track = sub.add_parser("track", help="登记要跟踪的笔记")
+    p_track.add_argument("notes", nargs="+", help="笔记链接或笔记ID")
+    p_track.add_argument("--interval", type=int, default=DEFAULT_INTERVAL, help="采样间隔（秒）")
+    p_untrack = sub.add_parser("untrack", help="停止跟踪")
+    p_untrack.add_argument("notes", nargs="+")
+    sub.add_parser("list", help="列出已登记的笔记")
+    p_capture = sub.add_parser("capture", help="立即采样一轮（需要浏览器登录状态）")
+    p_capture.add_argument("--force", action="store_true", help="忽略采样间隔，采样全部笔记")
+    sub.add_parser("run", help="持续按间隔采样")
+    p_show = sub.add_parser("show", help="查询降采样后的序列")
+    p_show.add_argument("notes", nargs="*")
+    p_show.add_argument("--hours", type=float, default=72)
+    p_show.add_argument("--step", type=int, default=3600, help="降采样步长（秒）")
+    args = parser.parse_args(argv)
+
+    store = get_engagement_store()
+    if args.command in ("capture", "run"):
+        import asyncio
+        import xiaohongshu_mcp as core
+
+        async def run():
+            if not await core.ensure_browser():
+                print("请先在打开的浏览器中登录小红书账号", file=sys.stderr)
+                return None
+            if args.command == "run":
+                await core.engagement_tracker_loop()
+            return await core.capture_engagement(force=args.force)
+        result: Any = asyncio.run(run())
+        if result is None:
+            return 1
+    elif args.command == "track":
+        result = {"已登记": store.track(args.notes, args.interval)}
+    elif args.command == "untrack":
+        result = {"已停止": store.untrack(args.notes)}
+    elif args.command == "list":
+        result = {**store.summary(), "笔记": store.tracked()}
+    else:
+        result = store.series(args.notes or None, since=time.time() - args.hours * 3600, step=args.step)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
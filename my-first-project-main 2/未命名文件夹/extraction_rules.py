@@ -0,0 +1,370 @@
+"""
+声明式的笔记页面提取规则
+
+字段、按顺序回退的选择器、正则和长度阈值都定义在 extraction_rules.json 中（带版本号），
+这里把规则编译成一个缓存的 JS 提取函数，一次 evaluate 就能取回全部字段；
+规则文件修改后自动热加载，修复选择器只需要改配置，不用重启服务。
+离线提取（html_archive）也使用同一份规则。
+"""
+from typing import Any, Dict, List, Optional, Tuple
+import json
+import os
+import re
+import threading
+import time
+
+import metrics
+
+RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "extraction_rules.json")
+RELOAD_CHECK_INTERVAL = 1.0
+
+# 规则解释器：R 为规则对象，opts 为 {fields: bool, comments: bool, tree: bool, cards: bool, comment_limit: int,
+# comment_mark: str, comment_selector: str, max_depth: int, max_fanout: int}
+EXTRACTOR_TEMPLATE = '''
+(opts) => {
+    const R = __RULES__;
+    opts = opts || {};
+    const areaSelector = R.comment_area.join(', ');
+    const inCommentArea = (el) => !!(areaSelector && el.closest(areaSelector));
+    const text = (el) => (el && el.textContent ? el.textContent.trim() : '');
+    const firstText = (root, selectors) => {
+        for (const selector of selectors || []) {
+            try {
+                const t = text(root.querySelector(selector));
+                if (t) return t;
+            } catch (e) {}
+        }
+        return '';
+    };
+    const toInt = (t) => {
+        const m = (t || '').replace(/,/g, '').match(/([\d.]+)\s*(万)?/);
+        return m ? Math.round(parseFloat(m[1]) * (m[2] ? 10000 : 1)) : 0;
+    };
+    const result = {};
+    if (opts.fields !== false) {
+        for (const [name, rule] of Object.entries(R.fields)) {
+            let value = firstText(document, rule.selectors);
+            for (const candidate of (value ? [] : rule.candidates || [])) {
+                const el = Array.from(document.querySelectorAll(candidate.selector)).find(el => {
+                    if (rule.exclude_comment_area && inCommentArea(el)) return false;
+                    const len = text(el).length;
+                    return len > (candidate.min_length || 0) && (!rule.max_length || len < rule.max_length);
+                });
+                if (el) { value = text(el); break; }
+            }
+            if (!value && rule.patterns) {
+                const body = document.body ? document.body.textContent : '';
+                for (const pattern of rule.patterns) {
+                    const m = body.match(new RegExp(pattern));
+                    if (m) { value = m[0].trim(); break; }
+                }
+            }
+            result[name] = value || rule.default;
+        }
+        for (const [name, rule] of Object.entries(R.lists)) {
+            const values = Array.from(document.querySelectorAll(rule.selector))
+                .filter(el => !(rule.exclude_comment_area && inCommentArea(el)))
+                .map(el => rule.attribute === 'src' ? (el.currentSrc || el.src) :
+                     rule.attribute ? el.getAttribute(rule.attribute) : text(el))
+                .filter(Boolean);
+            result[name] = Array.from(new Set(values));
+        }
+    }
+    if (opts.comments) {
+        // comment_mark / comment_selector 用于分批提取：取过的评论节点打上 data-xhs-comment=<标记>，下一批跳过。
+        // 按节点标记而不是按位置继续："展开回复" 会把回复插到前面的楼层里，位置会整体后移
+        const C = R.comments;
+        const limit = opts.comment_limit || Infinity;
+        const mark = opts.comment_mark || '';
+        const comments = [];
+        let used = '';
+        for (const selector of opts.comment_selector ? [opts.comment_selector] : C.items) {
+            for (const item of document.querySelectorAll(selector)) {
+                if (comments.length >= limit) break;
+                if (mark && item.getAttribute('data-xhs-comment') === mark) continue;
+                const username = firstText(item, C.username);
+                let content = firstText(item, C.content);
+                if (!content && C.content_fallback_to_text && username) {
+                    content = text(item).replace(username, '').trim();
+                }
+                if (username && content && content.length > C.min_length) {
+                    comments.push({'用户名': username, '内容': content,
+                                   '时间': firstText(item, C.time) || C.default_time});
+                    if (mark) item.setAttribute('data-xhs-comment', mark);
+                }
+            }
+            if (comments.length || opts.comment_selector) {
+                used = selector;
+                break;
+            }
+        }
+        result['评论'] = comments;
+        result['评论选择器'] = used;
+    }
+    if (opts.tree) {
+        // 评论树：每个楼层取楼主评论和它下面的回复，"回复 某人:" 开头的回复挂到该用户在本楼层的上一条回复下。
+        // 有 comment_mark 时只返回没有标记过的节点（楼层内的父子关系仍按整个楼层计算），limit 只计新的楼层
+        const C = R.comments, T = R.comment_tree;
+        const maxDepth = opts.max_depth === undefined || opts.max_depth === null ? Infinity : opts.max_depth;
+        const maxFanout = opts.max_fanout || Infinity;
+        const limit = opts.comment_limit || Infinity;
+        const mark = opts.comment_mark || '';
+        const fresh = (el) => {
+            if (mark && el.getAttribute('data-xhs-tree') === mark) return false;
+            if (mark) el.setAttribute('data-xhs-tree', mark);
+            return true;
+        };
+        const first = (root, selectors) => {
+            for (const selector of selectors) {
+                const el = root.querySelector(selector);
+                if (el) return el;
+            }
+            return null;
+        };
+        const node = (el, parentId, depth) => {
+            // 没有评论ID时用页面内序号兜底，序号记在节点上，分批提取时同一节点的ID不变
+            let raw = el.getAttribute(T.id_attribute) || el.getAttribute('data-xhs-cid');
+            if (!raw) {
+                window.__xhsCommentSeq = (window.__xhsCommentSeq || 0) + 1;
+                raw = T.id_prefix + 'idx-' + window.__xhsCommentSeq;
+                el.setAttribute('data-xhs-cid', raw);
+            }
+            const link = el.querySelector(T.author_link);
+            const m = link ? (link.getAttribute('href') || '').match(new RegExp(T.author_id_pattern)) : null;
+            return {'评论ID': raw.startsWith(T.id_prefix) ? raw.slice(T.id_prefix.length) : raw,
+                    '父评论ID': parentId, '用户名': firstText(el, C.username), '用户ID': m ? m[1] : '',
+                    '内容': firstText(el, C.content), '时间': firstText(el, C.time) || C.default_time,
+                    '点赞数': toInt(firstText(el, T.likes)), '深度': depth};
+        };
+        const tree = [];
+        let roots = 0;
+        for (const thread of document.querySelectorAll(T.thread.join(', '))) {
+            if (roots >= limit) break;
+            const top = first(thread, T.item);
+            if (!top) continue;
+            const root = node(top, '', 0);
+            if (!root['用户名'] || !root['内容']) continue;
+            if (fresh(top)) {
+                tree.push(root);
+                roots++;
+            }
+            if (maxDepth < 1) continue;
+            const fanout = {};
+            const lastByUser = {};
+            for (const sub of thread.querySelectorAll(T.reply.join(', '))) {
+                if (sub === top) continue;
+                let parent = root;
+                const reply = node(sub, root['评论ID'], 1);
+                const m = reply['内容'].match(new RegExp(T.reply_to_pattern));
+                if (m && lastByUser[m[1]] && lastByUser[m[1]]['深度'] < maxDepth) parent = lastByUser[m[1]];
+                reply['父评论ID'] = parent['评论ID'];
+                reply['深度'] = parent['深度'] + 1;
+                fanout[parent['评论ID']] = (fanout[parent['评论ID']] || 0) + 1;
+                if (fanout[parent['评论ID']] > maxFanout) continue;
+                lastByUser[reply['用户名']] = reply;
+                if (fresh(sub)) tree.push(reply);
+            }
+        }
+        result['评论树'] = tree;
+    }
+    if (opts.cards && R.cards) {
+        // 搜索结果卡片：只读卡片上已经渲染的字段，不打开笔记详情；链接保留 xsec_token，轻量抓取可以直接使用
+        const K = R.cards;
+        const cards = [], seen = new Set();
+        for (const card of document.querySelectorAll(K.items.join(', '))) {
+            let noteId = '', query = '';
+            for (const selector of K.links) {
+                for (const a of card.querySelectorAll(selector)) {
+                    const url = new URL(a.getAttribute('href') || '', location.origin);
+                    const m = url.pathname.match(new RegExp(K.note_id_pattern));
+                    if (!m) continue;
+                    noteId = noteId || m[1];
+                    if (!query && url.searchParams.get('xsec_token')) query = url.search;
+                }
+            }
+            if (!noteId || seen.has(noteId)) continue;
+            seen.add(noteId);
+            const authorLink = card.querySelector(K.author_link);
+            const am = authorLink ? (authorLink.getAttribute('href') || '').match(new RegExp(K.author_id_pattern)) : null;
+            let cover = '';
+            for (const selector of K.cover) {
+                const img = card.querySelector(selector);
+                if (img && (img.currentSrc || img.src)) { cover = img.currentSrc || img.src; break; }
+            }
+            cards.push({'笔记ID': noteId, '链接': location.origin + '/explore/' + noteId + query,
+                        '标题': firstText(card, K.title) || K.default_title,
+                        '作者': firstText(card, K.author) || K.default_author, '作者ID': am ? am[1] : '',
+                        '封面': cover, '点赞数': toInt(firstText(card, K.likes))});
+        }
+        result['卡片'] = cards;
+    }
+    return result;
+}
+'''
+
+REQUIRED_SECTIONS = ("fields", "lists", "comments", "comment_tree", "actions")
+
+
+class ExtractionRules:
+    """
+    一个版本的提取规则及其编译后的 JS 提取函数
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        for section in REQUIRED_SECTIONS:
+            if not isinstance(config.get(section), dict):
+                raise ValueError(f"提取规则缺少 {section} 段")
+        self.version = config.get("version", 1)
+        self.config = config
+        self.comment_area: List[str] = list(config.get("comment_area", []))
+        self.fields: Dict[str, Dict[str, Any]] = config["fields"]
+        self.lists: Dict[str, Dict[str, Any]] = config["lists"]
+        self.comments: Dict[str, Any] = config["comments"]
+        self.actions: Dict[str, List[str]] = config["actions"]
+        # 正则在这里先编译一遍，写错时加载失败而不是在页面里静默失效
+        self.patterns: Dict[str, List[re.Pattern]] = {
+            name: [re.compile(p) for p in rule.get("patterns", [])] for name, rule in self.fields.items()
+        }
+        self.js = EXTRACTOR_TEMPLATE.replace("__RULES__", json.dumps(config, ensure_ascii=False))
+
+    def action(self, name: str) -> List[str]:
+        return list(self.actions.get(name, []))
+
+
+def load_rules_config(path: Optional[str] = None) -> Dict[str, Any]:
+    with open(path or RULES_PATH, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+_rules_cache: Dict[str, Tuple[float, ExtractionRules]] = {}
+_rules_lock = threading.Lock()
+_last_check: Dict[str, float] = {}
+
+
+def get_rules(path: Optional[str] = None) -> ExtractionRules:
+    """
+    获取已编译的提取规则；规则文件变更后自动热加载，同一路径每秒最多检查一次
+    """
+    path = path or RULES_PATH
+    now = time.monotonic()
+    cached = _rules_cache.get(path)
+    if cached and now - _last_check.get(path, 0) < RELOAD_CHECK_INTERVAL:
+        return cached[1]
+    with _rules_lock:
+        _last_check[path] = now
+        mtime = os.path.getmtime(path)
+        cached = _rules_cache.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        try:
+            rules = ExtractionRules(load_rules_config(path))
+        except (OSError, ValueError, re.error) as e:
+            # 规则改坏时继续使用上一次成功编译的版本
+            if cached:
+                print(f"[日志] 提取规则加载失败，继续使用旧版本: {e}")
+                return cached[1]
+            raise
+        _rules_cache[path] = (mtime, rules)
+        metrics.set_gauge("extraction_rules_version", rules.version)
+        if cached:
+            metrics.inc("extraction_rules_reloads_total")
+            print(f"[日志] 提取规则已重新加载: 版本 {rules.version}")
+        return rules
+
+
+async def extract_page(page, fields: bool = True, comments: bool = False,
+                       comment_limit: Optional[int] = None, tree: bool = False,
+                       max_depth: Optional[int] = None, max_fanout: Optional[int] = None,
+                       comment_mark: Optional[str] = None, comment_selector: Optional[str] = None,
+                       cards: bool = False) -> Dict[str, Any]:
+    """
+    在已加载的页面上用一次 evaluate 执行提取规则；
+    tree 为 True 时额外返回 "评论树"（带评论ID、父评论ID、用户ID、点赞数、深度的扁平列表）。
+    comment_mark 为分批提取的标记：评论和评论树只返回没有打过该标记的节点，并给返回的节点打上标记；
+    提取评论时还返回 "评论选择器"，连同同一个 comment_mark 传回即可取下一批。
+    cards 为 True 时返回搜索结果页上当前渲染的 "卡片"（笔记ID、链接、标题、作者、封面、点赞数）
+    """
+    rules = get_rules()
+    result = await page.evaluate(rules.js, {"fields": fields, "comments": comments, "cards": cards,
+                                            "comment_limit": comment_limit or 0, "tree": tree,
+                                            "max_depth": max_depth, "max_fanout": max_fanout or 0,
+                                            "comment_mark": comment_mark or "",
+                                            "comment_selector": comment_selector or ""})
+    result["规则版本"] = rules.version
+    return result
+
+
+async def wait_for_note(page, timeout: float = 15) -> bool:
+    """等待笔记详情（弹窗或详情页的标题、正文）渲染出来，代替固定等待；超时返回 False"""
+    rules = get_rules()
+    selectors = (rules.action("note_modal") + rules.fields["标题"]["selectors"]
+                 + [c["selector"] for c in rules.fields["内容"]["candidates"]])
+    try:
+        await page.wait_for_selector(", ".join(selectors), timeout=timeout * 1000)
+        return True
+    except Exception:
+        return False
+
+
+async def query_main_image(page):
+    """按提取规则（actions.main_image）的顺序找到笔记主图元素，都没有时返回 None"""
+    for selector in get_rules().action("main_image"):
+        element = await page.query_selector(selector)
+        if element:
+            return element
+    return None
+
+
+async def wait_for_images(page, timeout: float = 3) -> None:
+    """等待视口内的图片加载完成，最多 timeout 秒"""
+    try:
+        await page.evaluate("""(timeout) => new Promise(resolve => {
+            const start = Date.now();
+            const check = () => {
+                const pending = Array.from(document.images).filter(img => {
+                    const rect = img.getBoundingClientRect();
+                    return !img.complete && rect.height > 0 && rect.top < window.innerHeight && rect.bottom > 0;
+                });
+                if (!pending.length || Date.now() - start > timeout) resolve();
+                else setTimeout(check, 100);
+            };
+            check();
+        })""", timeout * 1000)
+    except Exception:
+        pass
+
+
+async def note_modal_open(page) -> bool:
+    for selector in get_rules().action("note_modal"):
+        element = await page.query_selector(selector)
+        if element and await element.is_visible():
+            return True
+    return False
+
+
+async def close_modal(page) -> bool:
+    """
+    按规则中的关闭按钮列表关闭笔记弹窗，都找不到时按 Escape；
+    弹窗仍在时再按一次 Escape，返回弹窗最终是否已关闭
+    """
+    for selector in get_rules().action("close_modal"):
+        button = await page.query_selector(selector)
+        if button:
+            await button.click()
+            break
+    else:
+        await page.keyboard.press("Escape")
+    if await _wait_modal_closed(page):
+        return True
+    await page.keyboard.press("Escape")
+    return await _wait_modal_closed(page)
+
+
+async def _wait_modal_closed(page, timeout: float = 2) -> bool:
+    """等待笔记弹窗消失（最多 timeout 秒），返回弹窗是否已关闭"""
+    try:
+        await page.wait_for_selector(", ".join(get_rules().action("note_modal")), state="hidden",
+                                     timeout=timeout * 1000)
+        return True
+    except Exception:
+        return not await note_modal_open(page)
@@ -0,0 +1,190 @@
+"""
+笔记详情页的轻量抓取：不渲染页面，直接解析服务端 HTML 中内嵌的 window.__INITIAL_STATE__
+
+请求通过持久化上下文的 APIRequestContext 发出，与浏览器共享登录 Cookie；
+解析失败时抛出 FastFetchError，由调用方退回到完整的页面抓取。
+"""
+from typing import Any, Dict, List, Optional
+from datetime import datetime
+import json
+import re
+
+from notes_corpus import note_id_from_url
+from html_archive import get_archive
+from post_processing import get_post_processor
+from time_index import annotate_times
+
+INITIAL_STATE_RE = re.compile(r'window\.__INITIAL_STATE__\s*=\s*(\{.*?\})\s*;?\s*</script>', re.S)
+# 内嵌状态是 JS 字面量，里面会出现 undefined
+UNDEFINED_RE = re.compile(r'(?<=[:\[,])\s*undefined\s*(?=[,\]}])')
+
+FETCH_HEADERS = {
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Referer": "https://www.xiaohongshu.com/",
+}
+
+
+class FastFetchError(Exception):
+    """轻量抓取失败（请求失败、没有内嵌状态或状态里没有笔记数据）"""
+
+
+def parse_initial_state(html: str) -> Dict[str, Any]:
+    """从 HTML 中提取并解析 window.__INITIAL_STATE__"""
+    m = INITIAL_STATE_RE.search(html or "")
+    if not m:
+        raise FastFetchError("页面中没有 __INITIAL_STATE__")
+    raw = UNDEFINED_RE.sub("null", m.group(1))
+    try:
+        return json.loads(raw)
+    except ValueError as e:
+        raise FastFetchError(f"__INITIAL_STATE__ 解析失败: {e}")
+
+
+def _format_time(ms: Any) -> str:
+    try:
+        return datetime.fromtimestamp(int(ms) / 1000).strftime("%Y-%m-%d %H:%M")
+    except (TypeError, ValueError, OverflowError, OSError):
+        return "未知"
+
+
+def _to_int(value: Any) -> Optional[int]:
+    """互动数可能是 "1.2万" 这样的文本"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    text = str(value).strip().replace(",", "")
+    try:
+        if text.endswith("万"):
+            return int(float(text[:-1]) * 10000)
+        return int(float(text))
+    except ValueError:
+        return None
+
+
+def _comment_record(item: Dict[str, Any], parent_id: str = "", depth: int = 0) -> Dict[str, Any]:
+    user = item.get("userInfo") or item.get("user_info") or {}
+    created = item.get("createTime") or item.get("create_time")
+    return {
+        "评论ID": item.get("id", ""),
+        "父评论ID": parent_id,
+        "用户名": user.get("nickname", "未知用户"),
+        "用户ID": user.get("userId") or user.get("user_id", ""),
+        "内容": item.get("content", ""),
+        "时间": _format_time(created),
+        "时间戳": created,
+        "点赞数": _to_int(item.get("likeCount") or item.get("like_count")),
+        "深度": depth,
+    }
+
+
+def comment_tree_records(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """把接口格式的评论（子评论在 subComments 中）展开成带父评论ID的扁平列表"""
+    records = []
+    depth_of: Dict[str, int] = {}
+    for item in items:
+        top = _comment_record(item)
+        records.append(top)
+        depth_of[top["评论ID"]] = 0
+        for sub in item.get("subComments") or item.get("sub_comments") or []:
+            target = (sub.get("targetComment") or sub.get("target_comment") or {}).get("id")
+            # 回复的是楼层里的另一条回复时挂到那条回复下面
+            parent = target if target in depth_of else top["评论ID"]
+            reply = _comment_record(sub, parent, depth_of[parent] + 1)
+            depth_of[reply["评论ID"]] = reply["深度"]
+            records.append(reply)
+    return records
+
+
+def note_record_from_detail(note_id: str, detail: Dict[str, Any]) -> Dict[str, Any]:
+    """把 noteDetailMap 中的一项转换成与页面快照相同字段的笔记记录"""
+    note = detail.get("note") or {}
+    user = note.get("user") or {}
+    interact = note.get("interactInfo") or {}
+    images = []
+    for img in note.get("imageList") or []:
+        src = img.get("urlDefault") or img.get("url") or ""
+        if not src and img.get("infoList"):
+            src = img["infoList"][-1].get("url", "")
+        if src:
+            images.append(src)
+    record = {
+        "笔记ID": note.get("noteId") or note_id,
+        "标题": note.get("title") or "未知标题",
+        "作者": user.get("nickname") or user.get("nickName") or "未知作者",
+        "作者ID": user.get("userId", ""),
+        "发布时间": _format_time(note.get("time")),
+        "发布时间戳": note.get("time"),
+        "内容": note.get("desc") or "未能获取内容",
+        "标签": ["#" + t["name"] for t in note.get("tagList") or [] if t.get("name")],
+        "图片": images,
+        "类型": note.get("type", ""),
+        "IP属地": note.get("ipLocation", ""),
+        "互动": {
+            "点赞": _to_int(interact.get("likedCount")),
+            "收藏": _to_int(interact.get("collectedCount")),
+            "评论": _to_int(interact.get("commentCount")),
+            "分享": _to_int(interact.get("shareCount")),
+        },
+    }
+    comments = (detail.get("comments") or {}).get("list") or []
+    if comments:
+        record["评论树"] = comment_tree_records(comments)
+        record["评论"] = [c for c in record["评论树"] if not c["父评论ID"]]
+    # 接口给出毫秒时间戳，规整结果精度为 second
+    return annotate_times(record)
+
+
+def note_records_from_state(state: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """提取内嵌状态中的全部笔记记录"""
+    detail_map = ((state.get("note") or {}).get("noteDetailMap")) or {}
+    records = []
+    for note_id, detail in detail_map.items():
+        if isinstance(detail, dict) and detail.get("note"):
+            records.append(note_record_from_detail(note_id, detail))
+    return records
+
+
+def parse_note_html(html: str, url: str = "") -> Dict[str, Any]:
+    """
+    从详情页 HTML 中解析出目标笔记；没有可用数据时抛出 FastFetchError
+    """
+    records = note_records_from_state(parse_initial_state(html))
+    if not records:
+        raise FastFetchError("内嵌状态中没有笔记数据")
+    wanted = note_id_from_url(url)
+    record = next((r for r in records if r["笔记ID"] == wanted), None) if wanted else records[0]
+    if record is None:
+        raise FastFetchError(f"内嵌状态中没有笔记 {wanted}")
+    if record["标题"] == "未知标题" and record["内容"] == "未能获取内容":
+        raise FastFetchError("笔记标题和正文均为空")
+    return record
+
+
+def _process_html(html: str, url: str) -> Dict[str, Any]:
+    # 开启归档时同样保存原始 HTML（未开启时 save 直接返回）
+    get_archive().save(note_id_from_url(url), url, html, source="fast")
+    return parse_note_html(html, url)
+
+
+async def fetch_note_html(context, url: str, timeout: float = 15) -> str:
+    """通过上下文的 APIRequestContext 获取详情页 HTML（共享登录 Cookie）"""
+    response = await context.request.get(url, headers=FETCH_HEADERS, timeout=timeout * 1000)
+    if not response.ok:
+        raise FastFetchError(f"HTTP {response.status}")
+    return await response.text()
+
+
+async def fetch_note_fast(context, url: str, timeout: float = 15) -> Dict[str, Any]:
+    """轻量抓取一条笔记，失败时抛出 FastFetchError"""
+    try:
+        html = await fetch_note_html(context, url, timeout)
+    except FastFetchError:
+        raise
+    except Exception as e:
+        raise FastFetchError(f"请求失败: {e}")
+    # 解析内嵌状态（正则 + JSON）和归档在后处理线程池中执行，不占用事件循环
+    record = await get_post_processor().run(_process_html, html, url, label="parse")
+    record["链接"] = url
+    record["抓取方式"] = "initial_state"
+    return record
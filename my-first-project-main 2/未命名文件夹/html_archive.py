@@ -0,0 +1,286 @@
+"""
+页面 HTML 快照归档与离线重新提取
+
+开启归档（环境变量 XHS_ARCHIVE_HTML=1）后，每次加载笔记页面都会把 DOM 快照 gzip 压缩保存到
+data/html_archive/<笔记ID前两位>/<笔记ID>/<抓取时间>.html.gz，并在 index.db 中按笔记ID和抓取时间建立索引。
+
+网站改版导致选择器失效时，修好提取规则后运行
+    python html_archive.py reextract --out data/reextracted.jsonl
+即可在不启动浏览器的情况下，用多进程对整个归档重新提取笔记字段和评论。
+"""
+from typing import Any, Dict, Iterator, List, Optional
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+import argparse
+import gzip
+import json
+import os
+import sqlite3
+import sys
+import threading
+
+import metrics
+from post_processing import get_post_processor
+
+ARCHIVE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "html_archive")
+
+
+class HtmlArchive:
+    """
+    按笔记ID和抓取时间索引的压缩 HTML 快照库
+    """
+
+    def __init__(self, root: str = ARCHIVE_DIR, enabled: Optional[bool] = None):
+        self.root = root
+        self.enabled = os.environ.get("XHS_ARCHIVE_HTML", "") == "1" if enabled is None else enabled
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(self.root, exist_ok=True)
+            self._conn = sqlite3.connect(os.path.join(self.root, "index.db"), check_same_thread=False)
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS snapshots (
+                    note_id TEXT NOT NULL, crawl_time TEXT NOT NULL, url TEXT, path TEXT NOT NULL,
+                    source TEXT, raw_size INTEGER, stored_size INTEGER,
+                    PRIMARY KEY (note_id, crawl_time));
+            """)
+        return self._conn
+
+    def save(self, note_id: str, url: str, html: str, source: str = "page",
+             crawl_time: Optional[datetime] = None) -> Optional[str]:
+        """保存一份快照，返回文件路径；未开启归档或没有笔记ID时不保存"""
+        if not self.enabled or not note_id or not html:
+            return None
+        crawl_time = crawl_time or datetime.now()
+        stamp = crawl_time.strftime("%Y%m%d%H%M%S%f")
+        rel_path = os.path.join(note_id[:2], note_id, f"{stamp}.html.gz")
+        path = os.path.join(self.root, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        raw = html.encode("utf-8")
+        with gzip.open(path, "wb", compresslevel=6) as f:
+            f.write(raw)
+        stored = os.path.getsize(path)
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO snapshots (note_id, crawl_time, url, path, source, raw_size, stored_size) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (note_id, crawl_time.strftime("%Y-%m-%d %H:%M:%S.%f"), url, rel_path, source, len(raw), stored))
+        metrics.inc("html_snapshots_total", source=source)
+        metrics.inc("html_snapshot_bytes_total", stored)
+        return path
+
+    def load(self, rel_path: str) -> str:
+        with gzip.open(os.path.join(self.root, rel_path), "rb") as f:
+            return f.read().decode("utf-8")
+
+    def list(self, note_id: Optional[str] = None, latest_only: bool = True) -> List[Dict[str, Any]]:
+        """列出快照索引；latest_only 时每条笔记只返回最新一份"""
+        if latest_only:
+            sql = ("SELECT note_id, MAX(crawl_time), url, path, source FROM snapshots"
+                   + (" WHERE note_id = ?" if note_id else "") + " GROUP BY note_id ORDER BY note_id")
+        else:
+            sql = ("SELECT note_id, crawl_time, url, path, source FROM snapshots"
+                   + (" WHERE note_id = ?" if note_id else "") + " ORDER BY note_id, crawl_time")
+        rows = self.conn.execute(sql, (note_id,) if note_id else ())
+        return [{"笔记ID": r[0], "抓取时间": r[1], "链接": r[2], "path": r[3], "来源": r[4]} for r in rows]
+
+
+_archive: Optional[HtmlArchive] = None
+
+
+def get_archive() -> HtmlArchive:
+    global _archive
+    if _archive is None:
+        _archive = HtmlArchive()
+    return _archive
+
+
+async def archive_page(page, url: str, note_id: str, source: str = "page") -> Optional[str]:
+    """归档当前页面的 DOM 快照（未开启归档时什么也不做）"""
+    archive = get_archive()
+    if not archive.enabled:
+        return None
+    try:
+        # gzip 压缩和写文件在后处理线程池中执行
+        return await get_post_processor().run(archive.save, note_id, url, await page.content(), source,
+                                              label="archive")
+    except Exception as e:
+        print(f"[日志] 归档页面快照失败: {e}")
+        return None
+
+
+# ---------------- 离线提取 ----------------
+
+def _parser():
+    try:
+        from selectolax.parser import HTMLParser
+    except ImportError:
+        raise RuntimeError("离线 DOM 提取需要安装 selectolax（pip install selectolax）")
+    return HTMLParser
+
+
+def _text(node) -> str:
+    # 与页面内的 el.textContent.trim() 一致：只去掉首尾空白，不逐个文本节点 strip（否则行内标签间的空格会丢失）
+    return node.text(separator="").strip() if node is not None else ""
+
+
+def _first_text(root, selectors: List[str]) -> str:
+    for selector in selectors:
+        try:
+            text = _text(root.css_first(selector))
+        except Exception:
+            continue
+        if text:
+            return text
+    return ""
+
+
+def extract_from_dom(html: str, rules=None) -> Dict[str, Any]:
+    """用 selectolax 执行与页面内 JS 提取函数相同的提取规则（extraction_rules.json）"""
+    from extraction_rules import get_rules
+    rules = rules or get_rules()
+    tree = _parser()(html)
+    area_ids = {n.mem_id for selector in rules.comment_area for n in tree.css(selector)}
+
+    def in_comment_area(node) -> bool:
+        parent = node.parent
+        while parent is not None:
+            if parent.mem_id in area_ids:
+                return True
+            parent = parent.parent
+        return False
+
+    record: Dict[str, Any] = {}
+    body_text = None
+    for name, rule in rules.fields.items():
+        value = _first_text(tree, rule.get("selectors", []))
+        for candidate in ([] if value else rule.get("candidates", [])):
+            for node in tree.css(candidate["selector"]):
+                text = _text(node)
+                if rule.get("exclude_comment_area") and (node.mem_id in area_ids or in_comment_area(node)):
+                    continue
+                if len(text) > candidate.get("min_length", 0) and (
+                        not rule.get("max_length") or len(text) < rule["max_length"]):
+                    value = text
+                    break
+            if value:
+                break
+        if not value and rules.patterns.get(name):
+            body_text = body_text if body_text is not None else _text(tree.body)
+            for pattern in rules.patterns[name]:
+                m = pattern.search(body_text)
+                if m:
+                    value = m.group(0).strip()
+                    break
+        record[name] = value or rule.get("default", "")
+    for name, rule in rules.lists.items():
+        values = []
+        for node in tree.css(rule["selector"]):
+            if rule.get("exclude_comment_area") and in_comment_area(node):
+                continue
+            values.append(node.attributes.get(rule["attribute"]) if rule.get("attribute") else _text(node))
+        record[name] = list(dict.fromkeys(v for v in values if v))
+
+    spec = rules.comments
+    comments = []
+    for selector in spec["items"]:
+        for node in tree.css(selector):
+            username = _first_text(node, spec["username"])
+            content = _first_text(node, spec["content"])
+            if not content and spec.get("content_fallback_to_text") and username:
+                content = _text(node).replace(username, "", 1).strip()
+            if username and content and len(content) > spec.get("min_length", 0):
+                comments.append({"用户名": username, "内容": content,
+                                 "时间": _first_text(node, spec["time"]) or spec.get("default_time", "未知时间")})
+        if comments:
+            break
+    record["评论"] = comments
+    record["规则版本"] = rules.version
+    return record
+
+
+def extract_from_html(html: str, url: str = "") -> Dict[str, Any]:
+    """
+    离线提取一份快照：优先解析内嵌初始状态，没有时按 DOM 选择器提取；
+    DOM 中的评论总是会补充进来（内嵌状态里通常没有评论）
+    """
+    from fast_fetch import FastFetchError, parse_note_html
+    try:
+        record = parse_note_html(html, url)
+        record["提取方式"] = "initial_state"
+        if not record.get("评论"):
+            try:
+                record["评论"] = extract_from_dom(html)["评论"]
+            except RuntimeError:
+                pass
+    except FastFetchError:
+        record = extract_from_dom(html)
+        record["提取方式"] = "dom"
+    return record
+
+
+def _reextract_one(args) -> Dict[str, Any]:
+    root, item = args
+    try:
+        with gzip.open(os.path.join(root, item["path"]), "rb") as f:
+            html = f.read().decode("utf-8")
+        record = extract_from_html(html, item["链接"] or "")
+        record.update({"笔记ID": item["笔记ID"], "链接": item["链接"], "抓取时间": item["抓取时间"]})
+        return record
+    except Exception as e:
+        return {"笔记ID": item["笔记ID"], "抓取时间": item["抓取时间"], "error": str(e)}
+
+
+def reextract_archive(archive: Optional[HtmlArchive] = None, latest_only: bool = True,
+                      workers: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """对归档中的快照做离线重新提取，多进程并行，按索引顺序逐条产出记录"""
+    archive = archive or get_archive()
+    items = archive.list(latest_only=latest_only)
+    tasks = [(archive.root, item) for item in items]
+    if workers == 1 or len(tasks) < 2:
+        for task in tasks:
+            yield _reextract_one(task)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield from pool.map(_reextract_one, tasks, chunksize=16)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="页面 HTML 快照归档")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_list = sub.add_parser("list", help="列出归档中的快照")
+    p_list.add_argument("--note-id", default=None)
+    p_list.add_argument("--all", action="store_true", help="列出所有版本，而不是每条笔记的最新一份")
+    p_re = sub.add_parser("reextract", help="离线重新提取整个归档")
+    p_re.add_argument("--out", default=None, help="输出 JSONL 文件，默认输出到标准输出")
+    p_re.add_argument("--all", action="store_true", help="提取所有版本，而不是每条笔记的最新一份")
+    p_re.add_argument("--workers", type=int, default=None, help="进程数，默认 CPU 核数")
+    args = parser.parse_args(argv)
+
+    archive = HtmlArchive(enabled=True)
+    if args.command == "list":
+        for item in archive.list(args.note_id, latest_only=not args.all):
+            print(json.dumps(item, ensure_ascii=False))
+        return 0
+
+    out = open(args.out, "w", encoding="utf-8") if args.out else sys.stdout
+    total = failed = 0
+    start = datetime.now()
+    try:
+        for record in reextract_archive(archive, latest_only=not args.all, workers=args.workers):
+            total += 1
+            failed += 1 if "error" in record else 0
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+    finally:
+        if args.out:
+            out.close()
+    elapsed = (datetime.now() - start).total_seconds()
+    print(f"[日志] 离线提取完成：{total} 份快照，失败 {failed} 份，耗时 {elapsed:.1f}s", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
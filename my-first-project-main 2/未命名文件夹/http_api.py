@@ -0,0 +1,140 @@
+"""
+小红书爬虫 HTTP API（Flask）
+
+启动：python http_api.py [--port 5001] [--prewarm] [--track-engagement]
+只加载 Flask 与共享核心，不会导入 FastMCP；pandas 只在 /export 时导入。
+浏览器操作统一在共享核心的后台事件循环中执行；--prewarm（或 XHS_PREWARM=1）时启动即预热浏览器，
+--track-engagement（或 XHS_TRACK_ENGAGEMENT=1）时在后台按间隔采样跟踪笔记的互动数。
+"""
+import argparse
+import glob
+import os
+import time
+
+from flask import Flask, request, jsonify, send_from_directory
+from flask_cors import CORS
+
+import xiaohongshu_mcp as core
+
+app = Flask(__name__)
+CORS(app)
+
+@app.route('/crawl', methods=['POST'])
+def crawl():
+    try:
+        data = request.json
+        print('收到前端请求:', data)
+        keywords = data.get('keywords')
+        note_limit = int(data.get('note_limit', 5) or 5)
+        comment_limit = int(data.get('comment_limit', 1) or 1)
+        print(f'准备启动爬虫，关键词: {keywords}, 笔记数: {note_limit}, 评论数: {comment_limit}')
+        if data.get('mode') == 'list':
+            # 列表模式：只读搜索结果卡片，不打开笔记详情
+            result = core.run_sync(core.list_notes(keywords, note_limit))
+            if 'error' in result:
+                return jsonify({'status': 'error', 'msg': result['error']}), 500
+            return jsonify({'status': 'ok', 'msg': f"已列出 {result['笔记数']} 条笔记", **result})
+        async def run_crawler():
+            print('ensure_browser 开始')
+            await core.ensure_browser()
+            print('ensure_browser 完成，开始爬取')
+            await core.crawl_notes_by_click(core.main_page, keywords, note_limit, comment_limit)
+            print('crawl_notes_by_click 完成')
+        core.run_sync(run_crawler())
+        print('爬虫任务已完成，准备返回响应')
+        return jsonify({'status': 'ok', 'msg': '爬虫任务已完成'})
+    except Exception as e:
+        print('后端异常:', e)
+        return jsonify({'status': 'error', 'msg': str(e)}), 500
+
+@app.route('/notes', methods=['GET'])
+def get_notes():
+    note_files = glob.glob(os.path.join(core.NOTES_DIR, "*.md"))
+    notes = []
+    for file in note_files:
+        with open(file, "r", encoding="utf-8") as f:
+            notes.append({"filename": os.path.basename(file), "content": f.read()})
+    return jsonify(notes)
+
+@app.route('/stats', methods=['GET'])
+def get_stats():
+    top = int(request.args.get('top', 10) or 10)
+    return jsonify(core.get_note_stats().summary(top))
+
+@app.route('/search', methods=['GET'])
+def search_local():
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'status': 'error', 'msg': '缺少检索词 q'}), 400
+    limit = int(request.args.get('limit', 10) or 10)
+    kind = request.args.get('kind') or None
+    if kind not in (None, core.KIND_NOTE, core.KIND_COMMENT):
+        return jsonify({'status': 'error', 'msg': f'不支持的类型: {kind}'}), 400
+    return jsonify(core.get_search_index().search(query, limit, kind))
+
+@app.route('/recent', methods=['GET'])
+def get_recent_notes():
+    keyword = request.args.get('keyword') or None
+    days = float(request.args.get('days', 7) or 7)
+    limit = int(request.args.get('limit', 100) or 100)
+    with_comments = request.args.get('comments', '') in ('1', 'true')
+    return jsonify(core.get_time_index().recent(keyword, days, limit, with_comments))
+
+@app.route('/engagement', methods=['GET'])
+def get_engagement():
+    notes = [n for n in request.args.get('notes', '').split(',') if n.strip()] or None
+    hours = float(request.args.get('hours', 72) or 72)
+    step = int(request.args.get('step', 3600) or 3600)
+    store = core.get_engagement_store()
+    return jsonify({**store.summary(), '序列': store.series(notes, since=time.time() - hours * 3600, step=step)})
+
+@app.route('/engagement/track', methods=['POST'])
+def track_engagement():
+    data = request.json or {}
+    notes = data.get('notes') or []
+    if not notes:
+        return jsonify({'status': 'error', 'msg': '缺少 notes'}), 400
+    store = core.get_engagement_store()
+    if data.get('untrack'):
+        return jsonify({'status': 'ok', '已停止': store.untrack(notes)})
+    interval = max(60, int(data.get('interval', core.DEFAULT_ENGAGEMENT_INTERVAL) or 60))
+    return jsonify({'status': 'ok', '已登记': store.track(notes, interval), '采样间隔s': interval})
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return jsonify(core.metrics.snapshot())
+
+@app.route('/export', methods=['POST'])
+def export_notes():
+    # pandas 只在真正导出时才导入
+    from dataset_export import export_dataset
+    data = request.json or {}
+    try:
+        result = export_dataset(
+            data.get('format', 'parquet'),
+            incremental=bool(data.get('incremental', True)),
+            chunk_size=int(data.get('chunk_size', 5000) or 5000)
+        )
+        return jsonify({'status': 'ok', **result})
+    except ValueError as e:
+        return jsonify({'status': 'error', 'msg': str(e)}), 400
+
+@app.route('/notes_img/<filename>')
+def serve_note_image(filename):
+    return send_from_directory(core.NOTES_DIR, filename)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="小红书爬虫 HTTP API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5001)
+    parser.add_argument("--prewarm", action="store_true", help="启动时预热浏览器")
+    parser.add_argument("--track-engagement", action="store_true", help="在后台按间隔采样跟踪笔记的互动数")
+    args = parser.parse_args(argv)
+    if args.prewarm or os.environ.get("XHS_PREWARM", "") == "1":
+        core.start_prewarm()
+    if args.track_engagement or os.environ.get("XHS_TRACK_ENGAGEMENT", "") == "1":
+        core.start_engagement_tracker()
+    app.run(host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main()
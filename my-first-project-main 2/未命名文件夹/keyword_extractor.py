@@ -0,0 +1,305 @@
+"""
+中文关键词提取：分词 + 基于已爬取语料的 TF-IDF
+
+- 安装了 jieba 时使用 jieba 分词，否则退化为基于用户词典的正向最大匹配，未登录的汉字串按二元组切分
+- 话题标签（如 "#甜妹女头"）整体成词：写入语料时加入用户词典，给单篇文本打分时只在本次分词中整体保留，不写词典
+- 文档频率统计保存在 data/keywords.db，随着笔记写入增量更新；给单条笔记打分只查询统计表，不会重建语料统计
+"""
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from collections import Counter
+import argparse
+import json
+import math
+import os
+import re
+import sqlite3
+import sys
+import threading
+
+# jieba 是可选依赖（分词质量更好），导入较慢，首次分词时才加载
+_jieba = None
+_jieba_checked = False
+
+
+def _load_jieba():
+    global _jieba, _jieba_checked
+    if not _jieba_checked:
+        _jieba_checked = True
+        try:
+            import jieba
+            _jieba = jieba
+        except ImportError:
+            _jieba = None
+    return _jieba
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+KEYWORD_DB_PATH = os.path.join(DATA_DIR, "keywords.db")
+USER_DICT_PATH = os.path.join(DATA_DIR, "user_dict.txt")
+
+HASHTAG_RE = re.compile(r'#([^\s#]+?)(?:\[话题\])?(?=#|\s|$)')
+TOKEN_RE = re.compile(r'[\u4e00-\u9fff]+|[A-Za-z][A-Za-z0-9_+\-]*|\d+(?:\.\d+)?')
+CJK_RE = re.compile(r'^[\u4e00-\u9fff]+$')
+
+# 常见虚词和小红书页面套话，不作为关键词
+STOPWORDS: Set[str] = set("""
+的 了 是 在 我 你 他 她 它 们 和 与 及 或 也 都 就 还 又 很 太 更 最 这 那 哪 有 没 不 无 被 把 给 让 对 从 到 为 以 于 而 但
+个 些 之 其 吗 呢 吧 啊 呀 哦 嗯 哈 啦 着 过 一 二 三 上 下 中 里 外 来 去 说 要 会 能 可 可以 自己 我们 你们 他们 大家 什么 怎么
+这个 那个 一个 没有 就是 还是 真的 然后 因为 所以 如果 已经 还有 而且 不是 这样 那样 时候 现在 今天 昨天 一下 一起 一样 非常
+作者 未能获取内容 未知标题 未知作者 话题 http https www com
+""".split())
+
+MAX_TAG_LEN = 20
+# 爬取失败时写入的占位文本
+PLACEHOLDER_TEXTS = {"未能获取内容", "未知标题", "未知作者"}
+
+
+def extract_hashtags(text: str) -> List[str]:
+    """提取正文/标签中的话题标签，去掉 # 和 [话题] 后缀"""
+    tags = []
+    for tag in HASHTAG_RE.findall(text or ""):
+        tag = tag.strip()
+        if 1 < len(tag) <= MAX_TAG_LEN and tag not in tags:
+            tags.append(tag)
+    return tags
+
+
+class Segmenter:
+    """
+    分词器：优先 jieba；否则按用户词典做正向最大匹配，未登录汉字串切成二元组
+    """
+
+    def __init__(self, user_words: Iterable[str] = ()):
+        self.words: Set[str] = set()
+        self.max_len = 1
+        for word in user_words:
+            self.add_word(word)
+
+    def add_word(self, word: str) -> bool:
+        word = word.strip()
+        if not word or word in self.words:
+            return False
+        self.words.add(word)
+        self.max_len = max(self.max_len, len(word))
+        jieba = _load_jieba()
+        if jieba is not None:
+            jieba.add_word(word)
+        return True
+
+    def _cut_cjk(self, run: str) -> List[str]:
+        tokens = []
+        pending = ""
+        i = 0
+        while i < len(run):
+            matched = None
+            for size in range(min(self.max_len, len(run) - i), 1, -1):
+                if run[i:i + size] in self.words:
+                    matched = run[i:i + size]
+                    break
+            if matched:
+                tokens.extend(self._bigrams(pending))
+                pending = ""
+                tokens.append(matched)
+                i += len(matched)
+            else:
+                pending += run[i]
+                i += 1
+        tokens.extend(self._bigrams(pending))
+        return tokens
+
+    @staticmethod
+    def _bigrams(run: str) -> List[str]:
+        if len(run) < 2:
+            return [run] if run else []
+        return [run[i:i + 2] for i in range(len(run) - 1)]
+
+    def cut(self, text: str) -> List[str]:
+        if not text:
+            return []
+        jieba = _load_jieba()
+        if jieba is not None:
+            return [t.strip() for t in jieba.lcut(text) if t.strip()]
+        tokens = []
+        for token in TOKEN_RE.findall(text):
+            if CJK_RE.match(token):
+                tokens.extend(self._cut_cjk(token))
+            else:
+                tokens.append(token)
+        return tokens
+
+
+def _is_term(token: str) -> bool:
+    if token in STOPWORDS or token.isdigit():
+        return False
+    if CJK_RE.match(token):
+        return len(token) >= 2
+    return len(token) >= 2 and bool(re.match(r'^[A-Za-z]', token))
+
+
+class KeywordEngine:
+    """
+    维护用户词典与语料文档频率，对单篇文本做 TF-IDF 关键词排序
+    """
+
+    def __init__(self, db_path: str = KEYWORD_DB_PATH, user_dict_path: str = USER_DICT_PATH):
+        self.db_path = db_path
+        self.user_dict_path = user_dict_path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS docs (doc_id TEXT PRIMARY KEY, mtime REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS doc_terms (doc_id TEXT NOT NULL, term TEXT NOT NULL, PRIMARY KEY (doc_id, term));
+            CREATE TABLE IF NOT EXISTS df (term TEXT PRIMARY KEY, n INTEGER NOT NULL);
+        """)
+        self.segmenter = Segmenter(self._load_user_dict())
+
+    def _load_user_dict(self) -> List[str]:
+        if not os.path.exists(self.user_dict_path):
+            return []
+        with open(self.user_dict_path, "r", encoding="utf-8") as f:
+            return [line.split()[0] for line in f if line.strip()]
+
+    def add_user_words(self, words: Iterable[str]) -> int:
+        """把新词加入用户词典并追加写入词典文件，返回新增数量"""
+        added = [w for w in words if _is_term(w) and len(w) <= MAX_TAG_LEN and self.segmenter.add_word(w)]
+        if added:
+            with open(self.user_dict_path, "a", encoding="utf-8") as f:
+                for word in added:
+                    f.write(f"{word}\n")
+        return len(added)
+
+    def terms(self, text: str, keep: Iterable[str] = ()) -> List[str]:
+        """分词并过滤停用词；keep 中的词（话题标签）在本次分词中整体保留，不加入用户词典"""
+        keep = sorted({w for w in keep if _is_term(w) and w not in self.segmenter.words}, key=len, reverse=True)
+        if not keep:
+            return [t for t in self.segmenter.cut(text) if _is_term(t)]
+        tokens = []
+        for i, part in enumerate(re.split("(" + "|".join(map(re.escape, keep)) + ")", text)):
+            # re.split 带分组时奇数位置是匹配到的整词
+            tokens.extend([part] if i % 2 else self.segmenter.cut(part))
+        return [t for t in tokens if _is_term(t)]
+
+    @property
+    def doc_count(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def add_document(self, doc_id: str, text: str, tags: Iterable[str] = (), mtime: float = 0.0) -> None:
+        """
+        把一篇文档计入文档频率统计；同一 doc_id 重复写入时先扣除旧的统计
+        """
+        self.add_user_words(list(tags) + extract_hashtags(text))
+        unique_terms = set(self.terms(text))
+        with self._lock, self._conn:
+            old_terms = [row[0] for row in self._conn.execute(
+                "SELECT term FROM doc_terms WHERE doc_id = ?", (doc_id,))]
+            if old_terms:
+                self._conn.executemany("UPDATE df SET n = n - 1 WHERE term = ?", [(t,) for t in old_terms])
+                self._conn.execute("DELETE FROM doc_terms WHERE doc_id = ?", (doc_id,))
+                self._conn.execute("DELETE FROM df WHERE n <= 0")
+            self._conn.execute("INSERT OR REPLACE INTO docs (doc_id, mtime) VALUES (?, ?)", (doc_id, mtime))
+            self._conn.executemany("INSERT INTO doc_terms (doc_id, term) VALUES (?, ?)",
+                                   [(doc_id, t) for t in unique_terms])
+            self._conn.executemany(
+                "INSERT INTO df (term, n) VALUES (?, 1) ON CONFLICT(term) DO UPDATE SET n = n + 1",
+                [(t,) for t in unique_terms])
+
+    def add_note(self, doc_id: str, note: Dict[str, Any], mtime: float = 0.0) -> None:
+        """把一条笔记记录（标题、正文、标签）计入统计"""
+        tags = [t.lstrip("#") for t in note.get("标签") or []]
+        self.add_document(doc_id, note_text(note), tags=tags, mtime=mtime)
+
+    def update_from_corpus(self, notes_dir: Optional[str] = None) -> int:
+        """
+        增量扫描已爬取笔记，只处理新增或修改过的文件，返回处理的文件数
+        """
+        from notes_corpus import list_note_files, load_note_file
+        known = dict(self._conn.execute("SELECT doc_id, mtime FROM docs"))
+        updated = 0
+        for path in list_note_files(notes_dir):
+            doc_id = os.path.basename(path)
+            if known.get(doc_id) == os.path.getmtime(path):
+                continue
+            note = load_note_file(path)
+            self.add_note(doc_id, note, mtime=note["mtime"])
+            updated += 1
+        return updated
+
+    def idf(self, terms: Iterable[str]) -> Dict[str, float]:
+        """查询一组词的平滑 IDF"""
+        terms = list(set(terms))
+        n_docs = self.doc_count
+        df: Dict[str, int] = {}
+        for i in range(0, len(terms), 500):
+            chunk = terms[i:i + 500]
+            placeholders = ",".join("?" * len(chunk))
+            df.update(self._conn.execute(f"SELECT term, n FROM df WHERE term IN ({placeholders})", chunk))
+        return {t: math.log((n_docs + 1) / (df.get(t, 0) + 1)) + 1.0 for t in terms}
+
+    def extract(self, text: str, topk: int = 20, tags: Iterable[str] = ()) -> List[Tuple[str, float]]:
+        """
+        对单篇文本按 TF-IDF 排序返回前 topk 个 (关键词, 权重)，结果稳定可复现；
+        只读统计和词典，不修改任何状态
+        """
+        counts = Counter(self.terms(text, keep=list(tags) + extract_hashtags(text)))
+        if not counts:
+            return []
+        total = sum(counts.values())
+        idf = self.idf(counts.keys())
+        scored = [(term, round(n / total * idf[term], 6)) for term, n in counts.items()]
+        scored.sort(key=lambda x: (-x[1], x[0]))
+        return scored[:topk]
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def note_text(note: Dict[str, Any]) -> str:
+    """笔记参与关键词统计的文本：标题 + 正文 + 标签（占位文本不计入）"""
+    content = note.get("内容", "")
+    if content in PLACEHOLDER_TEXTS:
+        content = ""
+    return " ".join([note.get("标题", ""), content, " ".join(note.get("标签") or [])])
+
+
+_engine: Optional[KeywordEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_keyword_engine() -> KeywordEngine:
+    """获取全局关键词引擎；首次调用时打开统计库，并把磁盘上尚未统计的笔记增量补进来"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                engine = KeywordEngine()
+                engine.update_from_corpus()
+                _engine = engine
+    return _engine
+
+
+def extract_keywords(title: str, content: str, topk: int = 20) -> List[str]:
+    """analyze_note 使用的便捷接口，只返回关键词列表"""
+    return [term for term, _ in get_keyword_engine().extract(f"{title} {content}", topk=topk)]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="中文关键词提取 / 语料 IDF 统计")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_update = sub.add_parser("update", help="增量更新语料文档频率统计")
+    p_update.add_argument("--notes-dir", default=None)
+    p_extract = sub.add_parser("extract", help="对一段文本提取关键词")
+    p_extract.add_argument("text")
+    p_extract.add_argument("--topk", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    engine = get_keyword_engine()
+    if args.command == "update":
+        updated = engine.update_from_corpus(args.notes_dir)
+        print(json.dumps({"更新文件数": updated, "文档总数": engine.doc_count}, ensure_ascii=False))
+    else:
+        print(json.dumps(engine.extract(args.text, topk=args.topk), ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
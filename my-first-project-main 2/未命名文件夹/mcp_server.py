@@ -0,0 +1,103 @@
+"""
+小红书爬虫 MCP 服务器（stdio）
+
+启动：python mcp_server.py [--prewarm]
+只加载 FastMCP 与共享核心，不会导入 Flask；Playwright 在第一次工具调用时才导入。
+加 --prewarm（或设置环境变量 XHS_PREWARM=1）时，服务启动后立即在后台启动并预热浏览器；
+加 --track-engagement（或 XHS_TRACK_ENGAGEMENT=1）时，在后台按间隔采样跟踪笔记的互动数。
+"""
+from contextlib import asynccontextmanager
+from typing import List
+import argparse
+import asyncio
+import os
+
+from fastmcp import Context, FastMCP
+
+import xiaohongshu_mcp as core
+
+PREWARM = os.environ.get("XHS_PREWARM", "") == "1"
+TRACK_ENGAGEMENT = os.environ.get("XHS_TRACK_ENGAGEMENT", "") == "1"
+
+@asynccontextmanager
+async def lifespan(server):
+    """服务生命周期：按需在后台预热浏览器、启动互动采样，不阻塞 MCP 握手"""
+    prewarm_task = asyncio.create_task(core.prewarm_browser()) if PREWARM else None
+    tracker_task = asyncio.create_task(core.engagement_tracker_loop()) if TRACK_ENGAGEMENT else None
+    try:
+        yield {}
+    finally:
+        for task in (prewarm_task, tracker_task):
+            if task and not task.done():
+                task.cancel()
+
+# 初始化 FastMCP 服务器
+mcp = FastMCP("xiaohongshu_scraper", lifespan=lifespan)
+
+# 共享核心中的函数直接注册为 MCP 工具，文档字符串即工具说明
+for tool in (
+    core.login,
+    core.search_notes,
+    core.list_notes,
+    core.get_note_content,
+    core.get_note_comments,
+    core.get_note_full,
+    core.get_comment_threads,
+    core.search_local,
+    core.get_recent_notes,
+    core.track_notes,
+    core.untrack_notes,
+    core.get_engagement,
+    core.analyze_note,
+    core.classify_notes,
+    core.export_notes_dataset,
+    core.get_metrics,
+    core.post_smart_comment,
+    core.post_comment,
+):
+    mcp.tool()(tool)
+
+def progress_reporter(ctx: Context):
+    """把核心批量任务的进度回调转成 MCP 进度通知"""
+    async def report(done: int, total: int, message: str):
+        await ctx.report_progress(done, total)
+        await ctx.info(f"[{done}/{total}] {message}")
+    return report
+
+@mcp.tool()
+async def get_notes_batch(urls: List[str], ctx: Context, concurrency: int = 0, item_timeout: float = 90,
+                          with_comments: bool = False) -> dict:
+    """批量获取笔记内容，每完成一条发送一次进度通知，返回每条笔记的结构化结果（超时或失败的条目单独标注）
+
+    Args:
+        urls: 笔记链接或笔记ID列表
+        concurrency: 同时获取的笔记数上限，0 表示跟随站点节奏自动调整
+        item_timeout: 单条笔记的超时时间（秒）
+        with_comments: 是否在同一次页面加载中一并获取评论
+    """
+    return await core.get_notes_batch(urls, concurrency, item_timeout, with_comments,
+                                      progress=progress_reporter(ctx))
+
+@mcp.tool()
+async def get_comments_batch(urls: List[str], ctx: Context, concurrency: int = 0, item_timeout: float = 90) -> dict:
+    """批量获取笔记评论，每完成一条发送一次进度通知，返回每条笔记的评论列表（超时或失败的条目单独标注）
+
+    Args:
+        urls: 笔记链接或笔记ID列表
+        concurrency: 同时获取的笔记数上限，0 表示跟随站点节奏自动调整
+        item_timeout: 单条笔记的超时时间（秒）
+    """
+    return await core.get_comments_batch(urls, concurrency, item_timeout, progress=progress_reporter(ctx))
+
+def main(argv=None):
+    global PREWARM, TRACK_ENGAGEMENT
+    parser = argparse.ArgumentParser(description="小红书爬虫 MCP 服务器")
+    parser.add_argument("--prewarm", action="store_true", help="启动时预热浏览器")
+    parser.add_argument("--track-engagement", action="store_true", help="在后台按间隔采样跟踪笔记的互动数")
+    args = parser.parse_args(argv)
+    PREWARM = PREWARM or args.prewarm
+    TRACK_ENGAGEMENT = TRACK_ENGAGEMENT or args.track_engagement
+    mcp.run()
+
+if __name__ == "__main__":
+    main()
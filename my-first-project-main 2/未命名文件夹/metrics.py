@@ -0,0 +1,59 @@
+"""
+进程内运行指标
+
+计数器、仪表值和最近事件都保存在内存里，通过 /metrics 接口和 get_metrics 工具查看。
+标签以关键字参数传入，例如 inc("page_recycles_total", reason="notes")。
+"""
+from typing import Any, Dict, List, Optional, Tuple
+from collections import deque
+import threading
+import time
+
+_lock = threading.Lock()
+_counters: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+_gauges: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+_events: deque = deque(maxlen=200)
+_started_at = time.time()
+
+
+def _key(name: str, labels: Dict[str, Any]) -> Tuple[str, Tuple[Tuple[str, str], ...]]:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name: str, value: float = 1, **labels) -> None:
+    """计数器加 value"""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name: str, value: Optional[float], **labels) -> None:
+    """设置仪表值；value 为 None 时删除"""
+    key = _key(name, labels)
+    with _lock:
+        if value is None:
+            _gauges.pop(key, None)
+        else:
+            _gauges[key] = value
+
+
+def record_event(name: str, **fields) -> None:
+    """记录一条事件（只保留最近 200 条）"""
+    with _lock:
+        _events.append({"event": name, "time": time.strftime("%Y-%m-%d %H:%M:%S"), **fields})
+
+
+def _format(store: Dict) -> List[Dict[str, Any]]:
+    return [{"name": name, "labels": dict(labels), "value": value}
+            for (name, labels), value in sorted(store.items())]
+
+
+def snapshot() -> Dict[str, Any]:
+    """返回当前全部指标"""
+    with _lock:
+        return {
+            "uptime_seconds": round(time.time() - _started_at, 1),
+            "counters": _format(_counters),
+            "gauges": _format(_gauges),
+            "events": list(_events),
+        }
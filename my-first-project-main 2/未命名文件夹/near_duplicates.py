@@ -0,0 +1,240 @@
+"""
+近重复笔记检测（MinHash + 分段 LSH）
+
+每条笔记的标题、正文和标签规整后切成字符 3-gram，计算 NUM_PERM 个 MinHash 值作为指纹；
+指纹按 BANDS 段（每段 ROWS 个值）哈希进桶，只有至少一段落在同一个桶里的笔记才会被比较，
+查找近重复的开销与语料规模基本无关。估计 Jaccard 相似度不低于 threshold 的笔记归为同一簇。
+
+索引保存在 data/dedup.db，按笔记ID索引（没有ID的旧笔记按文件名），同时记录笔记所在的文件；
+笔记文件名会在不同次爬取之间重复使用，按文件名索引会让后来的笔记挤掉先前已完整抓取的那一条。
+crawl_notes_by_click 写入笔记时增量更新，
+开启 XHS_SKIP_DUPLICATE_DETAILS=1 后，与已完整抓取的笔记近重复时跳过评论展开和图片截图。
+"""
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import struct
+import sys
+import threading
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+DEDUP_DB_PATH = os.path.join(DATA_DIR, "dedup.db")
+
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 3
+DEFAULT_THRESHOLD = float(os.environ.get("XHS_DUPLICATE_THRESHOLD", 0.8))
+SKIP_DUPLICATE_DETAILS = os.environ.get("XHS_SKIP_DUPLICATE_DETAILS", "") == "1"
+
+_MERSENNE = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+# 固定种子生成的哈希参数，保证不同进程、不同时间算出的指纹可以比较
+_PERMS = [(int.from_bytes(hashlib.blake2b(f"a{i}".encode(), digest_size=8).digest(), "big") % (_MERSENNE - 1) + 1,
+           int.from_bytes(hashlib.blake2b(f"b{i}".encode(), digest_size=8).digest(), "big") % _MERSENNE)
+          for i in range(NUM_PERM)]
+_NORMALIZE_RE = re.compile(r'[\s\W_]+', re.U)
+_PLACEHOLDERS = ("未能获取内容", "未知标题")
+
+
+def doc_key(note_id: str, filename: str) -> str:
+    """索引中的文档键：优先笔记ID，没有时用文件名"""
+    return note_id or filename
+
+
+def note_text(note: Dict[str, Any]) -> str:
+    """参与指纹计算的文本：标题 + 正文 + 标签（去掉占位文本、空白和标点，统一小写）"""
+    parts = [note.get("标题") or "", note.get("内容") or ""]
+    parts += [t.lstrip("#") for t in note.get("标签") or []]
+    text = " ".join(p for p in parts if p and p not in _PLACEHOLDERS)
+    return _NORMALIZE_RE.sub("", text.replace("[话题]", "")).lower()
+
+
+def shingles(text: str, k: int = SHINGLE_SIZE) -> set:
+    if len(text) <= k:
+        return {text} if text else set()
+    return {text[i:i + k] for i in range(len(text) - k + 1)}
+
+
+def minhash(items: Iterable[str]) -> Tuple[int, ...]:
+    """计算 MinHash 签名；空集合返回全为最大值的签名（不会与任何笔记相似）"""
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "big") for s in items]
+    if not hashes:
+        return tuple([_MAX_HASH] * NUM_PERM)
+    return tuple(min((a * h + b) % _MERSENNE for h in hashes) & _MAX_HASH for a, b in _PERMS)
+
+
+def similarity(sig1: Tuple[int, ...], sig2: Tuple[int, ...]) -> float:
+    """两个签名相同位置相等的比例，即 Jaccard 相似度的估计"""
+    return sum(1 for x, y in zip(sig1, sig2) if x == y) / NUM_PERM
+
+
+def band_keys(sig: Tuple[int, ...]) -> List[int]:
+    """每段签名压成一个 64 位桶号"""
+    keys = []
+    for band in range(BANDS):
+        chunk = struct.pack(f"<{ROWS}I", *sig[band * ROWS:(band + 1) * ROWS])
+        keys.append(int.from_bytes(hashlib.blake2b(chunk, digest_size=8).digest(), "big", signed=True))
+    return keys
+
+
+def _pack(sig: Tuple[int, ...]) -> bytes:
+    return struct.pack(f"<{NUM_PERM}I", *sig)
+
+
+def _unpack(blob: bytes) -> Tuple[int, ...]:
+    return struct.unpack(f"<{NUM_PERM}I", blob)
+
+
+class DedupIndex:
+    """
+    持久化的 LSH 近重复索引
+    """
+
+    def __init__(self, db_path: str = DEDUP_DB_PATH, threshold: float = DEFAULT_THRESHOLD):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.threshold = threshold
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS docs (
+                doc_id TEXT PRIMARY KEY, title TEXT, sig BLOB NOT NULL, cluster TEXT NOT NULL,
+                complete INTEGER NOT NULL DEFAULT 0);
+            CREATE INDEX IF NOT EXISTS idx_docs_cluster ON docs (cluster);
+            CREATE TABLE IF NOT EXISTS bands (
+                band INTEGER NOT NULL, bucket INTEGER NOT NULL, doc_id TEXT NOT NULL,
+                PRIMARY KEY (band, bucket, doc_id)) WITHOUT ROWID;
+        """)
+        # 旧版本的库没有 file 列（当时 doc_id 就是文件名）
+        if "file" not in [row[1] for row in self.conn.execute("PRAGMA table_info(docs)")]:
+            self.conn.execute("ALTER TABLE docs ADD COLUMN file TEXT")
+
+    def _candidates(self, keys: List[int], exclude: Optional[str] = None) -> List[Tuple[str, str, bytes, str, int, str]]:
+        docs = set()
+        for band, key in enumerate(keys):
+            for (doc_id,) in self.conn.execute("SELECT doc_id FROM bands WHERE band = ? AND bucket = ?", (band, key)):
+                if doc_id != exclude:
+                    docs.add(doc_id)
+        rows = []
+        for doc_id in docs:
+            row = self.conn.execute("SELECT doc_id, title, sig, cluster, complete, COALESCE(file, doc_id) "
+                                    "FROM docs WHERE doc_id = ?", (doc_id,)).fetchone()
+            if row:
+                rows.append(row)
+        return rows
+
+    def find(self, note: Dict[str, Any], exclude: Optional[str] = None) -> List[Dict[str, Any]]:
+        """查找与 note 近重复的已索引笔记，按相似度从高到低返回"""
+        sig = minhash(shingles(note_text(note)))
+        return self._matches(sig, band_keys(sig), exclude)
+
+    def _matches(self, sig, keys, exclude=None) -> List[Dict[str, Any]]:
+        if sig[0] == _MAX_HASH and len(set(sig)) == 1:
+            return []
+        matches = []
+        for doc_id, title, blob, cluster, complete, file in self._candidates(keys, exclude):
+            sim = similarity(sig, _unpack(blob))
+            if sim >= self.threshold:
+                matches.append({"文档": doc_id, "文件": file, "标题": title, "相似度": round(sim, 3),
+                                "簇": cluster, "完整": bool(complete)})
+        return sorted(matches, key=lambda m: -m["相似度"])
+
+    def add(self, doc_id: str, note: Dict[str, Any], complete: bool = True,
+            file: Optional[str] = None) -> Dict[str, Any]:
+        """
+        索引一条笔记（doc_id 用 doc_key 生成，同一 doc_id 重复添加时覆盖），返回它所在的簇和近重复列表；
+        与多个簇相似时把这些簇合并。同一条笔记已有完整抓取的版本时，仍指向那个版本的文件
+        """
+        sig = minhash(shingles(note_text(note)))
+        keys = band_keys(sig)
+        file = file or doc_id
+        with self._lock, self.conn:
+            existing = self.conn.execute("SELECT complete, COALESCE(file, doc_id) FROM docs WHERE doc_id = ?",
+                                         (doc_id,)).fetchone()
+            if existing and existing[0] and not complete:
+                complete, file = True, existing[1]
+            self.conn.execute("DELETE FROM bands WHERE doc_id = ?", (doc_id,))
+            matches = self._matches(sig, keys, exclude=doc_id)
+            clusters = sorted({m["簇"] for m in matches})
+            cluster = clusters[0] if clusters else doc_id
+            for other in clusters[1:]:
+                self.conn.execute("UPDATE docs SET cluster = ? WHERE cluster = ?", (cluster, other))
+            self.conn.execute(
+                "INSERT OR REPLACE INTO docs (doc_id, title, sig, cluster, complete, file) VALUES (?, ?, ?, ?, ?, ?)",
+                (doc_id, note.get("标题", ""), _pack(sig), cluster, int(complete), file))
+            self.conn.executemany("INSERT OR IGNORE INTO bands (band, bucket, doc_id) VALUES (?, ?, ?)",
+                                  [(band, key, doc_id) for band, key in enumerate(keys)])
+        return {"簇": cluster, "近重复": matches}
+
+    def clusters(self, min_size: int = 2) -> List[Dict[str, Any]]:
+        """列出成员数不少于 min_size 的簇"""
+        rows = self.conn.execute(
+            "SELECT cluster, COUNT(*) AS n FROM docs GROUP BY cluster HAVING n >= ? ORDER BY n DESC", (min_size,))
+        result = []
+        for cluster, n in rows.fetchall():
+            members = [{"文档": d, "文件": f, "标题": t} for d, f, t in
+                       self.conn.execute("SELECT doc_id, COALESCE(file, doc_id), title FROM docs "
+                                         "WHERE cluster = ? ORDER BY doc_id", (cluster,))]
+            result.append({"簇": cluster, "数量": n, "成员": members})
+        return result
+
+    def rebuild(self, notes_dir: Optional[str] = None) -> int:
+        """清空索引并从已爬取语料重建"""
+        from notes_corpus import iter_notes
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM bands")
+            self.conn.execute("DELETE FROM docs")
+        count = 0
+        for note in iter_notes(notes_dir):
+            # 因近重复而跳过了评论和图片的笔记带有 "重复于" 头部字段
+            self.add(doc_key(note["笔记ID"], note["文件名"]), note, complete=not note.get("重复于"),
+                     file=note["文件名"])
+            count += 1
+        return count
+
+
+_index: Optional[DedupIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_dedup_index() -> DedupIndex:
+    """获取全局近重复索引（首次调用时打开）"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = DedupIndex()
+    return _index
+
+
+def complete_duplicate(note: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """返回与 note 近重复且已完整抓取（有评论和图片）的笔记，没有时返回 None"""
+    for match in get_dedup_index().find(note):
+        if match["完整"]:
+            return match
+    return None
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="近重复笔记检测")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_rebuild = sub.add_parser("rebuild", help="从已爬取语料重建近重复索引")
+    p_rebuild.add_argument("--notes-dir", default=None)
+    p_clusters = sub.add_parser("clusters", help="列出近重复簇")
+    p_clusters.add_argument("--min-size", type=int, default=2)
+    args = parser.parse_args(argv)
+
+    index = get_dedup_index()
+    if args.command == "rebuild":
+        print(json.dumps({"索引笔记数": index.rebuild(args.notes_dir)}, ensure_ascii=False))
+    else:
+        print(json.dumps(index.clusters(args.min_size), ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,160 @@
+"""
+已爬取语料的统计聚合（物化视图）
+
+聚合结果存放在 data/stats.db 的 agg 表中，按 (维度, 键) 计数，并在 (维度, 计数) 上建索引，
+查询热门标签/作者等只需索引扫描，与语料规模无关。
+crawl_notes_by_click 每写入一条笔记就调用 record_note 增量更新；同一文件被覆盖时先扣除旧的贡献。
+"""
+from typing import Any, Dict, List, Optional
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+STATS_DB_PATH = os.path.join(DATA_DIR, "stats.db")
+
+# 聚合维度
+DIM_TAG = "tag"
+DIM_AUTHOR = "author"
+DIM_KEYWORD_NOTES = "keyword_notes"
+DIM_KEYWORD_COMMENTS = "keyword_comments"
+DIM_DOMAIN = "domain"
+DIM_DAY = "day"
+DIM_TOTAL = "total"
+
+
+def note_contribution(note: Dict[str, Any]) -> Dict[str, Dict[str, int]]:
+    """计算一条笔记对各维度计数的贡献"""
+    from domain_classifier import get_classifier
+    from notes_corpus import crawl_date
+
+    keyword = note.get("搜索关键词") or "未知"
+    comments = len(note.get("评论") or [])
+    contribution: Dict[str, Dict[str, int]] = {
+        DIM_TAG: {},
+        DIM_AUTHOR: {note.get("作者") or "未知作者": 1},
+        DIM_KEYWORD_NOTES: {keyword: 1},
+        DIM_KEYWORD_COMMENTS: {keyword: comments},
+        DIM_DOMAIN: {},
+        DIM_DAY: {crawl_date(note): 1},
+        DIM_TOTAL: {"notes": 1, "comments": comments},
+    }
+    for tag in note.get("标签") or []:
+        tag = tag.lstrip("#").strip()
+        if tag:
+            contribution[DIM_TAG][tag] = 1
+    for detail in get_classifier().classify_note(note):
+        contribution[DIM_DOMAIN][detail["领域"]] = 1
+    return contribution
+
+
+class NoteStats:
+    """
+    增量维护的语料统计
+    """
+
+    def __init__(self, db_path: str = STATS_DB_PATH):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS agg (dim TEXT NOT NULL, key TEXT NOT NULL, n INTEGER NOT NULL,
+                                            PRIMARY KEY (dim, key));
+            CREATE INDEX IF NOT EXISTS agg_top ON agg (dim, n DESC);
+            CREATE TABLE IF NOT EXISTS contrib (doc_id TEXT PRIMARY KEY, mtime REAL NOT NULL, data TEXT NOT NULL);
+        """)
+
+    def _apply(self, contribution: Dict[str, Dict[str, int]], sign: int) -> None:
+        rows = [(dim, key, sign * n) for dim, counts in contribution.items() for key, n in counts.items() if n]
+        self._conn.executemany(
+            "INSERT INTO agg (dim, key, n) VALUES (?, ?, ?) ON CONFLICT(dim, key) DO UPDATE SET n = n + excluded.n",
+            rows)
+
+    def record_note(self, doc_id: str, note: Dict[str, Any], mtime: float = 0.0) -> None:
+        """记录一条新写入（或被覆盖）的笔记"""
+        contribution = note_contribution(note)
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT data FROM contrib WHERE doc_id = ?", (doc_id,)).fetchone()
+            if row:
+                self._apply(json.loads(row[0]), -1)
+            self._apply(contribution, 1)
+            self._conn.execute("DELETE FROM agg WHERE n <= 0")
+            self._conn.execute("INSERT OR REPLACE INTO contrib (doc_id, mtime, data) VALUES (?, ?, ?)",
+                               (doc_id, mtime, json.dumps(contribution, ensure_ascii=False)))
+
+    def rebuild(self, notes_dir: Optional[str] = None) -> int:
+        """清空后按磁盘上的全部笔记重建统计，返回笔记数"""
+        from notes_corpus import iter_notes
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM agg")
+            self._conn.execute("DELETE FROM contrib")
+        count = 0
+        for note in iter_notes(notes_dir):
+            self.record_note(note["文件名"], note, mtime=note["mtime"])
+            count += 1
+        return count
+
+    def top(self, dim: str, limit: int = 10) -> List[Dict[str, Any]]:
+        return [{"key": key, "count": n} for key, n in self._conn.execute(
+            "SELECT key, n FROM agg WHERE dim = ? ORDER BY n DESC, key LIMIT ?", (dim, limit))]
+
+    def all(self, dim: str) -> Dict[str, int]:
+        return dict(self._conn.execute("SELECT key, n FROM agg WHERE dim = ? ORDER BY key", (dim,)))
+
+    def summary(self, limit: int = 10) -> Dict[str, Any]:
+        """汇总 /stats 返回的全部统计"""
+        start = time.perf_counter()
+        totals = self.all(DIM_TOTAL)
+        result = {
+            "笔记总数": totals.get("notes", 0),
+            "评论总数": totals.get("comments", 0),
+            "热门标签": self.top(DIM_TAG, limit),
+            "热门作者": self.top(DIM_AUTHOR, limit),
+            "关键词评论量": self.top(DIM_KEYWORD_COMMENTS, limit),
+            "关键词笔记数": self.top(DIM_KEYWORD_NOTES, limit),
+            "领域分布": self.all(DIM_DOMAIN),
+            "每日笔记数": self.all(DIM_DAY),
+        }
+        result["查询耗时ms"] = round((time.perf_counter() - start) * 1000, 3)
+        return result
+
+
+_stats: Optional[NoteStats] = None
+_stats_lock = threading.Lock()
+
+
+def get_note_stats() -> NoteStats:
+    """获取全局统计对象（首次调用时打开统计库）"""
+    global _stats
+    if _stats is None:
+        with _stats_lock:
+            if _stats is None:
+                _stats = NoteStats()
+    return _stats
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="已爬取语料统计")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_rebuild = sub.add_parser("rebuild", help="按磁盘上的全部笔记重建统计")
+    p_rebuild.add_argument("--notes-dir", default=None)
+    p_show = sub.add_parser("show", help="输出当前统计")
+    p_show.add_argument("--top", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    stats = get_note_stats()
+    if args.command == "rebuild":
+        start = time.perf_counter()
+        count = stats.rebuild(args.notes_dir)
+        print(json.dumps({"笔记数": count, "耗时s": round(time.perf_counter() - start, 2)}, ensure_ascii=False))
+    else:
+        print(json.dumps(stats.summary(args.top), ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""
+已爬取笔记（scraped_notes/*.md）的读取与解析
+
+crawl_notes_by_click 把每条笔记写成一个 markdown 文件，这里负责把它还原成结构化记录，
+供领域分类、关键词统计等批处理功能按需逐条读取。
+"""
+from typing import Any, Dict, Iterator, List, Optional
+from datetime import datetime
+import glob
+import os
+import re
+
+NOTES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scraped_notes")
+
+# 评论行格式：1. 用户名（时间）: 内容
+COMMENT_LINE_RE = re.compile(r'^(\d+)\. (.*?)（(.*?)）: (.*)$')
+# 头部字段格式：- 作者：xxx
+META_LINE_RE = re.compile(r'^- (.+?)：(.*)$')
+NOTE_ID_RE = re.compile(r'/(?:explore|discovery/item|search_result)/([0-9a-zA-Z]+)')
+
+
+def parse_note_markdown(text: str) -> Dict[str, Any]:
+    """
+    把 crawl_notes_by_click 写出的 markdown 解析为笔记记录
+    """
+    note: Dict[str, Any] = {
+        "标题": "未知标题",
+        "作者": "未知作者",
+        "发布时间": "未知",
+        "标签": [],
+        "内容": "",
+        "图片": [],
+        "评论": [],
+    }
+    section = None
+    body_lines: List[str] = []
+    for line in text.splitlines():
+        if line.startswith("# ") and section is None and note["标题"] == "未知标题":
+            note["标题"] = line[2:].strip() or "未知标题"
+            section = "头部"
+            continue
+        if line.startswith("## "):
+            section = line[3:].strip()
+            continue
+        if section == "头部":
+            m = META_LINE_RE.match(line)
+            if m:
+                key, value = m.group(1).strip(), m.group(2).strip()
+                if key == "标签":
+                    note["标签"] = [] if value in ("", "无") else [t.strip() for t in value.split("、") if t.strip()]
+                else:
+                    note[key] = value
+        elif section == "正文":
+            body_lines.append(line)
+        elif section == "图片":
+            for src in re.findall(r'!\[[^\]]*\]\(([^)]+)\)', line):
+                note["图片"].append(src)
+        elif section == "评论":
+            m = COMMENT_LINE_RE.match(line)
+            if m:
+                note["评论"].append({"用户名": m.group(2), "时间": m.group(3), "内容": m.group(4)})
+            elif line.strip() and note["评论"]:
+                # 评论内容本身带换行时，续接到上一条
+                note["评论"][-1]["内容"] += "\n" + line
+    note["内容"] = "\n".join(body_lines).strip()
+    return note
+
+
+def note_id_from_url(url: str) -> str:
+    """从笔记链接中提取笔记ID（/explore/<id> 或 /discovery/item/<id>）"""
+    m = NOTE_ID_RE.search(url or "")
+    return m.group(1) if m else ""
+
+
+def crawl_date(note: Dict[str, Any]) -> str:
+    """笔记的抓取日期（YYYY-MM-DD）；旧文件没有抓取时间时使用文件修改时间"""
+    crawl_time = note.get("抓取时间") or ""
+    if re.match(r'^\d{4}-\d{2}-\d{2}', crawl_time):
+        return crawl_time[:10]
+    if note.get("mtime"):
+        return datetime.fromtimestamp(note["mtime"]).strftime("%Y-%m-%d")
+    return "unknown"
+
+
+def load_note_file(path: str) -> Dict[str, Any]:
+    """读取并解析单个笔记文件，附带文件名和修改时间"""
+    with open(path, "r", encoding="utf-8") as f:
+        note = parse_note_markdown(f.read())
+    note["文件名"] = os.path.basename(path)
+    note["mtime"] = os.path.getmtime(path)
+    note["笔记ID"] = note_id_from_url(note.get("链接", ""))
+    return note
+
+
+def list_note_files(notes_dir: Optional[str] = None) -> List[str]:
+    """按文件名排序列出所有笔记文件"""
+    return sorted(glob.glob(os.path.join(notes_dir or NOTES_DIR, "*.md")))
+
+
+def iter_notes(notes_dir: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """
+    逐条产出笔记记录，不会一次性把整个语料读进内存
+    """
+    for path in list_note_files(notes_dir):
+        try:
+            yield load_note_file(path)
+        except (OSError, UnicodeDecodeError) as e:
+            print(f"[日志] 读取笔记失败 {path}: {e}")
+            continue
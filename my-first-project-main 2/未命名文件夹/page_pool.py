@@ -0,0 +1,176 @@
+"""
+页面租借池：让并发的工具调用各自使用独立页面，而不是共同操作 main_page
+
+- 池中页面都来自同一个持久化浏览器上下文，共享登录 Cookie
+- 池满时按先来先到的顺序排队等待；给了 limit 时同时租出的页面数随它变化（站点节奏控制器的并发上限），
+  size 是硬上限
+- 归还时由 on_release 钩子决定页面是否继续复用（例如超过内存阈值时直接关闭）
+- 重启浏览器前调用 pause：新的租借先等待，已租出的页面用完归还后再重启，resume 后恢复租借
+"""
+from typing import Any, Awaitable, Callable, Deque, List, Optional, Set
+from collections import deque
+from contextlib import asynccontextmanager
+import asyncio
+import time
+
+import metrics
+
+
+class PagePool:
+    """
+    有上限的页面池
+
+    Args:
+        factory: 创建新页面的协程函数
+        size: 同时租出的页面数硬上限
+        on_release: 归还时调用，返回 False 表示关闭该页面而不是放回池中
+        limit: 返回当前允许同时租出的页面数，每次租借和归还时重新读取
+    """
+
+    def __init__(self, factory: Callable[[], Awaitable[Any]], size: int = 3,
+                 on_release: Optional[Callable[[Any], Awaitable[bool]]] = None,
+                 limit: Optional[Callable[[], int]] = None):
+        self.factory = factory
+        self.size = max(1, size)
+        self.on_release = on_release
+        self.limit = limit
+        self._idle: List[Any] = []
+        self._leased: Set[Any] = set()
+        self._slots_used = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._lock = asyncio.Lock()
+        self._open = asyncio.Event()
+        self._open.set()
+
+    @property
+    def in_use(self) -> int:
+        return self._slots_used
+
+    @property
+    def leased(self) -> int:
+        return len(self._leased)
+
+    @property
+    def capacity(self) -> int:
+        """当前允许同时租出的页面数"""
+        if self.limit is None:
+            return self.size
+        return max(1, min(self.size, self.limit()))
+
+    def _report(self) -> None:
+        metrics.set_gauge("page_pool_capacity", self.capacity)
+        metrics.set_gauge("page_pool_in_use", self._slots_used)
+        metrics.set_gauge("page_pool_idle", len(self._idle))
+        metrics.set_gauge("page_pool_waiters", len(self._waiters))
+
+    async def _take_slot(self) -> None:
+        """占用一个租借名额；没有空位时排队，保证先到先得"""
+        if self._slots_used < self.capacity and not self._waiters:
+            self._slots_used += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._report()
+        try:
+            # 被唤醒时名额由归还方直接转交，计数不变
+            await waiter
+        except asyncio.CancelledError:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            elif waiter.done() and not waiter.cancelled():
+                # 名额已经转交过来但调用方被取消了，把名额让出去
+                self._give_back_slot()
+            raise
+
+    def _give_back_slot(self) -> None:
+        """释放一个名额，再按当前容量依次放行排队的调用方（容量变大时一次放行多个，变小时不放行）"""
+        self._slots_used -= 1
+        while self._waiters and self._slots_used < self.capacity:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self._slots_used += 1
+                waiter.set_result(None)
+
+    async def acquire(self) -> Any:
+        """租借一个页面"""
+        start = time.monotonic()
+        await self._take_slot()
+        try:
+            # 浏览器即将重启时拿着名额等待，重启完成后再取页面
+            await self._open.wait()
+            page = None
+            async with self._lock:
+                while self._idle:
+                    candidate = self._idle.pop()
+                    if not candidate.is_closed():
+                        page = candidate
+                        break
+            if page is None:
+                page = await self.factory()
+        except BaseException:
+            self._give_back_slot()
+            self._report()
+            raise
+        self._leased.add(page)
+        metrics.inc("page_pool_leases_total")
+        metrics.inc("page_pool_wait_seconds_total", time.monotonic() - start)
+        self._report()
+        return page
+
+    async def release(self, page: Any, discard: bool = False) -> None:
+        """归还页面；discard 为 True 或钩子拒绝复用时关闭页面"""
+        self._leased.discard(page)
+        try:
+            keep = not discard and not page.is_closed()
+            if keep and self.on_release is not None:
+                keep = await self.on_release(page)
+            if keep:
+                async with self._lock:
+                    self._idle.append(page)
+            elif not page.is_closed():
+                await page.close()
+        except Exception as e:
+            print(f"[日志] 归还页面出错: {e}")
+        finally:
+            self._give_back_slot()
+            self._report()
+
+    @asynccontextmanager
+    async def lease(self):
+        """async with pool.lease() as page: ..."""
+        page = await self.acquire()
+        failed = False
+        try:
+            yield page
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            # 出错或被取消的页面可能停在半途，直接丢弃，下次重新创建
+            await self.release(page, discard=failed)
+
+    async def pause(self, timeout: float) -> bool:
+        """
+        暂停新的租借并等待已租出的页面全部归还，最多等待 timeout 秒；全部归还时返回 True
+        """
+        self._open.clear()
+        deadline = time.monotonic() + timeout
+        while self._leased and time.monotonic() < deadline:
+            await asyncio.sleep(0.2)
+        return not self._leased
+
+    def resume(self) -> None:
+        """恢复租借"""
+        self._open.set()
+
+    async def reset(self) -> None:
+        """浏览器重启后调用：丢弃空闲页面，已租出的页面在归还时自然丢弃"""
+        async with self._lock:
+            idle, self._idle = self._idle, []
+        for page in idle:
+            try:
+                if not page.is_closed():
+                    await page.close()
+            except Exception:
+                pass
+        self._report()
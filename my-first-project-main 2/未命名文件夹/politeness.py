@@ -0,0 +1,234 @@
+"""
+按站点自适应的请求节奏控制（AIMD）
+
+每个 host 一个 HostPacer，统计最近一段时间的导航耗时、出错率和空结果率：
+- 各项指标都健康时，允许的并发数和请求速率加性增加（+1 并发 / +rate_step 次每秒）
+- 出错、空结果或耗时超过目标值时，乘性减小（× decrease_factor），并在冷却期内不再重复减小
+并发数和速率始终限制在配置的上下限之间，当前状态通过 metrics 仪表值暴露。
+页面池和批量任务的并发数也跟随这里的并发上限（AdaptiveLimit），站点响应快时抓取跟着变快。
+"""
+from typing import Any, Callable, Deque, Dict, Optional
+from collections import deque
+from contextlib import asynccontextmanager
+from urllib.parse import urlparse
+import asyncio
+import os
+import time
+
+import metrics
+
+
+class PacingConfig:
+    """节奏控制参数，均可通过环境变量覆盖"""
+
+    def __init__(self):
+        self.min_concurrency = int(os.environ.get("XHS_PACING_MIN_CONCURRENCY", 1))
+        self.max_concurrency = int(os.environ.get("XHS_PACING_MAX_CONCURRENCY", 8))
+        self.initial_concurrency = int(os.environ.get("XHS_PACING_INITIAL_CONCURRENCY", 2))
+        self.min_rate = float(os.environ.get("XHS_PACING_MIN_RATE", 0.2))
+        self.max_rate = float(os.environ.get("XHS_PACING_MAX_RATE", 4.0))
+        self.initial_rate = float(os.environ.get("XHS_PACING_INITIAL_RATE", 1.0))
+        self.rate_step = float(os.environ.get("XHS_PACING_RATE_STEP", 0.2))
+        self.decrease_factor = float(os.environ.get("XHS_PACING_DECREASE_FACTOR", 0.5))
+        self.target_latency = float(os.environ.get("XHS_PACING_TARGET_LATENCY", 5.0))
+        self.max_error_rate = float(os.environ.get("XHS_PACING_MAX_ERROR_RATE", 0.1))
+        self.max_empty_rate = float(os.environ.get("XHS_PACING_MAX_EMPTY_RATE", 0.3))
+        self.window = int(os.environ.get("XHS_PACING_WINDOW", 20))
+        # 每积累这么多个样本评估一次是否加性增加
+        self.increase_every = int(os.environ.get("XHS_PACING_INCREASE_EVERY", 5))
+        self.decrease_cooldown = float(os.environ.get("XHS_PACING_DECREASE_COOLDOWN", 10))
+
+
+class RequestOutcome:
+    """一次请求的结果，调用方可在 async with 块内标记 error（如 HTTP 429）或 empty"""
+
+    def __init__(self):
+        self.error = False
+        self.empty = False
+
+
+class HostPacer:
+    """
+    单个 host 的并发上限 + 请求间隔控制
+    """
+
+    def __init__(self, host: str, config: Optional[PacingConfig] = None):
+        self.host = host
+        self.config = config or PacingConfig()
+        c = self.config
+        self.concurrency = max(c.min_concurrency, min(c.max_concurrency, c.initial_concurrency))
+        self.rate = max(c.min_rate, min(c.max_rate, c.initial_rate))
+        self.in_flight = 0
+        self._samples: Deque[Dict[str, Any]] = deque(maxlen=c.window)
+        self._results: Deque[bool] = deque(maxlen=c.window)
+        self._since_adjust = 0
+        self._last_decrease = 0.0
+        self._next_start = 0.0
+        self._cond = asyncio.Condition()
+        self._report()
+
+    # ---------- 节奏 ----------
+
+    async def _acquire(self) -> None:
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < self.concurrency)
+            self.in_flight += 1
+            # 按当前速率排出开始时间，并发请求依次错开
+            now = time.monotonic()
+            start = max(now, self._next_start)
+            self._next_start = start + 1.0 / self.rate
+        delay = start - now
+        if delay > 0:
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                await self._release()
+                raise
+
+    async def _release(self) -> None:
+        async with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    @asynccontextmanager
+    async def request(self):
+        """
+        async with pacer.request() as outcome: ...
+        块内抛出异常记为出错（取消不计）；抛出前已标记 outcome.empty 的记为空结果
+        """
+        await self._acquire()
+        outcome = RequestOutcome()
+        start = time.monotonic()
+        cancelled = False
+        try:
+            yield outcome
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        except Exception:
+            outcome.error = not outcome.empty
+            raise
+        finally:
+            await self._release()
+            if not cancelled:
+                self.record(time.monotonic() - start, error=outcome.error)
+                if outcome.empty:
+                    self.record_result(empty=True)
+
+    # ---------- 反馈 ----------
+
+    def record(self, latency: float, error: bool = False) -> None:
+        """记录一次请求的耗时和是否出错"""
+        self._samples.append({"latency": latency, "error": error})
+        metrics.inc("pacing_requests_total", host=self.host, result="error" if error else "ok")
+        self._adjust(bad=error or latency > self.config.target_latency)
+
+    def record_result(self, empty: bool) -> None:
+        """
+        记录一次提取结果是否为空：页面加载成功却没有内容，通常说明已被限流
+        """
+        self._results.append(empty)
+        metrics.inc("pacing_results_total", host=self.host, result="empty" if empty else "ok")
+        self._adjust(bad=empty)
+
+    def _adjust(self, bad: bool) -> None:
+        """按 AIMD 调整并发数和速率"""
+        self._since_adjust += 1
+        c = self.config
+        now = time.monotonic()
+        if bad:
+            # 单个坏样本只在窗口整体也变差时才触发减小，避免偶发抖动
+            if self._window_unhealthy() and now - self._last_decrease >= c.decrease_cooldown:
+                self._decrease(now)
+        elif self._since_adjust >= c.increase_every and not self._window_unhealthy():
+            self._increase()
+        self._report()
+
+    def _stats(self) -> Dict[str, float]:
+        n = len(self._samples) or 1
+        latencies = sorted(s["latency"] for s in self._samples) or [0.0]
+        return {
+            "error_rate": sum(s["error"] for s in self._samples) / n,
+            "empty_rate": sum(self._results) / (len(self._results) or 1),
+            "latency_p50": latencies[len(latencies) // 2],
+        }
+
+    def _window_unhealthy(self) -> bool:
+        c = self.config
+        stats = self._stats()
+        return (stats["error_rate"] > c.max_error_rate or stats["empty_rate"] > c.max_empty_rate
+                or stats["latency_p50"] > c.target_latency)
+
+    def _increase(self) -> None:
+        c = self.config
+        self._since_adjust = 0
+        self.concurrency = min(c.max_concurrency, self.concurrency + 1)
+        self.rate = min(c.max_rate, self.rate + c.rate_step)
+        self._wake()
+
+    def _decrease(self, now: float) -> None:
+        c = self.config
+        self._since_adjust = 0
+        self._last_decrease = now
+        concurrency = max(c.min_concurrency, int(self.concurrency * c.decrease_factor))
+        rate = max(c.min_rate, self.rate * c.decrease_factor)
+        if concurrency == self.concurrency and rate == self.rate:
+            return
+        self.concurrency, self.rate = concurrency, rate
+        metrics.inc("pacing_decreases_total", host=self.host)
+        metrics.record_event("pacing_decrease", host=self.host, concurrency=self.concurrency,
+                             rate=round(self.rate, 2), **{k: round(v, 2) for k, v in self._stats().items()})
+        print(f"[日志] {self.host} 响应变差，降低节奏：并发 {self.concurrency}，速率 {self.rate:.2f}/s")
+
+    def _wake(self) -> None:
+        """并发上限提高后唤醒排队的请求"""
+        async def notify():
+            async with self._cond:
+                self._cond.notify_all()
+        try:
+            asyncio.get_running_loop().create_task(notify())
+        except RuntimeError:
+            pass
+
+    def _report(self) -> None:
+        stats = self._stats()
+        metrics.set_gauge("pacing_concurrency", self.concurrency, host=self.host)
+        metrics.set_gauge("pacing_rate", round(self.rate, 3), host=self.host)
+        metrics.set_gauge("pacing_in_flight", self.in_flight, host=self.host)
+        metrics.set_gauge("pacing_error_rate", round(stats["error_rate"], 3), host=self.host)
+        metrics.set_gauge("pacing_empty_rate", round(stats["empty_rate"], 3), host=self.host)
+        metrics.set_gauge("pacing_latency_p50", round(stats["latency_p50"], 3), host=self.host)
+
+
+class AdaptiveLimit:
+    """
+    上限随 limit() 变化的信号量：async with gate: ...；每次进入和退出时重新读取上限
+    """
+
+    def __init__(self, limit: Callable[[], int]):
+        self.limit = limit
+        self.active = 0
+        self._cond = asyncio.Condition()
+
+    async def __aenter__(self) -> "AdaptiveLimit":
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.active < max(1, self.limit()))
+            self.active += 1
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        async with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+
+_pacers: Dict[str, HostPacer] = {}
+
+
+def get_pacer(url: str) -> HostPacer:
+    """按 URL 的 host 获取节奏控制器"""
+    host = urlparse(url).netloc or url
+    pacer = _pacers.get(host)
+    if pacer is None:
+        pacer = _pacers[host] = HostPacer(host)
+    return pacer
@@ -0,0 +1,150 @@
+"""
+把 CPU 密集和阻塞磁盘的后处理移出浏览器事件循环
+
+驱动 Playwright 的事件循环同时处理所有页面的 CDP 消息，循环里每多跑 1 毫秒的正则、Markdown 拼接、
+分词和领域分类、gzip 压缩或同步写文件，其他页面的浏览器操作就晚 1 毫秒。这里提供一个有界的线程池：
+    await run(fn, *args)     在线程池中执行并等待结果，等待期间事件循环继续处理其他页面
+    await submit(fn, *args)  排队后立即返回、不等待完成；排队和执行中的任务达到 XHS_POSTPROCESS_QUEUE 时
+                             等待空位（背压），抓取速度不会把后处理积压撑爆内存
+    await drain()            等待已提交的任务全部完成
+
+用线程而不是进程：分词词典和各索引的 sqlite 连接都在进程内共享，不需要在每个进程里重新加载。
+纯 Python 计算仍受 GIL 限制，但解释器每隔 sys.getswitchinterval()（默认 5 毫秒）就会切回事件循环，
+循环的停顿从整段计算缩短到一个切换间隔；sqlite、gzip、写文件和 fsync 期间则完全释放 GIL。
+
+monitor_loop_lag 周期性测量事件循环的调度延迟（event_loop_lag_ms 等指标），
+用来确认浏览器操作的延迟不再随分析开销变化。
+"""
+from typing import Any, Callable, Optional, Set, Union
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import functools
+import os
+import threading
+import time
+
+import metrics
+
+POSTPROCESS_THREADS = int(os.environ.get("XHS_POSTPROCESS_THREADS", 2))
+POSTPROCESS_QUEUE = int(os.environ.get("XHS_POSTPROCESS_QUEUE", 32))
+# 事件循环延迟的采样间隔（秒）和计为一次卡顿的阈值（毫秒）
+LAG_INTERVAL = float(os.environ.get("XHS_LOOP_LAG_INTERVAL", 0.5))
+LAG_STALL_MS = float(os.environ.get("XHS_LOOP_STALL_MS", 100))
+
+
+def write_file(path: str, data: Union[str, bytes], append: bool = False, fsync: bool = False) -> None:
+    """写入文本或二进制文件；fsync 为 True 时落盘后才返回"""
+    binary = isinstance(data, bytes)
+    mode = ("a" if append else "w") + ("b" if binary else "")
+    with open(path, mode, **({} if binary else {"encoding": "utf-8"})) as f:
+        f.write(data)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class PostProcessor:
+    """
+    有界线程池 + 背压；绑定在第一次使用它的事件循环上（浏览器所在的循环）
+    """
+
+    def __init__(self, threads: int = POSTPROCESS_THREADS, queue_size: int = POSTPROCESS_QUEUE):
+        self.queue_size = max(1, queue_size)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, threads), thread_name_prefix="postprocess")
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._pending: Set[asyncio.Task] = set()
+        self._inflight = 0
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # 命令行每次 asyncio.run 都是新的事件循环，信号量和待完成任务跟着换
+            self._loop = loop
+            self._slots = asyncio.Semaphore(self.queue_size)
+            self._pending = set()
+        return self._slots
+
+    async def _execute(self, fn: Callable, args: tuple, label: str) -> Any:
+        self._inflight += 1
+        metrics.set_gauge("postprocess_inflight", self._inflight)
+        start = time.perf_counter()
+        try:
+            return await self._loop.run_in_executor(self._executor, functools.partial(fn, *args))
+        finally:
+            self._inflight -= 1
+            metrics.set_gauge("postprocess_inflight", self._inflight)
+            metrics.inc("postprocess_tasks_total", kind=label)
+            metrics.inc("postprocess_seconds_total", time.perf_counter() - start, kind=label)
+
+    async def run(self, fn: Callable, *args, label: str = "task") -> Any:
+        """在线程池中执行 fn(*args) 并返回结果（异常原样抛出）"""
+        async with self._semaphore():
+            return await self._execute(fn, args, label)
+
+    async def submit(self, fn: Callable, *args, label: str = "task") -> asyncio.Task:
+        """提交后台任务，不等待完成；失败只记录日志和指标"""
+        slots = self._semaphore()
+        if slots.locked():
+            metrics.inc("postprocess_backpressure_total", kind=label)
+        await slots.acquire()
+
+        async def job():
+            try:
+                return await self._execute(fn, args, label)
+            except Exception as e:
+                print(f"[日志] 后处理任务 {label} 失败: {e}")
+                metrics.inc("postprocess_errors_total", kind=label)
+            finally:
+                slots.release()
+        task = asyncio.ensure_future(job())
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+        return task
+
+    async def drain(self) -> None:
+        """等待已提交的后台任务全部完成"""
+        while self._pending and self._loop is asyncio.get_running_loop():
+            await asyncio.gather(*list(self._pending), return_exceptions=True)
+
+
+async def monitor_loop_lag(interval: float = LAG_INTERVAL) -> None:
+    """每 interval 秒测量一次事件循环的调度延迟（实际醒来时间 - 预定时间），一直运行到被取消"""
+    worst = 0.0
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag_ms = max(0.0, (time.perf_counter() - start - interval) * 1000)
+        metrics.set_gauge("event_loop_lag_ms", round(lag_ms, 2))
+        metrics.inc("event_loop_lag_samples_total")
+        metrics.inc("event_loop_lag_ms_total", lag_ms)
+        if lag_ms > worst:
+            worst = lag_ms
+            metrics.set_gauge("event_loop_lag_max_ms", round(worst, 2))
+        if lag_ms >= LAG_STALL_MS:
+            metrics.inc("event_loop_stalls_total")
+
+
+_lag_task: Optional[asyncio.Task] = None
+
+
+def start_lag_monitor() -> None:
+    """在当前事件循环中启动延迟监测（已在运行时不重复启动）"""
+    global _lag_task
+    loop = asyncio.get_running_loop()
+    if _lag_task is None or _lag_task.done() or _lag_task.get_loop() is not loop:
+        _lag_task = loop.create_task(monitor_loop_lag())
+
+
+_processor: Optional[PostProcessor] = None
+_processor_lock = threading.Lock()
+
+
+def get_post_processor() -> PostProcessor:
+    """获取全局后处理线程池（首次调用时创建）"""
+    global _processor
+    if _processor is None:
+        with _processor_lock:
+            if _processor is None:
+                _processor = PostProcessor()
+    return _processor
@@ -0,0 +1,499 @@
+"""
+已爬取语料的本地全文检索（字符 bigram 倒排索引 + BM25）
+
+中文文本按连续汉字切成字符 bigram（单独一个汉字时保留单字），英文和数字按整词索引；
+每条笔记（标题 + 正文 + 标签）和它的每条评论各是一个文档。
+
+索引由若干只读段文件组成（data/search_index/seg_*.seg），打开时整体 mmap，
+词典有序存放、二分查找，倒排表直接在映射内存上读取，不需要把索引加载进内存：
+- crawl_notes_by_click 每写入一条笔记就追加一个小段，同一笔记旧的文档在所在段中标记删除
+- 段数超过 MERGE_FACTOR 时把最小的几个段合并成一个，合并时丢弃已删除的文档
+- manifest.json 记录当前的段和删除标记，其他进程查询时发现它变化会重新加载；
+  写入时持有 write.lock 文件锁，批量爬取的多个子进程可以同时写同一个索引
+"""
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from array import array
+from collections import Counter
+from contextlib import contextmanager
+import argparse
+import heapq
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import sys
+import threading
+import time
+import unicodedata
+
+try:
+    import fcntl
+except ImportError:  # Windows 上没有 fcntl，只做进程内加锁
+    fcntl = None
+
+import metrics
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+SEARCH_DIR = os.path.join(DATA_DIR, "search_index")
+MANIFEST_NAME = "manifest.json"
+
+MERGE_FACTOR = int(os.environ.get("XHS_SEARCH_MERGE_FACTOR", 8))
+REBUILD_BATCH = 5000
+TITLE_BOOST = 2
+BM25_K1 = 1.2
+BM25_B = 0.75
+SNIPPET_CHARS = 80
+
+KIND_NOTE = "笔记"
+KIND_COMMENT = "评论"
+
+# 汉字、假名、谚文按字符 bigram 切分，其余按字母数字整词
+_CJK_RUN_RE = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]+')
+_WORD_RE = re.compile(r'[a-z0-9]+')
+
+# 段文件：头部之后依次是以下各节，每节按 4 字节对齐
+_MAGIC = b"XSEG"
+_FORMAT_VERSION = 1
+_SECTIONS = ("doc_len", "store_off", "store", "term_off", "terms", "post_off", "postings",
+             "key_off", "keys", "key_range")
+_HEADER = struct.Struct("=4sIIIIQ" + "QQ" * len(_SECTIONS))
+
+
+def tokenize(text: str) -> List[str]:
+    """把文本切成索引词：汉字 bigram + 英文数字整词"""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    tokens = []
+    for run in _CJK_RUN_RE.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    tokens.extend(_WORD_RE.findall(_CJK_RUN_RE.sub(" ", text)))
+    return tokens
+
+
+def note_documents(doc_id: str, note: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """一条笔记对应的检索文档（存储字段）：笔记本身 + 每条评论"""
+    title = note.get("标题") or ""
+    link = note.get("链接") or ""
+    tags = [t.lstrip("#").strip() for t in note.get("标签") or []]
+    docs = [{"文档": doc_id, "类型": KIND_NOTE, "标题": title, "作者": note.get("作者") or "",
+             "链接": link, "标签": tags, "文本": note.get("内容") or ""}]
+    for k, c in enumerate(note.get("评论") or [], 1):
+        if c.get("内容"):
+            docs.append({"文档": doc_id, "类型": KIND_COMMENT, "标题": title, "作者": c.get("用户名") or "",
+                         "链接": link, "评论序号": k, "文本": c["内容"]})
+    return docs
+
+
+def document_tokens(stored: Dict[str, Any]) -> Counter:
+    """按存储字段计算文档的词频；笔记标题重复计入 TITLE_BOOST 次"""
+    tokens = Counter(tokenize(stored.get("文本", "")))
+    if stored.get("类型") == KIND_NOTE:
+        for _ in range(TITLE_BOOST):
+            tokens.update(tokenize(stored.get("标题", "")))
+        tokens.update(tokenize(" ".join(stored.get("标签") or [])))
+    else:
+        tokens.update(tokenize(stored.get("作者", "")))
+    return tokens
+
+
+def _string_table(items: List[bytes]) -> Tuple[bytes, bytes]:
+    offsets = array("I", [0])
+    for item in items:
+        offsets.append(offsets[-1] + len(item))
+    return offsets.tobytes(), b"".join(items)
+
+
+def write_segment(path: str, stored_docs: List[Dict[str, Any]]) -> int:
+    """把一批文档写成一个段文件（先写临时文件再改名），返回文档数"""
+    docs = sorted(stored_docs, key=lambda d: d["文档"])
+    lengths = array("I")
+    store = []
+    postings: Dict[str, List[int]] = {}
+    key_ranges: Dict[str, List[int]] = {}
+    for local, stored in enumerate(docs):
+        tokens = document_tokens(stored)
+        lengths.append(sum(tokens.values()))
+        store.append(json.dumps(stored, ensure_ascii=False).encode("utf-8"))
+        for term, tf in tokens.items():
+            postings.setdefault(term, []).extend((local, tf))
+        key_ranges.setdefault(stored["文档"], [local, local])[1] = local + 1
+    terms = sorted(postings)
+    post_off = array("I", [0])
+    post_data = array("I")
+    for term in terms:
+        post_data.extend(postings[term])
+        post_off.append(len(post_data) // 2)
+    keys = sorted(key_ranges)
+    store_off, store_blob = _string_table(store)
+    term_off, term_blob = _string_table([t.encode("utf-8") for t in terms])
+    key_off, key_blob = _string_table([k.encode("utf-8") for k in keys])
+    key_range = array("I", [n for k in keys for n in key_ranges[k]])
+    sections = [lengths.tobytes(), store_off, store_blob, term_off, term_blob, post_off.tobytes(),
+                post_data.tobytes(), key_off, key_blob, key_range.tobytes()]
+
+    layout = []
+    offset = _HEADER.size
+    for data in sections:
+        layout.extend((offset, len(data)))
+        offset += len(data) + (-len(data)) % 4
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, _FORMAT_VERSION, len(docs), len(terms), len(keys), sum(lengths), *layout))
+        for data in sections:
+            f.write(data + b"\0" * ((-len(data)) % 4))
+    os.replace(tmp_path, path)
+    return len(docs)
+
+
+class Segment:
+    """
+    一个 mmap 打开的只读段；deleted 为已标记删除的段内文档号
+    """
+
+    def __init__(self, path: str, deleted: Iterable[int] = ()):
+        self.path = path
+        self.name = os.path.basename(path)
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        fields = _HEADER.unpack_from(self._mm, 0)
+        magic, version, self.n_docs, self.n_terms, self.n_keys, self.total_len = fields[:6]
+        if magic != _MAGIC or version != _FORMAT_VERSION:
+            raise ValueError(f"无法识别的索引段: {path}")
+        view = memoryview(self._mm)
+        s = {}
+        for i, name in enumerate(_SECTIONS):
+            offset, length = fields[6 + 2 * i], fields[7 + 2 * i]
+            s[name] = view[offset:offset + length]
+        self._doc_len = s["doc_len"].cast("I")
+        self._store_off = s["store_off"].cast("I")
+        self._store = s["store"]
+        self._term_off = s["term_off"].cast("I")
+        self._terms = s["terms"]
+        self._post_off = s["post_off"].cast("I")
+        self._postings = s["postings"].cast("I")
+        self._key_off = s["key_off"].cast("I")
+        self._keys = s["keys"]
+        self._key_range = s["key_range"].cast("I")
+        self.deleted = frozenset(deleted)
+
+    @property
+    def live_docs(self) -> int:
+        return self.n_docs - len(self.deleted)
+
+    def _term(self, i: int) -> bytes:
+        return bytes(self._terms[self._term_off[i]:self._term_off[i + 1]])
+
+    def _lower_bound(self, term: bytes) -> int:
+        lo, hi = 0, self.n_terms
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term(mid) < term:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def term_ids(self, term: str, prefix: bool = False) -> List[int]:
+        """词在词典中的序号；prefix 为 True 时返回所有以 term 开头的词"""
+        key = term.encode("utf-8")
+        i = self._lower_bound(key)
+        if not prefix:
+            return [i] if i < self.n_terms and self._term(i) == key else []
+        ids = []
+        while i < self.n_terms and self._term(i).startswith(key):
+            ids.append(i)
+            i += 1
+        return ids
+
+    def postings(self, term_id: int) -> Tuple[memoryview, memoryview]:
+        """返回 (文档号, 词频) 两个视图"""
+        start, end = self._post_off[term_id] * 2, self._post_off[term_id + 1] * 2
+        return self._postings[start:end:2], self._postings[start + 1:end:2]
+
+    def doc_len(self, local: int) -> int:
+        return self._doc_len[local]
+
+    def stored(self, local: int) -> Dict[str, Any]:
+        return json.loads(bytes(self._store[self._store_off[local]:self._store_off[local + 1]]))
+
+    def key_range(self, doc_id: str) -> Optional[Tuple[int, int]]:
+        """某个笔记文件在本段中的文档号范围"""
+        key = doc_id.encode("utf-8")
+        lo, hi = 0, self.n_keys
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if bytes(self._keys[self._key_off[mid]:self._key_off[mid + 1]]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.n_keys and bytes(self._keys[self._key_off[lo]:self._key_off[lo + 1]]) == key:
+            return self._key_range[2 * lo], self._key_range[2 * lo + 1]
+        return None
+
+    def iter_live(self) -> Iterable[Dict[str, Any]]:
+        for local in range(self.n_docs):
+            if local not in self.deleted:
+                yield self.stored(local)
+
+
+def make_snippet(text: str, terms: List[str], width: int = SNIPPET_CHARS) -> str:
+    """截取第一个命中词附近的一段文本"""
+    lowered = unicodedata.normalize("NFKC", text).lower()
+    hits = [pos for pos in (lowered.find(t) for t in terms) if pos >= 0]
+    start = max(0, min(hits) - width // 4) if hits else 0
+    snippet = text[start:start + width].replace("\n", " ")
+    return ("…" if start else "") + snippet + ("…" if start + width < len(text) else "")
+
+
+class SearchIndex:
+    """
+    分段的本地全文索引
+    """
+
+    def __init__(self, root: str = SEARCH_DIR):
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.manifest_path = os.path.join(root, MANIFEST_NAME)
+        self._lock = threading.Lock()
+        self._segments: List[Segment] = []
+        self._next_id = 1
+        self._manifest_version: Optional[Tuple[int, int]] = None
+        self._refresh()
+
+    # ---------- 段与 manifest ----------
+
+    @contextmanager
+    def _write_lock(self):
+        """进程内线程锁 + 跨进程文件锁：读取 manifest、写新段、替换 manifest 整个过程互斥"""
+        with self._lock, open(os.path.join(self.root, "write.lock"), "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _refresh(self) -> None:
+        """manifest 变化（本进程或其他进程写入）时重新加载段列表，未变化的段复用已有映射"""
+        try:
+            st = os.stat(self.manifest_path)
+        except OSError:
+            return
+        # manifest 每次都是改名替换，inode 变化即说明有新版本
+        version = (st.st_ino, st.st_mtime_ns)
+        if version == self._manifest_version:
+            return
+        with open(self.manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        opened = {seg.name: seg for seg in self._segments}
+        segments = []
+        for entry in manifest.get("segments", []):
+            seg = opened.get(entry["name"])
+            if seg is None:
+                try:
+                    seg = Segment(os.path.join(self.root, entry["name"]))
+                except (OSError, ValueError) as e:
+                    print(f"[日志] 打开索引段失败 {entry['name']}: {e}")
+                    continue
+            seg.deleted = frozenset(entry.get("deleted", []))
+            segments.append(seg)
+        self._segments = segments
+        self._next_id = manifest.get("next_id", 1)
+        self._manifest_version = version
+
+    def _save_manifest(self) -> None:
+        manifest = {
+            "version": _FORMAT_VERSION,
+            "next_id": self._next_id,
+            "segments": [{"name": seg.name, "docs": seg.n_docs, "deleted": sorted(seg.deleted)}
+                         for seg in self._segments],
+        }
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp_path, self.manifest_path)
+        st = os.stat(self.manifest_path)
+        self._manifest_version = (st.st_ino, st.st_mtime_ns)
+        docs = sum(seg.live_docs for seg in self._segments)
+        metrics.set_gauge("search_index_segments", len(self._segments))
+        metrics.set_gauge("search_index_docs", docs)
+
+    def _new_segment(self, stored_docs: List[Dict[str, Any]]) -> Segment:
+        name = f"seg_{self._next_id:06d}.seg"
+        self._next_id += 1
+        path = os.path.join(self.root, name)
+        write_segment(path, stored_docs)
+        return Segment(path)
+
+    def _remove_files(self, segments: List[Segment]) -> None:
+        # 其他进程可能仍映射着这些段，POSIX 下删除文件不影响已有映射
+        for seg in segments:
+            try:
+                os.remove(seg.path)
+            except OSError:
+                pass
+
+    def _maybe_merge(self) -> List[Segment]:
+        """段数超过 MERGE_FACTOR 时合并最小的 MERGE_FACTOR 个段，返回被合并掉的段"""
+        if len(self._segments) <= MERGE_FACTOR:
+            return []
+        victims = sorted(self._segments, key=lambda seg: seg.live_docs)[:MERGE_FACTOR]
+        stored_docs = [doc for seg in victims for doc in seg.iter_live()]
+        merged = self._new_segment(stored_docs)
+        victim_names = {seg.name for seg in victims}
+        self._segments = [seg for seg in self._segments if seg.name not in victim_names] + [merged]
+        metrics.inc("search_index_merges_total")
+        return victims
+
+    # ---------- 写入 ----------
+
+    def add_note(self, doc_id: str, note: Dict[str, Any]) -> int:
+        """索引一条笔记及其评论（同一 doc_id 已索引时旧文档标记删除），返回新增文档数"""
+        stored_docs = note_documents(doc_id, note)
+        with self._write_lock():
+            self._refresh()
+            for seg in self._segments:
+                rng = seg.key_range(doc_id)
+                if rng:
+                    seg.deleted = seg.deleted | set(range(*rng))
+            self._segments = self._segments + [self._new_segment(stored_docs)]
+            removed = self._maybe_merge()
+            self._save_manifest()
+        self._remove_files(removed)
+        metrics.inc("search_index_writes_total")
+        return len(stored_docs)
+
+    def rebuild(self, notes_dir: Optional[str] = None) -> int:
+        """清空索引并从已爬取语料重建，每 REBUILD_BATCH 个文档写一个段"""
+        from notes_corpus import iter_notes
+        with self._write_lock():
+            self._refresh()
+            old = self._segments
+            self._segments = []
+            batch: List[Dict[str, Any]] = []
+            count = 0
+            for note in iter_notes(notes_dir):
+                docs = note_documents(note["文件名"], note)
+                batch.extend(docs)
+                count += len(docs)
+                if len(batch) >= REBUILD_BATCH:
+                    self._segments.append(self._new_segment(batch))
+                    batch = []
+            if batch:
+                self._segments.append(self._new_segment(batch))
+            self._save_manifest()
+        self._remove_files(old)
+        return count
+
+    # ---------- 查询 ----------
+
+    def search(self, query: str, limit: int = 10, kind: Optional[str] = None) -> Dict[str, Any]:
+        """
+        BM25 排序检索；kind 为 "笔记" 或 "评论" 时只返回该类型。
+        单个汉字的查询词按前缀匹配所有以它开头的 bigram
+        """
+        started = time.perf_counter()
+        with self._lock:
+            self._refresh()
+            segments = self._segments
+        terms = list(dict.fromkeys(tokenize(query)))
+        total_docs = sum(seg.n_docs for seg in segments)
+        # 被标记删除的文档在合并前仍计入文档数、长度和 df，与常见的分段索引一致
+        avg_len = sum(seg.total_len for seg in segments) / total_docs if total_docs else 0.0
+        avg_len = avg_len or 1.0
+        scores: Dict[Tuple[int, int], float] = {}
+        for term in terms:
+            prefix = len(term) == 1 and _CJK_RUN_RE.fullmatch(term) is not None
+            matches = [(si, seg, tid) for si, seg in enumerate(segments)
+                       for tid in seg.term_ids(term, prefix=prefix)]
+            df = sum(len(seg.postings(tid)[0]) for _, seg, tid in matches)
+            if not df:
+                continue
+            idf = math.log(1 + (total_docs - df + 0.5) / (df + 0.5))
+            for si, seg, tid in matches:
+                deleted = seg.deleted
+                docs, tfs = seg.postings(tid)
+                for local, tf in zip(docs, tfs):
+                    if local in deleted:
+                        continue
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * seg.doc_len(local) / avg_len)
+                    key = (si, local)
+                    scores[key] = scores.get(key, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+        results = []
+        # 按类型过滤时需要读存储字段才能判断，只能按得分顺序逐个检查
+        if kind:
+            ranked = sorted(scores.items(), key=lambda item: -item[1])
+        else:
+            ranked = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+        for (si, local), score in ranked:
+            stored = segments[si].stored(local)
+            if kind and stored.get("类型") != kind:
+                continue
+            text = stored.pop("文本", "")
+            stored["片段"] = make_snippet(text, terms)
+            stored["得分"] = round(score, 4)
+            results.append(stored)
+            if len(results) >= limit:
+                break
+        elapsed = time.perf_counter() - started
+        metrics.inc("search_queries_total")
+        return {"查询": query, "命中数": len(scores), "耗时毫秒": round(elapsed * 1000, 2), "结果": results}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._refresh()
+            segments = self._segments
+        return {
+            "段数": len(segments),
+            "文档数": sum(seg.live_docs for seg in segments),
+            "已删除": sum(len(seg.deleted) for seg in segments),
+            "段": [{"名称": seg.name, "文档数": seg.n_docs, "已删除": len(seg.deleted), "词数": seg.n_terms}
+                  for seg in segments],
+        }
+
+
+_index: Optional[SearchIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_search_index() -> SearchIndex:
+    """获取全局检索索引（首次调用时打开）"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = SearchIndex()
+    return _index
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="已爬取语料的本地全文检索")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_rebuild = sub.add_parser("rebuild", help="从已爬取语料重建索引")
+    p_rebuild.add_argument("--notes-dir", default=None)
+    p_query = sub.add_parser("query", help="检索")
+    p_query.add_argument("text")
+    p_query.add_argument("--limit", type=int, default=10)
+    p_query.add_argument("--kind", choices=[KIND_NOTE, KIND_COMMENT], default=None)
+    sub.add_parser("stats", help="查看索引段信息")
+    args = parser.parse_args(argv)
+
+    index = get_search_index()
+    if args.command == "rebuild":
+        result: Any = {"索引文档数": index.rebuild(args.notes_dir)}
+    elif args.command == "query":
+        result = index.search(args.text, args.limit, args.kind)
+    else:
+        result = index.stats()
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
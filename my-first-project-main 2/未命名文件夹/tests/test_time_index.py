@@ -0,0 +1,70 @@
+"""
+normalize_series（pandas 向量化，time backfill 使用）与 normalize_time（标量，抓取时使用）的一致性
+
+用法：python -m pytest tests
+"""
+from datetime import datetime
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from time_index import SITE_TZ, normalize_series, normalize_time  # noqa: E402
+
+pd = pytest.importorskip("pandas")
+
+TEXTS = [
+    "05-07", "05-07 12:30", "2024-05-07", "2024-05-07 08:05", "2024/5/7", "2024年5月7日", "2024.05.07",
+    "编辑于 2024-05-07 上海", "编辑于 05-07", "编辑于 3天前 广东", "5月7日", "5月7日 09:15",
+    "今天", "今天 12:30", "昨天", "昨天 23:59", "前天 00:01",
+    "3天前", "12小时前", "45分钟前", "刚刚",
+    # 非法日期留给后面的规则，都不匹配时为 unknown
+    "02-30", "2023-02-29", "13-01", "02-30 3天前",
+    "", "未知", "abc", None,
+]
+
+# 抓取时间（站点时区）：普通日期、跨年（01-02 抓取时 "12-31" 属于上一年）、闰年、午夜
+CRAWL_TIMES = [
+    datetime(2024, 5, 20, 15, 42, 17, tzinfo=SITE_TZ),
+    datetime(2025, 1, 2, 0, 30, 0, tzinfo=SITE_TZ),
+    datetime(2024, 3, 1, 23, 59, 59, tzinfo=SITE_TZ),
+    datetime(2024, 12, 31, 0, 0, 0, tzinfo=SITE_TZ),
+]
+
+YEAR_ROLLOVER_TEXTS = ["12-31", "12-31 22:10", "01-01", "01-03", "12月30日", "02-29"]
+
+
+def _scalar(texts, crawled):
+    return [normalize_time(text, epoch) for text, epoch in zip(texts, crawled)]
+
+
+def _vectorized(texts, crawled):
+    df = normalize_series(pd.Series(texts, dtype=object), pd.Series(crawled, dtype="float64"))
+    return [(None if pd.isna(epoch) else int(epoch), precision)
+            for epoch, precision in zip(df["epoch"], df["precision"])]
+
+
+@pytest.mark.parametrize("crawled_at", CRAWL_TIMES, ids=lambda d: d.strftime("%Y-%m-%d_%H%M"))
+def test_series_matches_scalar(crawled_at):
+    texts = TEXTS + YEAR_ROLLOVER_TEXTS
+    crawled = [crawled_at.timestamp()] * len(texts)
+    assert _vectorized(texts, crawled) == _scalar(texts, crawled)
+
+
+def test_series_matches_scalar_with_mixed_crawl_times():
+    texts = (TEXTS + YEAR_ROLLOVER_TEXTS) * len(CRAWL_TIMES)
+    crawled = [c.timestamp() for c in CRAWL_TIMES for _ in range(len(TEXTS) + len(YEAR_ROLLOVER_TEXTS))]
+    assert _vectorized(texts, crawled) == _scalar(texts, crawled)
+
+
+def test_year_rollover_and_invalid_dates():
+    crawled = datetime(2025, 1, 2, 0, 30, tzinfo=SITE_TZ).timestamp()
+    epoch, precision = normalize_time("12-31", crawled)
+    assert datetime.fromtimestamp(epoch, SITE_TZ).date().isoformat() == "2024-12-31"
+    assert precision == "day"
+    assert normalize_time("02-30", crawled) == (None, "unknown")
+    epoch, precision = normalize_time("编辑于 3天前 广东", crawled)
+    assert datetime.fromtimestamp(epoch, SITE_TZ).date().isoformat() == "2024-12-30"
+    assert precision == "day"
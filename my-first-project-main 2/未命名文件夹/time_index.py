@@ -0,0 +1,418 @@
+"""
+发布时间 / 评论时间的规整与按时间查询
+
+页面上的时间是各种文本："05-07"、"编辑于 2024-05-07 上海"、"3天前"、"昨天 12:30"、"刚刚"……
+这里以抓取时间为参照把它们解析成绝对的 UTC 时间（Unix 秒），并附带精度标记：
+- second：接口给出的精确时间戳
+- minute / hour：带时分的日期、"N分钟前"、"N小时前"
+- day：只有日期（取站点时区当天 0 点）、"N天前"、"昨天"
+- unknown：无法解析
+页面显示的日期按站点时区（默认 UTC+8，XHS_SITE_UTC_OFFSET）理解；没有年份的日期取不晚于抓取日期的最近一年。
+
+规整结果写入 data/time_index.db，笔记和评论都在 (搜索关键词, 时间) 上建索引，
+"某关键词最近 7 天的笔记" 是一次索引范围扫描。
+已有语料用 backfill 按块回填，解析使用 pandas 向量化（只在回填时导入 pandas）。
+"""
+from typing import Any, Dict, List, Optional, Tuple
+from datetime import datetime, timedelta, timezone
+import argparse
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+TIME_INDEX_DB_PATH = os.path.join(DATA_DIR, "time_index.db")
+
+SITE_TZ = timezone(timedelta(hours=float(os.environ.get("XHS_SITE_UTC_OFFSET", 8))))
+BACKFILL_CHUNK = 5000
+
+PRECISION_SECOND = "second"
+PRECISION_MINUTE = "minute"
+PRECISION_HOUR = "hour"
+PRECISION_DAY = "day"
+PRECISION_UNKNOWN = "unknown"
+
+_RELATIVE_DAYS = {"今天": 0, "昨天": 1, "前天": 2}
+
+# 按顺序尝试，第一个能解析出合法时间的规则生效；标量解析和向量化解析共用这张表
+TIME_PATTERNS: List[Tuple[str, re.Pattern]] = [
+    ("ymd", re.compile(r'(\d{4})[-/.年](\d{1,2})[-/.月](\d{1,2})日?(?:\s*(\d{1,2}):(\d{2}))?')),
+    ("md", re.compile(r'(?<![\d-])(\d{1,2})-(\d{1,2})(?![\d-])(?:\s*(\d{1,2}):(\d{2}))?')),
+    ("md", re.compile(r'(?<!\d)(\d{1,2})月(\d{1,2})日(?:\s*(\d{1,2}):(\d{2}))?')),
+    ("relative_day", re.compile(r'(今天|昨天|前天)(?:\s*(\d{1,2}):(\d{2}))?')),
+    ("days_ago", re.compile(r'(\d+)\s*天前')),
+    ("hours_ago", re.compile(r'(\d+)\s*小时前')),
+    ("minutes_ago", re.compile(r'(\d+)\s*分钟前')),
+    ("just_now", re.compile(r'(刚刚)')),
+]
+
+
+def to_epoch(value: Any) -> Optional[float]:
+    """
+    把参照时间转换成 Unix 秒：datetime（无时区时按本机时区）、
+    "YYYY-MM-DD HH:MM:SS" 文本（抓取时间，本机时区）或数字（大于 1e11 时视为毫秒）
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if isinstance(value, (int, float)):
+        return value / 1000 if value > 1e11 else float(value)
+    try:
+        return datetime.strptime(str(value)[:19], "%Y-%m-%d %H:%M:%S").timestamp()
+    except ValueError:
+        return None
+
+
+def _site_datetime(year: int, month: int, day: int, hour: Optional[str], minute: Optional[str]) -> Tuple[datetime, str]:
+    if hour is None or hour == "":
+        return datetime(year, month, day, tzinfo=SITE_TZ), PRECISION_DAY
+    return datetime(year, month, day, int(hour), int(minute), tzinfo=SITE_TZ), PRECISION_MINUTE
+
+
+def _resolve(kind: str, groups: Tuple[Optional[str], ...], ref: datetime) -> Tuple[datetime, str]:
+    """按规则类型把匹配结果解析为站点时区的时间；非法日期抛出 ValueError"""
+    if kind == "ymd":
+        return _site_datetime(int(groups[0]), int(groups[1]), int(groups[2]), groups[3], groups[4])
+    if kind == "md":
+        month, day = int(groups[0]), int(groups[1])
+        moment, precision = _site_datetime(ref.year, month, day, groups[2], groups[3])
+        if moment.date() > ref.date():
+            moment, precision = _site_datetime(ref.year - 1, month, day, groups[2], groups[3])
+        return moment, precision
+    midnight = ref.replace(hour=0, minute=0, second=0, microsecond=0)
+    if kind == "relative_day":
+        moment = midnight - timedelta(days=_RELATIVE_DAYS[groups[0]])
+        if groups[1]:
+            return moment + timedelta(hours=int(groups[1]), minutes=int(groups[2])), PRECISION_MINUTE
+        return moment, PRECISION_DAY
+    if kind == "days_ago":
+        return midnight - timedelta(days=int(groups[0])), PRECISION_DAY
+    if kind == "hours_ago":
+        return (ref - timedelta(hours=int(groups[0]))).replace(minute=0, second=0, microsecond=0), PRECISION_HOUR
+    if kind == "minutes_ago":
+        return (ref - timedelta(minutes=int(groups[0]))).replace(second=0, microsecond=0), PRECISION_MINUTE
+    return ref.replace(second=0, microsecond=0), PRECISION_MINUTE
+
+
+def normalize_time(text: Any, crawled_at: Any = None, timestamp: Any = None) -> Tuple[Optional[int], str]:
+    """
+    把一条时间文本解析为 (UTC Unix 秒, 精度)；有接口时间戳（毫秒或秒）时直接使用。
+    crawled_at 为抓取时间，缺省为当前时间
+    """
+    exact = to_epoch(timestamp) if timestamp not in (None, "", 0) else None
+    if exact is not None:
+        return int(exact), PRECISION_SECOND
+    ref_epoch = to_epoch(crawled_at)
+    ref = datetime.fromtimestamp(time.time() if ref_epoch is None else ref_epoch, SITE_TZ)
+    text = str(text or "")
+    for kind, pattern in TIME_PATTERNS:
+        m = pattern.search(text)
+        if not m:
+            continue
+        try:
+            moment, precision = _resolve(kind, m.groups(), ref)
+        except (ValueError, OverflowError):
+            continue
+        return int(moment.timestamp()), precision
+    return None, PRECISION_UNKNOWN
+
+
+def format_utc(epoch: Optional[int]) -> str:
+    if epoch is None:
+        return ""
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def annotate_times(record: Dict[str, Any], crawled_at: Any = None) -> Dict[str, Any]:
+    """
+    给笔记记录补上 发布时间UTC / 发布时间精度，给其中的评论（评论、评论树）补上 时间UTC / 时间精度；
+    原地修改并返回 record
+    """
+    crawled_at = crawled_at or record.get("抓取时间")
+    epoch, precision = normalize_time(record.get("发布时间"), crawled_at, record.get("发布时间戳"))
+    record["发布时间UTC"] = format_utc(epoch)
+    record["发布时间精度"] = precision
+    for key in ("评论", "评论树"):
+        for c in record.get(key) or []:
+            epoch, precision = normalize_time(c.get("时间"), crawled_at, c.get("时间戳"))
+            c["时间UTC"] = format_utc(epoch)
+            c["时间精度"] = precision
+    return record
+
+
+def normalize_series(texts, crawled):
+    """
+    向量化版本的 normalize_time：texts 为时间文本 Series，crawled 为同索引的抓取时间 Series（Unix 秒），
+    返回带 epoch（可空整数）和 precision 两列的 DataFrame。规则与 TIME_PATTERNS 完全一致，
+    结果与逐条调用 normalize_time 相同（tests/test_time_index.py 检查）
+    """
+    import pandas as pd
+
+    texts = texts.fillna("").astype(str)
+    ref = pd.to_datetime(crawled.astype("float64"), unit="s", utc=True).dt.tz_convert(SITE_TZ)
+    midnight = ref.dt.floor("D")
+    moment = pd.Series(pd.NaT, index=texts.index, dtype=ref.dtype)
+    precision = pd.Series(PRECISION_UNKNOWN, index=texts.index, dtype=object)
+
+    def site_datetime(year, month, day, hour, minute):
+        parts = pd.DataFrame({"year": year, "month": month, "day": day,
+                              "hour": pd.to_numeric(hour, errors="coerce").fillna(0),
+                              "minute": pd.to_numeric(minute, errors="coerce").fillna(0)})
+        values = pd.to_datetime(parts, errors="coerce").dt.tz_localize(SITE_TZ)
+        return values, hour.notna() & (hour != "")
+
+    # 时间文本重复度很高（"3天前"、"05-07"……），正则只在去重后的文本上执行，再按编码映射回各行
+    codes, uniques = pd.factorize(texts)
+    uniques = pd.Series(uniques, dtype=object)
+    for kind, pattern in TIME_PATTERNS:
+        pending = moment.isna()
+        if not pending.any():
+            break
+        extracted = uniques.str.extract(pattern)
+        groups = extracted.iloc[codes[pending.to_numpy()]].set_axis(texts.index[pending])
+        matched = groups[0].notna()
+        if not matched.any():
+            continue
+        g = groups[matched]
+        idx = g.index
+        r, mid = ref[idx], midnight[idx]
+        if kind == "ymd":
+            values, has_time = site_datetime(g[0].astype(int), g[1].astype(int), g[2].astype(int), g[3], g[4])
+        elif kind == "md":
+            year = r.dt.year
+            values, has_time = site_datetime(year, g[0].astype(int), g[1].astype(int), g[2], g[3])
+            future = values.dt.floor("D") > mid
+            if future.any():
+                earlier, _ = site_datetime(year - 1, g[0].astype(int), g[1].astype(int), g[2], g[3])
+                values = values.where(~future, earlier)
+        elif kind == "relative_day":
+            values = mid - pd.to_timedelta(g[0].map(_RELATIVE_DAYS), unit="D")
+            has_time = g[1].notna()
+            offset = (pd.to_timedelta(pd.to_numeric(g[1], errors="coerce").fillna(0), unit="h")
+                      + pd.to_timedelta(pd.to_numeric(g[2], errors="coerce").fillna(0), unit="m"))
+            values = values + offset
+        elif kind == "days_ago":
+            values, has_time = mid - pd.to_timedelta(g[0].astype(int), unit="D"), None
+        elif kind == "hours_ago":
+            values, has_time = (r - pd.to_timedelta(g[0].astype(int), unit="h")).dt.floor("h"), None
+        elif kind == "minutes_ago":
+            values, has_time = (r - pd.to_timedelta(g[0].astype(int), unit="m")).dt.floor("min"), None
+        else:
+            values, has_time = r.dt.floor("min"), None
+        # 非法日期（如 02-30）解析为 NaT，留给后面的规则
+        valid = values.notna()
+        idx = idx[valid.to_numpy()]
+        moment.loc[idx] = values[valid]
+        if kind in ("ymd", "md", "relative_day"):
+            precision.loc[idx] = has_time[valid].map({True: PRECISION_MINUTE, False: PRECISION_DAY})
+        else:
+            precision.loc[idx] = {"days_ago": PRECISION_DAY, "hours_ago": PRECISION_HOUR}.get(kind, PRECISION_MINUTE)
+
+    epoch = ((moment - pd.Timestamp(0, tz="UTC")) // pd.Timedelta(seconds=1)).astype("Int64")
+    return pd.DataFrame({"epoch": epoch, "precision": precision})
+
+
+class TimeIndex:
+    """
+    笔记与评论的时间索引
+    """
+
+    def __init__(self, db_path: str = TIME_INDEX_DB_PATH):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS notes (
+                doc_id TEXT PRIMARY KEY, note_id TEXT, keyword TEXT NOT NULL, title TEXT, link TEXT,
+                time_text TEXT, published INTEGER, precision TEXT NOT NULL, crawled INTEGER);
+            CREATE INDEX IF NOT EXISTS idx_notes_keyword_time ON notes (keyword, published);
+            CREATE INDEX IF NOT EXISTS idx_notes_time ON notes (published);
+            CREATE TABLE IF NOT EXISTS comments (
+                doc_id TEXT NOT NULL, seq INTEGER NOT NULL, keyword TEXT NOT NULL, user TEXT, content TEXT,
+                time_text TEXT, published INTEGER, precision TEXT NOT NULL,
+                PRIMARY KEY (doc_id, seq)) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_comments_keyword_time ON comments (keyword, published);
+            CREATE INDEX IF NOT EXISTS idx_comments_time ON comments (published);
+        """)
+
+    def _write(self, note_rows: List[tuple], comment_rows: List[tuple]) -> None:
+        with self._lock, self.conn:
+            self.conn.executemany("DELETE FROM comments WHERE doc_id = ?", [(row[0],) for row in note_rows])
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO notes (doc_id, note_id, keyword, title, link, time_text, published, "
+                "precision, crawled) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", note_rows)
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO comments (doc_id, seq, keyword, user, content, time_text, published, "
+                "precision) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", comment_rows)
+
+    def record_note(self, doc_id: str, note: Dict[str, Any]) -> Tuple[Optional[int], str]:
+        """索引一条笔记和它的评论（同一 doc_id 覆盖），返回发布时间的 (UTC 秒, 精度)"""
+        from notes_corpus import note_id_from_url
+        crawled = to_epoch(note.get("抓取时间")) or note.get("mtime") or time.time()
+        keyword = note.get("搜索关键词") or ""
+        published, precision = normalize_time(note.get("发布时间"), crawled, note.get("发布时间戳"))
+        note_rows = [(doc_id, note.get("笔记ID") or note_id_from_url(note.get("链接", "")), keyword,
+                      note.get("标题", ""), note.get("链接", ""), note.get("发布时间", ""), published, precision,
+                      int(crawled))]
+        comment_rows = []
+        for seq, c in enumerate(note.get("评论") or [], 1):
+            c_time, c_precision = normalize_time(c.get("时间"), crawled, c.get("时间戳"))
+            comment_rows.append((doc_id, seq, keyword, c.get("用户名", ""), c.get("内容", ""), c.get("时间", ""),
+                                 c_time, c_precision))
+        self._write(note_rows, comment_rows)
+        return published, precision
+
+    def _backfill_chunk(self, notes: List[Dict[str, Any]]) -> int:
+        import pandas as pd
+
+        note_df = pd.DataFrame({
+            "doc_id": [n["文件名"] for n in notes],
+            "note_id": [n.get("笔记ID", "") for n in notes],
+            "keyword": [n.get("搜索关键词") or "" for n in notes],
+            "title": [n.get("标题", "") for n in notes],
+            "link": [n.get("链接", "") for n in notes],
+            "time_text": [n.get("发布时间", "") for n in notes],
+            "crawled": [to_epoch(n.get("抓取时间")) or n["mtime"] for n in notes],
+        })
+        parsed = normalize_series(note_df["time_text"], note_df["crawled"])
+        note_df["published"], note_df["precision"] = parsed["epoch"], parsed["precision"]
+        note_df["crawled"] = note_df["crawled"].astype("int64")
+
+        comment_df = pd.DataFrame([
+            {"doc_id": n["文件名"], "seq": seq, "keyword": n.get("搜索关键词") or "", "user": c.get("用户名", ""),
+             "content": c.get("内容", ""), "time_text": c.get("时间", ""), "crawled": crawled}
+            for n, crawled in zip(notes, note_df["crawled"]) for seq, c in enumerate(n.get("评论") or [], 1)
+        ], columns=["doc_id", "seq", "keyword", "user", "content", "time_text", "crawled"])
+        if len(comment_df):
+            parsed = normalize_series(comment_df["time_text"], comment_df["crawled"])
+            comment_df["published"], comment_df["precision"] = parsed["epoch"], parsed["precision"]
+        else:
+            comment_df["published"], comment_df["precision"] = [], []
+
+        def rows(df, columns):
+            # 可空整数列里的 NA 转成 None 再写入 SQLite
+            return [tuple(None if pd.isna(v) else (int(v) if c in ("published", "crawled", "seq") else v)
+                          for c, v in zip(columns, values))
+                    for values in df[columns].itertuples(index=False, name=None)]
+
+        self._write(rows(note_df, ["doc_id", "note_id", "keyword", "title", "link", "time_text", "published",
+                                   "precision", "crawled"]),
+                    rows(comment_df, ["doc_id", "seq", "keyword", "user", "content", "time_text", "published",
+                                      "precision"]))
+        return len(notes)
+
+    def backfill(self, notes_dir: Optional[str] = None, chunk_size: int = BACKFILL_CHUNK) -> Dict[str, int]:
+        """清空索引并从已爬取语料按块回填（向量化解析，需要 pandas）"""
+        from notes_corpus import iter_notes
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM notes")
+            self.conn.execute("DELETE FROM comments")
+        count = 0
+        chunk: List[Dict[str, Any]] = []
+        for note in iter_notes(notes_dir):
+            chunk.append(note)
+            if len(chunk) >= chunk_size:
+                count += self._backfill_chunk(chunk)
+                chunk = []
+        if chunk:
+            count += self._backfill_chunk(chunk)
+        return {"笔记数": count, **self.precision_counts()}
+
+    def precision_counts(self) -> Dict[str, int]:
+        return {f"精度_{p}": n for p, n in
+                self.conn.execute("SELECT precision, COUNT(*) FROM notes GROUP BY precision")}
+
+    def notes_between(self, keyword: Optional[str] = None, since: Optional[int] = None,
+                      until: Optional[int] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """按发布时间范围查笔记（新的在前）；给定 keyword 时走 (关键词, 时间) 索引"""
+        sql, params = self._range("notes", keyword, since, until)
+        cursor = self.conn.execute(
+            "SELECT doc_id, note_id, keyword, title, link, time_text, published, precision FROM notes "
+            + sql + " ORDER BY published DESC LIMIT ?", params + [limit])
+        return [{"文档": r[0], "笔记ID": r[1], "搜索关键词": r[2], "标题": r[3], "链接": r[4], "发布时间": r[5],
+                 "发布时间UTC": format_utc(r[6]), "发布时间精度": r[7]} for r in cursor]
+
+    def comments_between(self, keyword: Optional[str] = None, since: Optional[int] = None,
+                         until: Optional[int] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """按评论时间范围查评论（新的在前）"""
+        sql, params = self._range("comments", keyword, since, until)
+        cursor = self.conn.execute(
+            "SELECT doc_id, seq, keyword, user, content, time_text, published, precision FROM comments "
+            + sql + " ORDER BY published DESC LIMIT ?", params + [limit])
+        return [{"文档": r[0], "序号": r[1], "搜索关键词": r[2], "用户名": r[3], "内容": r[4], "时间": r[5],
+                 "时间UTC": format_utc(r[6]), "时间精度": r[7]} for r in cursor]
+
+    @staticmethod
+    def _range(table: str, keyword: Optional[str], since: Optional[int], until: Optional[int]):
+        clauses = ["published IS NOT NULL"]
+        params: List[Any] = []
+        if keyword:
+            clauses.append("keyword = ?")
+            params.append(keyword)
+        if since is not None:
+            clauses.append("published >= ?")
+            params.append(int(since))
+        if until is not None:
+            clauses.append("published < ?")
+            params.append(int(until))
+        return "WHERE " + " AND ".join(clauses), params
+
+    def recent(self, keyword: Optional[str] = None, days: float = 7, limit: int = 100,
+               with_comments: bool = False) -> Dict[str, Any]:
+        """最近 days 天发布的笔记（及评论）"""
+        since = int(time.time() - days * 86400)
+        result: Dict[str, Any] = {"搜索关键词": keyword or "全部", "起始UTC": format_utc(since),
+                                  "笔记": self.notes_between(keyword, since, limit=limit)}
+        if with_comments:
+            result["评论"] = self.comments_between(keyword, since, limit=limit)
+        return result
+
+
+_index: Optional[TimeIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_time_index() -> TimeIndex:
+    """获取全局时间索引（首次调用时打开）"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = TimeIndex()
+    return _index
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="发布时间规整与按时间查询")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_backfill = sub.add_parser("backfill", help="从已爬取语料回填时间索引（需要 pandas）")
+    p_backfill.add_argument("--notes-dir", default=None)
+    p_backfill.add_argument("--chunk-size", type=int, default=BACKFILL_CHUNK)
+    p_recent = sub.add_parser("recent", help="查询最近 N 天发布的笔记")
+    p_recent.add_argument("keyword", nargs="?", default=None)
+    p_recent.add_argument("--days", type=float, default=7)
+    p_recent.add_argument("--limit", type=int, default=100)
+    p_recent.add_argument("--comments", action="store_true", help="同时返回评论")
+    p_parse = sub.add_parser("parse", help="解析一条时间文本")
+    p_parse.add_argument("text")
+    p_parse.add_argument("--crawled", default=None, help="抓取时间 YYYY-MM-DD HH:MM:SS，默认当前时间")
+    args = parser.parse_args(argv)
+
+    if args.command == "backfill":
+        result: Any = get_time_index().backfill(args.notes_dir, args.chunk_size)
+    elif args.command == "recent":
+        result = get_time_index().recent(args.keyword, args.days, args.limit, args.comments)
+    else:
+        epoch, precision = normalize_time(args.text, args.crawled)
+        result = {"UTC": format_utc(epoch), "精度": precision}
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,221 @@
+"""
+抽样的 Playwright 追踪（失败现场取证）
+
+开启追踪（环境变量 XHS_TRACE=1）后，浏览器上下文启动一次 tracing（截图、DOM 快照、网络请求），
+每条笔记开始时开一个 chunk，结束时：
+    - 失败的笔记（抛出异常，或调用方标记为软失败，例如没有取到正文）保存为 zip；
+    - 成功的笔记按 XHS_TRACE_SAMPLE_RATE 的比例抽样保存；
+    - 其余直接丢弃，只占用 Playwright 的滚动缓冲。
+保存路径为 data/traces/<任务>/<笔记ID>_<时间>_<原因>.zip，可以用 `npx playwright show-trace <文件>` 打开。
+全部追踪文件的总大小不超过 XHS_TRACE_BUDGET_MB，超出时从最旧的开始删除。
+
+tracing 是整个浏览器上下文共用的，同一时间只能有一个 chunk：页面池并发时只有一条笔记开 chunk，
+其余笔记没有自己的追踪文件，失败时也不会单独保存。chunk 录制的是整个上下文，同一时间段内其他页面的操作、
+截图和网络请求同样会出现在这条笔记的 zip 里，查看时按页面区分。
+"""
+from typing import Any, Dict, List, Optional
+from contextlib import asynccontextmanager
+from datetime import datetime
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import sys
+
+import metrics
+
+TRACES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "traces")
+
+TRACE_ENABLED = os.environ.get("XHS_TRACE", "") == "1"
+# 成功的笔记中保存追踪的比例（0~1）
+SAMPLE_RATE = float(os.environ.get("XHS_TRACE_SAMPLE_RATE", 0))
+# 追踪文件总大小上限（MB）
+BUDGET_MB = float(os.environ.get("XHS_TRACE_BUDGET_MB", 500))
+
+
+def _safe(name: str) -> str:
+    return re.sub(r'\W+', '_', name or "")[:40].strip("_") or "unknown"
+
+
+class NoteTrace:
+    """
+    一条笔记的追踪片段；active 为 False 时表示这条笔记没有被追踪
+    """
+
+    def __init__(self, job: str, note_id: str = "", active: bool = False):
+        self.job = job
+        self.note_id = note_id
+        self.active = active
+        self.reason: Optional[str] = None
+        self.path: Optional[str] = None
+
+    def fail(self, reason: str) -> None:
+        """标记为失败：结束时一定保存（不受抽样比例影响）"""
+        self.reason = self.reason or reason
+
+
+class TraceRecorder:
+    """
+    按笔记切分的 tracing chunk：失败或抽样命中时保存，按磁盘预算淘汰最旧的文件
+    """
+
+    def __init__(self, root: str = TRACES_DIR, enabled: Optional[bool] = None,
+                 sample_rate: Optional[float] = None, budget_mb: Optional[float] = None):
+        self.root = root
+        self.enabled = TRACE_ENABLED if enabled is None else enabled
+        self.sample_rate = SAMPLE_RATE if sample_rate is None else sample_rate
+        self.budget_bytes = int((BUDGET_MB if budget_mb is None else budget_mb) * 1024 * 1024)
+        # 已经启动 tracing 的浏览器上下文；浏览器重启后是新的上下文，需要重新启动
+        self._context = None
+        self._chunk_lock = asyncio.Lock()
+
+    async def begin(self, context, job: str, note_id: str = "") -> NoteTrace:
+        """开始追踪一条笔记；未开启、没有浏览器或已有笔记在追踪时返回不活动的片段"""
+        if not self.enabled or context is None or self._chunk_lock.locked():
+            return NoteTrace(job, note_id)
+        await self._chunk_lock.acquire()
+        try:
+            if self._context is not context:
+                await context.tracing.start(screenshots=True, snapshots=True)
+                self._context = context
+            await context.tracing.start_chunk(title=f"{job} {note_id}".strip())
+        except Exception as e:
+            print(f"[日志] 启动追踪失败: {e}")
+            self._context = None
+            self._chunk_lock.release()
+            return NoteTrace(job, note_id)
+        except BaseException:
+            # 启动期间任务被取消：释放 chunk 锁，否则之后的笔记再也无法追踪
+            self._chunk_lock.release()
+            raise
+        return NoteTrace(job, note_id, active=True)
+
+    async def end(self, trace: Optional[NoteTrace], failure: Optional[str] = None) -> Optional[str]:
+        """结束追踪：失败或抽样命中时保存并返回文件路径，否则丢弃"""
+        if trace is None or not trace.active:
+            return None
+        trace.active = False
+        if failure:
+            trace.fail(failure)
+        reason = trace.reason or ("sample" if random.random() < self.sample_rate else None)
+        context = self._context
+        try:
+            if reason:
+                stamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+                path = os.path.join(self.root, _safe(trace.job), f"{_safe(trace.note_id)}_{stamp}_{_safe(reason)}.zip")
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                await context.tracing.stop_chunk(path=path)
+                trace.path = path
+                metrics.inc("traces_saved_total", reason="sample" if reason == "sample" else "failure")
+                print(f"[日志] 已保存追踪: {path}")
+                self.enforce_budget()
+            else:
+                await context.tracing.stop_chunk()
+                metrics.inc("traces_discarded_total")
+        except Exception as e:
+            # 上下文可能已经关闭（浏览器重启），下次重新启动 tracing
+            print(f"[日志] 结束追踪失败: {e}")
+            self._context = None
+        finally:
+            self._chunk_lock.release()
+        return trace.path
+
+    @asynccontextmanager
+    async def note(self, context, job: str, note_id: str = ""):
+        """
+        async with recorder.note(context, job, note_id) as trace: ...
+        块内抛出异常时按失败保存；软失败调用 trace.fail(原因)
+        """
+        trace = await self.begin(context, job, note_id)
+        failure = None
+        try:
+            yield trace
+        except Exception as e:
+            failure = type(e).__name__
+            raise
+        finally:
+            await self.end(trace, failure)
+
+    def list(self, job: Optional[str] = None) -> List[Dict[str, Any]]:
+        """列出已保存的追踪文件，从新到旧"""
+        result = []
+        for path, size, mtime in self._files():
+            rel = os.path.relpath(path, self.root)
+            if job and rel.split(os.sep)[0] != _safe(job):
+                continue
+            result.append({"文件": path, "任务": rel.split(os.sep)[0], "大小KB": round(size / 1024, 1),
+                           "时间": datetime.fromtimestamp(mtime).strftime("%Y-%m-%d %H:%M:%S")})
+        return sorted(result, key=lambda r: r["时间"], reverse=True)
+
+    def _files(self):
+        if not os.path.isdir(self.root):
+            return []
+        files = []
+        for dirpath, _, names in os.walk(self.root):
+            for name in names:
+                if name.endswith(".zip"):
+                    path = os.path.join(dirpath, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    files.append((path, st.st_size, st.st_mtime))
+        return files
+
+    def enforce_budget(self, budget_bytes: Optional[int] = None) -> Dict[str, Any]:
+        """总大小超过预算时从最旧的追踪文件开始删除，并清理空的任务目录"""
+        budget = self.budget_bytes if budget_bytes is None else budget_bytes
+        files = sorted(self._files(), key=lambda f: f[2])
+        total = sum(size for _, size, _ in files)
+        removed = 0
+        for path, size, _ in files:
+            if total <= budget:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+            parent = os.path.dirname(path)
+            if parent != self.root and not os.listdir(parent):
+                os.rmdir(parent)
+        if removed:
+            metrics.inc("traces_evicted_total", removed)
+        metrics.set_gauge("trace_bytes", total)
+        return {"删除文件数": removed, "剩余字节": total}
+
+
+_recorder: Optional[TraceRecorder] = None
+
+
+def get_trace_recorder() -> TraceRecorder:
+    """获取全局追踪记录器（只在浏览器所在的事件循环中使用）"""
+    global _recorder
+    if _recorder is None:
+        _recorder = TraceRecorder()
+    return _recorder
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="失败现场的 Playwright 追踪文件")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_list = sub.add_parser("list", help="列出已保存的追踪文件")
+    p_list.add_argument("--job", default=None, help="只列出某个任务的追踪")
+    p_prune = sub.add_parser("prune", help="按磁盘预算删除最旧的追踪文件")
+    p_prune.add_argument("--budget-mb", type=float, default=BUDGET_MB)
+    args = parser.parse_args(argv)
+
+    recorder = get_trace_recorder()
+    if args.command == "list":
+        result: Any = recorder.list(args.job)
+    else:
+        result = recorder.enforce_budget(int(args.budget_mb * 1024 * 1024))
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
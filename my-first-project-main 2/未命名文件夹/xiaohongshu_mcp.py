@@ -1,45 +1,105 @@
+"""
+小红书爬虫共享核心：浏览器管理、搜索/笔记/评论抓取、分析与爬取逻辑
+
+这里只依赖标准库，Playwright、pandas 等重量级依赖在首次使用时才导入。
+对外入口分别在：
+- mcp_server.py  MCP stdio 服务器
+- http_api.py    Flask HTTP API
+- cli.py         命令行
+"""
 from typing import Any, List, Dict, Optional
 import asyncio
-import json
 import os
-import pandas as pd
 from datetime import datetime
-from playwright.async_api import async_playwright
-from fastmcp import FastMCP
 import re
-import glob
-from flask import Flask, request, jsonify, send_from_directory
-from flask_cors import CORS
-
-# 初始化 FastMCP 服务器
-mcp = FastMCP("xiaohongshu_scraper")
+import threading
+import time
+from domain_classifier import get_classifier, classify_corpus
+from keyword_extractor import extract_keywords, get_keyword_engine
+from note_stats import get_note_stats
+from browser_lifecycle import PageLifecycle
+from page_pool import PagePool
+from notes_corpus import load_note_file, note_id_from_url
+from fast_fetch import FastFetchError, fetch_note_fast
+from html_archive import archive_page
+from extraction_rules import close_modal, extract_page, query_main_image, wait_for_images, wait_for_note
+from politeness import AdaptiveLimit, get_pacer
+from comment_store import MAX_DEPTH, MAX_FANOUT, get_comment_store
+from near_duplicates import SKIP_DUPLICATE_DETAILS, complete_duplicate, doc_key, get_dedup_index
+from search_index import KIND_COMMENT, KIND_NOTE, get_search_index
+from time_index import annotate_times, format_utc, get_time_index, normalize_time
+from comment_stream import collect_comments, load_more_comments, scroll_to_comments, stream_comments
+from card_listing import (MAX_SCROLL_ROUNDS, collect_cards, query_cards, read_card_link, read_card_title, search_url,
+                          stream_cards, wait_for_cards)
+from trace_capture import get_trace_recorder
+from post_processing import get_post_processor, start_lag_monitor, write_file
+from engagement import DEFAULT_INTERVAL as DEFAULT_ENGAGEMENT_INTERVAL, get_engagement_store
+from crawl_errors import (CircuitBreaker, LoginWallError, MAX_NOTE_ATTEMPTS, ModalStuck, NavigationTimeout,
+                          SelectorMiss, call_with_retry, classify_error, default_policy)
+import metrics
 
 # 全局变量
-BROWSER_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "browser_data")
-DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# 批量爬取的子进程各自使用一份配置目录副本（XHS_BROWSER_DATA_DIR）
+BROWSER_DATA_DIR = os.environ.get("XHS_BROWSER_DATA_DIR") or os.path.join(BASE_DIR, "browser_data")
+DATA_DIR = os.path.join(BASE_DIR, "data")
+# 无界面运行（定时任务、批量爬取）；需要配置目录中已有登录状态
+HEADLESS = os.environ.get("XHS_HEADLESS", "") == "1"
+NOTES_DIR = os.path.join(BASE_DIR, "scraped_notes")
 TIMESTAMP = datetime.now().strftime("%Y%m%d_%H%M%S")
 
-# 确保目录存在
-os.makedirs(BROWSER_DATA_DIR, exist_ok=True)
-os.makedirs(DATA_DIR, exist_ok=True)
+def ensure_dirs():
+    """确保运行时目录存在（在首次启动浏览器时调用，而不是导入时）"""
+    os.makedirs(BROWSER_DATA_DIR, exist_ok=True)
+    os.makedirs(DATA_DIR, exist_ok=True)
 
 # 用于存储浏览器上下文，以便在不同方法之间共享
+playwright_instance = None
 browser_context = None
 main_page = None
 is_logged_in = False
 
-async def ensure_browser():
-    """确保浏览器已启动并登录"""
-    global browser_context, main_page, is_logged_in
+# 自定义配置目录时生命周期状态放在配置目录旁边，多个子进程互不覆盖
+LIFECYCLE_STATE_PATH = (BROWSER_DATA_DIR + ".lifecycle.json" if os.environ.get("XHS_BROWSER_DATA_DIR")
+                        else os.path.join(DATA_DIR, "lifecycle_state.json"))
+# 页面回收、卡死检测与缓存清理
+lifecycle = PageLifecycle(BROWSER_DATA_DIR, LIFECYCLE_STATE_PATH)
+# 失败现场的 Playwright 追踪（XHS_TRACE=1 时开启）
+tracer = get_trace_recorder()
+# 写文件、分词分类、索引更新等后处理在线程池中执行，不占用驱动浏览器的事件循环
+post = get_post_processor()
+
+XHS_HOME_URL = "https://www.xiaohongshu.com"
+# 登录后才会下发的会话 Cookie
+LOGIN_COOKIE_NAMES = ("web_session",)
+# 登录状态缓存有效期（秒），过期后重新读取 Cookie（不加载页面）
+LOGIN_CACHE_TTL = 300
+# 导航后判断是否落在登录墙上的选择器
+LOGIN_WALL_SELECTORS = '.login-container, .login-modal, #login-container, div[class*="login-box"]'
+# get_note_comments 结果文本中最多列出的评论数，其余评论只在评论文件中
+COMMENT_RESULT_LIMIT = int(os.environ.get("XHS_COMMENT_RESULT_LIMIT", 200))
+
+# 登录状态缓存：value 为最近一次判断结果，checked_at 为判断时间；
+# wall_session 记录撞上登录墙时的会话 Cookie，同一个会话不会再被 Cookie 判定为已登录
+_login_cache = {"value": None, "checked_at": 0.0, "wall_session": None}
+
+async def launch_browser():
+    """启动持久化浏览器上下文并准备主页面（已启动时直接返回）"""
+    global playwright_instance, browser_context, main_page
     
     if browser_context is None:
-        # 启动浏览器
-        playwright_instance = await async_playwright().start()
+        # 启动浏览器（Playwright 在首次使用时才导入）
+        from playwright.async_api import async_playwright
+        ensure_dirs()
+        # 浏览器未运行时顺便按计划清理配置目录中的缓存
+        lifecycle.cleanup_profile_if_due()
+        if playwright_instance is None:
+            playwright_instance = await async_playwright().start()
         
         # 使用持久化上下文来保存用户状态
         browser_context = await playwright_instance.chromium.launch_persistent_context(
             user_data_dir=BROWSER_DATA_DIR,
-            headless=False,  # 非隐藏模式，方便用户登录
+            headless=HEADLESS,  # 默认非隐藏模式，方便用户登录
             viewport={"width": 1280, "height": 800},
             timeout=60000
         )
@@ -52,31 +112,227 @@ async def ensure_browser():
         
         # 设置页面级别的超时时间
         main_page.set_default_timeout(60000)
+        # 浏览器所在的事件循环上报调度延迟
+        start_lag_monitor()
     
-    # 检查登录状态
-    if not is_logged_in:
-        # 访问小红书首页
-        await main_page.goto("https://www.xiaohongshu.com", timeout=60000)
-        await asyncio.sleep(3)
-        
-        # 检查是否已登录
-        login_elements = await main_page.query_selector_all('text="登录"')
-        if login_elements:
-            return False  # 需要登录
-        else:
-            is_logged_in = True
-            return True  # 已登录
-    
+    return browser_context
+
+async def close_browser():
+    """关闭浏览器上下文（卡死时关闭失败也会丢弃引用）"""
+    global browser_context, main_page
+    context, browser_context, main_page = browser_context, None, None
+    if context is not None:
+        try:
+            await asyncio.wait_for(context.close(), lifecycle.config.health_timeout)
+        except Exception as e:
+            print(f"[日志] 关闭浏览器失败，直接丢弃: {e}")
+
+# 重启前等待已租出页面归还的最长时间（秒），超时后照常重启
+RESTART_DRAIN_TIMEOUT = float(os.environ.get("XHS_RESTART_DRAIN_TIMEOUT", 120))
+_restart_lock = asyncio.Lock()
+
+async def restart_browser(reason: str):
+    """
+    重启浏览器并返回新的主页面：先暂停页面池的新租借，等已租出的页面用完归还再重启，
+    正在使用页面的调用不会被中途打断；多个调用方同时要求重启时只重启一次
+    """
+    if _restart_lock.locked():
+        # 已经有人在重启，等它完成后直接使用新的主页面
+        async with _restart_lock:
+            return main_page
+    async with _restart_lock:
+        print(f"[日志] 准备重启浏览器，原因: {reason}，等待 {page_pool.leased} 个已租出的页面归还")
+        if not await page_pool.pause(RESTART_DRAIN_TIMEOUT):
+            print(f"[日志] 等待超时，仍有 {page_pool.leased} 个页面未归还，直接重启")
+        try:
+            print(f"[日志] 重启浏览器，原因: {reason}")
+            metrics.inc("browser_restarts_total", reason=reason)
+            metrics.record_event("browser_restart", reason=reason)
+            await close_browser()
+            await page_pool.reset()
+            lifecycle.mark_restarted()
+            await launch_browser()
+        finally:
+            page_pool.resume()
+        return main_page
+
+async def recycle_main_page(reason: str):
+    """用同一上下文中的新页面替换主页面，并关闭旧页面释放内存"""
+    global main_page
+    old_page = main_page
+    new_page = await browser_context.new_page()
+    new_page.set_default_timeout(60000)
+    main_page = new_page
+    lifecycle.forget(old_page)
+    try:
+        await old_page.close()
+    except Exception as e:
+        print(f"[日志] 关闭旧页面失败: {e}")
+    metrics.inc("page_recycles_total", reason=reason)
+    metrics.record_event("page_recycle", reason=reason)
+    print(f"[日志] 已回收页面，原因: {reason}")
+    return main_page
+
+async def new_pool_page():
+    """页面池创建新页面：与主页面共用同一个持久化上下文（共享登录 Cookie）"""
+    await launch_browser()
+    page = await browser_context.new_page()
+    page.set_default_timeout(60000)
+    return page
+
+async def on_pool_page_release(page) -> bool:
+    """页面归还时的生命周期检查，返回是否继续复用"""
+    if lifecycle.health_check_due() and not await lifecycle.check_health(page):
+        await restart_browser("hang")
+        return False
+    restart = await lifecycle.restart_reason()
+    if restart:
+        await restart_browser(restart)
+        return False
+    reason = await lifecycle.recycle_reason(page)
+    if reason:
+        lifecycle.forget(page)
+        metrics.inc("page_recycles_total", reason=reason)
+        metrics.record_event("page_recycle", reason=reason, pooled=True)
+        return False
+    await lifecycle.maybe_clear_cache(page)
     return True
 
-@mcp.tool()
+# 整个站点的节奏控制器：页面池和批量任务的并发数都跟随它的并发上限
+site_pacer = get_pacer(XHS_HOME_URL)
+
+# MCP 工具调用使用的页面池：同时租出的页面数跟随站点并发上限，最多 XHS_PAGE_POOL_SIZE 个，超出时排队
+page_pool = PagePool(new_pool_page, size=int(os.environ.get("XHS_PAGE_POOL_SIZE", site_pacer.config.max_concurrency)),
+                     on_release=on_pool_page_release, limit=lambda: site_pacer.concurrency)
+
+async def page_checkpoint(page):
+    """
+    在一条笔记处理完后调用：卡死或整个浏览器内存超过阈值时重启浏览器，
+    页面处理的笔记数或 JS 堆超过阈值时回收页面，到期时清空缓存；返回之后应当使用的页面
+    """
+    if lifecycle.health_check_due() and not await lifecycle.check_health(page):
+        return await restart_browser("hang")
+    restart = await lifecycle.restart_reason()
+    if restart:
+        return await restart_browser(restart)
+    reason = await lifecycle.recycle_reason(page)
+    if reason:
+        if page is main_page:
+            return await recycle_main_page(reason)
+        lifecycle.forget(page)
+    await lifecycle.maybe_clear_cache(page)
+    return page
+
+def mark_login_state(value: bool, wall_session: Optional[str] = None):
+    """更新登录状态缓存"""
+    global is_logged_in
+    is_logged_in = value
+    _login_cache["value"] = value
+    _login_cache["checked_at"] = time.monotonic()
+    if value:
+        _login_cache["wall_session"] = None
+    elif wall_session is not None:
+        _login_cache["wall_session"] = wall_session
+
+async def get_session_cookie() -> Optional[str]:
+    """读取持久化上下文中的登录会话 Cookie，未登录或已过期时返回 None"""
+    cookies = await browser_context.cookies(XHS_HOME_URL)
+    now = time.time()
+    for cookie in cookies:
+        if cookie.get("name") in LOGIN_COOKIE_NAMES and cookie.get("value"):
+            expires = cookie.get("expires", -1)
+            if expires is None or expires < 0 or expires > now:
+                return cookie["value"]
+    return None
+
+async def check_login(force: bool = False) -> bool:
+    """
+    通过 Cookie 判断登录状态，不加载任何页面；结果缓存 LOGIN_CACHE_TTL 秒
+    """
+    cached = _login_cache["value"]
+    if not force and cached is not None and time.monotonic() - _login_cache["checked_at"] < LOGIN_CACHE_TTL:
+        return cached
+    session = await get_session_cookie()
+    logged_in = session is not None and session != _login_cache["wall_session"]
+    mark_login_state(logged_in)
+    return logged_in
+
+async def is_login_wall(page) -> bool:
+    """判断当前页面是否是登录页或弹出了登录框"""
+    if "login" in (page.url or "").lower():
+        return True
+    try:
+        return await page.query_selector(LOGIN_WALL_SELECTORS) is not None
+    except Exception:
+        return False
+
+async def goto_page(page, url: str, timeout: int = 60000):
+    """
+    导航到指定页面；只有真正落在登录墙上时才把登录状态置为未登录。
+    导航受该站点的节奏控制器约束，耗时和出错情况会反馈给它
+    """
+    async with get_pacer(url).request() as outcome:
+        try:
+            response = await page.goto(url, timeout=timeout)
+        except Exception as e:
+            error = classify_error(e)
+            if isinstance(error, NavigationTimeout):
+                raise error from e
+            raise
+        outcome.error = response is not None and (response.status == 429 or response.status >= 500)
+    if _login_cache["value"] and await is_login_wall(page):
+        print(f"[日志] 导航到 {url} 时遇到登录墙，登录状态失效")
+        mark_login_state(False, wall_session=await get_session_cookie())
+    return response
+
+async def ensure_browser():
+    """确保浏览器已启动并登录"""
+    await launch_browser()
+    # 按需检查主页面：卡死则重启浏览器，超过阈值则回收页面
+    await page_checkpoint(main_page)
+    # 检查登录状态（读取 Cookie，带缓存）
+    return await check_login()
+
+async def prewarm_browser():
+    """
+    服务启动时预热：启动浏览器、探测登录状态并打开一次首页，
+    让第一次工具调用不再承担浏览器冷启动的开销
+    """
+    start = time.monotonic()
+    try:
+        await launch_browser()
+        logged_in = await check_login(force=True)
+        await goto_page(main_page, XHS_HOME_URL)
+        print(f"[日志] 浏览器预热完成，耗时 {time.monotonic() - start:.1f}s，登录状态: {'已登录' if logged_in else '未登录'}")
+    except Exception as e:
+        print(f"[日志] 浏览器预热失败: {e}")
+
+# HTTP API 等同步调用方共用的后台事件循环：浏览器对象绑定在创建它的事件循环上，
+# 因此所有浏览器操作都要在同一个循环里执行
+_background_loop = None
+_background_lock = threading.Lock()
+
+def get_background_loop():
+    """获取（必要时启动）后台事件循环线程"""
+    global _background_loop
+    with _background_lock:
+        if _background_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="browser-loop", daemon=True).start()
+            _background_loop = loop
+    return _background_loop
+
+def run_sync(coro, timeout: Optional[float] = None):
+    """在后台事件循环中执行协程并等待结果"""
+    return asyncio.run_coroutine_threadsafe(coro, get_background_loop()).result(timeout)
+
+def start_prewarm():
+    """在后台事件循环中异步预热浏览器，不阻塞调用方"""
+    return asyncio.run_coroutine_threadsafe(prewarm_browser(), get_background_loop())
+
 async def login() -> str:
     """登录小红书账号"""
-    global is_logged_in
-    
-    await ensure_browser()
-    
-    if is_logged_in:
+    if await ensure_browser():
         return "已登录小红书账号"
     
     # 访问小红书登录页面
@@ -100,7 +356,7 @@ async def login() -> str:
             # 检查是否已登录成功
             still_login = await main_page.query_selector_all('text="登录"')
             if not still_login:
-                is_logged_in = True
+                mark_login_state(True)
                 await asyncio.sleep(2)  # 等待页面加载
                 return "登录成功！"
             
@@ -110,61 +366,26 @@ async def login() -> str:
         
         return "登录等待超时。请重试或手动登录后再使用其他功能。"
     else:
-        is_logged_in = True
+        mark_login_state(True)
         return "已登录小红书账号"
 
-@mcp.tool()
 async def search_notes(keywords: str, limit: int = 5) -> str:
     """
     根据关键词搜索小红书笔记，返回前limit条结果。
     """
-    global main_page
-    return await do_search_notes(main_page, keywords, limit)
+    await ensure_browser()
+    async with page_pool.lease() as page:
+        return await do_search_notes(page, keywords, limit)
 
 async def do_search_notes(main_page, keywords: str, limit: int = 5) -> str:
     """
     实际执行小红书搜索并返回前limit条结果。
     """
-    # 跳转到搜索页面
-    await main_page.goto(f"https://www.xiaohongshu.com/search_result?keyword={keywords}", timeout=60000)
-    await asyncio.sleep(5)  # 等待页面加载
-    # 以下为原search_notes核心爬取逻辑的简化版
     try:
-        # 尝试获取帖子卡片
-        post_cards = await main_page.query_selector_all('section.note-item')
-        if not post_cards:
-            post_cards = await main_page.query_selector_all('div[data-v-a264b01a]')
-        post_links = []
-        post_titles = []
-        for card in post_cards:
-            try:
-                link_element = await card.query_selector('a[href*="/explore/"]')
-                if not link_element:
-                    continue
-                href = await link_element.get_attribute('href')
-                if href and '/explore/' in href:
-                    full_url = f"https://www.xiaohongshu.com{href}"
-                    post_links.append(full_url)
-                    # 获取标题
-                    title_element = await card.query_selector('a.title span')
-                    if title_element:
-                        title = await title_element.text_content()
-                    else:
-                        title = "未知标题"
-                    post_titles.append(title)
-            except Exception:
-                continue
-        # 去重
-        unique_posts = []
-        seen_urls = set()
-        for url, title in zip(post_links, post_titles):
-            if url not in seen_urls:
-                seen_urls.add(url)
-                unique_posts.append({"url": url, "title": title})
-        unique_posts = unique_posts[:limit]
-        if unique_posts:
+        posts = await get_note_links_by_keywords(main_page, keywords, limit)
+        if posts:
             result = "搜索结果：\n\n"
-            for i, post in enumerate(unique_posts, 1):
+            for i, post in enumerate(posts, 1):
                 result += f"{i}. {post['title']}\n   链接: {post['url']}\n\n"
             return result
         else:
@@ -172,7 +393,31 @@ async def do_search_notes(main_page, keywords: str, limit: int = 5) -> str:
     except Exception as e:
         return f"搜索笔记时出错: {str(e)}"
 
-@mcp.tool()
+async def list_notes(keywords: str, limit: int = 100) -> dict:
+    """快速列出搜索结果：只读取结果卡片上的标题、作者、封面、点赞数和笔记ID，不打开任何笔记详情，
+    适合按关键词批量监控趋势（几百条笔记只需几秒到几十秒）
+
+    Args:
+        keywords: 搜索关键词
+        limit: 最多列出的笔记数
+    """
+    if not await ensure_browser():
+        return {"error": "请先登录小红书账号"}
+    async with page_pool.lease() as page:
+        try:
+            return await list_notes_on_page(page, keywords, limit)
+        except Exception as e:
+            return {"error": f"列出笔记时出错: {str(e)}"}
+
+async def list_notes_on_page(page, keywords: str, limit: int = 100, rounds: int = MAX_SCROLL_ROUNDS) -> Dict[str, Any]:
+    """在给定页面上打开搜索结果并边滚动边收集卡片"""
+    await goto_page(page, search_url(keywords))
+    found = await wait_for_cards(page)
+    get_pacer(page.url).record_result(empty=not found)
+    if not found and await is_login_wall(page):
+        raise LoginWallError("搜索结果页遇到登录墙")
+    return await collect_cards(page, keywords, limit, rounds)
+
 async def get_note_content(url: str) -> str:
     """获取笔记内容
     
@@ -184,498 +429,30 @@ async def get_note_content(url: str) -> str:
         return "请先登录小红书账号"
     
     try:
-        # 访问帖子链接
-        await main_page.goto(url, timeout=60000)
-        await asyncio.sleep(10)  # 增加等待时间到10秒
-        
-        # 增强滚动操作以确保所有内容加载
-        await main_page.evaluate('''
-            () => {
-                // 先滚动到页面底部
-                window.scrollTo(0, document.body.scrollHeight);
-                setTimeout(() => { 
-                    // 然后滚动到中间
-                    window.scrollTo(0, document.body.scrollHeight / 2); 
-                }, 1000);
-                setTimeout(() => { 
-                    // 最后回到顶部
-                    window.scrollTo(0, 0); 
-                }, 2000);
-            }
-        ''')
-        await asyncio.sleep(3)  # 等待滚动完成和内容加载
-        
-        # 打印页面结构片段用于分析
-        try:
-            print("打印页面结构片段用于分析")
-            page_structure = await main_page.evaluate('''
-                () => {
-                    // 获取笔记内容区域
-                    const noteContent = document.querySelector('.note-content');
-                    const detailDesc = document.querySelector('#detail-desc');
-                    const commentArea = document.querySelector('.comments-container, .comment-list');
-                    
-                    return {
-                        hasNoteContent: !!noteContent,
-                        hasDetailDesc: !!detailDesc,
-                        hasCommentArea: !!commentArea,
-                        noteContentHtml: noteContent ? noteContent.outerHTML.slice(0, 500) : null,
-                        detailDescHtml: detailDesc ? detailDesc.outerHTML.slice(0, 500) : null,
-                        commentAreaFirstChild: commentArea ? 
-                            (commentArea.firstElementChild ? commentArea.firstElementChild.outerHTML.slice(0, 500) : null) : null
-                    };
-                }
-            ''')
-            print(f"页面结构分析: {json.dumps(page_structure, ensure_ascii=False, indent=2)}")
-        except Exception as e:
-            print(f"打印页面结构时出错: {str(e)}")
-        
-        # 获取帖子内容
-        post_content = {}
-        
-        # 获取帖子标题 - 方法1：使用id选择器
-        try:
-            print("尝试获取标题 - 方法1：使用id选择器")
-            title_element = await main_page.query_selector('#detail-title')
-            if title_element:
-                title = await title_element.text_content()
-                post_content["标题"] = title.strip() if title else "未知标题"
-                print(f"方法1获取到标题: {post_content['标题']}")
-            else:
-                print("方法1未找到标题元素")
-                post_content["标题"] = "未知标题"
-        except Exception as e:
-            print(f"方法1获取标题出错: {str(e)}")
-            post_content["标题"] = "未知标题"
-        
-        # 获取帖子标题 - 方法2：使用class选择器
-        if post_content["标题"] == "未知标题":
-            try:
-                print("尝试获取标题 - 方法2：使用class选择器")
-                title_element = await main_page.query_selector('div.title')
-                if title_element:
-                    title = await title_element.text_content()
-                    post_content["标题"] = title.strip() if title else "未知标题"
-                    print(f"方法2获取到标题: {post_content['标题']}")
-                else:
-                    print("方法2未找到标题元素")
-            except Exception as e:
-                print(f"方法2获取标题出错: {str(e)}")
-        
-        # 获取帖子标题 - 方法3：使用JavaScript
-        if post_content["标题"] == "未知标题":
-            try:
-                print("尝试获取标题 - 方法3：使用JavaScript")
-                title = await main_page.evaluate('''
-                    () => {
-                        // 尝试多种可能的标题选择器
-                        const selectors = [
-                            '#detail-title',
-                            'div.title',
-                            'h1',
-                            'div.note-content div.title'
-                        ];
-                        
-                        for (const selector of selectors) {
-                            const el = document.querySelector(selector);
-                            if (el && el.textContent.trim()) {
-                                return el.textContent.trim();
-                            }
-                        }
-                        return null;
-                    }
-                ''')
-                if title:
-                    post_content["标题"] = title
-                    print(f"方法3获取到标题: {post_content['标题']}")
-                else:
-                    print("方法3未找到标题元素")
-            except Exception as e:
-                print(f"方法3获取标题出错: {str(e)}")
-        
-        # 获取作者 - 方法1：使用username类选择器
-        try:
-            print("尝试获取作者 - 方法1：使用username类选择器")
-            author_element = await main_page.query_selector('span.username')
-            if author_element:
-                author = await author_element.text_content()
-                post_content["作者"] = author.strip() if author else "未知作者"
-                print(f"方法1获取到作者: {post_content['作者']}")
-            else:
-                print("方法1未找到作者元素")
-                post_content["作者"] = "未知作者"
-        except Exception as e:
-            print(f"方法1获取作者出错: {str(e)}")
-            post_content["作者"] = "未知作者"
-        
-        # 获取作者 - 方法2：使用链接选择器
-        if post_content["作者"] == "未知作者":
-            try:
-                print("尝试获取作者 - 方法2：使用链接选择器")
-                author_element = await main_page.query_selector('a.name')
-                if author_element:
-                    author = await author_element.text_content()
-                    post_content["作者"] = author.strip() if author else "未知作者"
-                    print(f"方法2获取到作者: {post_content['作者']}")
-                else:
-                    print("方法2未找到作者元素")
-            except Exception as e:
-                print(f"方法2获取作者出错: {str(e)}")
-        
-        # 获取作者 - 方法3：使用JavaScript
-        if post_content["作者"] == "未知作者":
-            try:
-                print("尝试获取作者 - 方法3：使用JavaScript")
-                author = await main_page.evaluate('''
-                    () => {
-                        // 尝试多种可能的作者选择器
-                        const selectors = [
-                            'span.username',
-                            'a.name',
-                            '.author-wrapper .username',
-                            '.info .name'
-                        ];
-                        
-                        for (const selector of selectors) {
-                            const el = document.querySelector(selector);
-                            if (el && el.textContent.trim()) {
-                                return el.textContent.trim();
-                            }
-                        }
-                        return null;
-                    }
-                ''')
-                if author:
-                    post_content["作者"] = author
-                    print(f"方法3获取到作者: {post_content['作者']}")
-                else:
-                    print("方法3未找到作者元素")
-            except Exception as e:
-                print(f"方法3获取作者出错: {str(e)}")
-        
-        # 获取发布时间 - 方法1：使用date类选择器
-        try:
-            print("尝试获取发布时间 - 方法1：使用date类选择器")
-            time_element = await main_page.query_selector('span.date')
-            if time_element:
-                time_text = await time_element.text_content()
-                post_content["发布时间"] = time_text.strip() if time_text else "未知"
-                print(f"方法1获取到发布时间: {post_content['发布时间']}")
-            else:
-                print("方法1未找到发布时间元素")
-                post_content["发布时间"] = "未知"
-        except Exception as e:
-            print(f"方法1获取发布时间出错: {str(e)}")
-            post_content["发布时间"] = "未知"
-        
-        # 获取发布时间 - 方法2：使用正则表达式匹配
-        if post_content["发布时间"] == "未知":
-            try:
-                print("尝试获取发布时间 - 方法2：使用正则表达式匹配")
-                time_selectors = [
-                    'text=/编辑于/',
-                    'text=/\\d{2}-\\d{2}/',
-                    'text=/\\d{4}-\\d{2}-\\d{2}/',
-                    'text=/\\d+月\\d+日/',
-                    'text=/\\d+天前/',
-                    'text=/\\d+小时前/',
-                    'text=/今天/',
-                    'text=/昨天/'
-                ]
-                
-                for selector in time_selectors:
-                    time_element = await main_page.query_selector(selector)
-                    if time_element:
-                        time_text = await time_element.text_content()
-                        post_content["发布时间"] = time_text.strip() if time_text else "未知"
-                        print(f"方法2获取到发布时间: {post_content['发布时间']}")
-                        break
-                    else:
-                        print(f"方法2未找到发布时间元素: {selector}")
-            except Exception as e:
-                print(f"方法2获取发布时间出错: {str(e)}")
-        
-        # 获取发布时间 - 方法3：使用JavaScript
-        if post_content["发布时间"] == "未知":
-            try:
-                print("尝试获取发布时间 - 方法3：使用JavaScript")
-                time_text = await main_page.evaluate('''
-                    () => {
-                        // 尝试多种可能的时间选择器
-                        const selectors = [
-                            'span.date',
-                            '.bottom-container .date',
-                            '.date'
-                        ];
-                        
-                        for (const selector of selectors) {
-                            const el = document.querySelector(selector);
-                            if (el && el.textContent.trim()) {
-                                return el.textContent.trim();
-                            }
-                        }
-                        
-                        // 尝试查找包含日期格式的文本
-                        const dateRegexes = [
-                            /编辑于\s*([\d-]+)/,
-                            /(\d{2}-\d{2})/,
-                            /(\d{4}-\d{2}-\d{2})/,
-                            /(\d+月\d+日)/,
-                            /(\d+天前)/,
-                            /(\d+小时前)/,
-                            /(今天)/,
-                            /(昨天)/
-                        ];
-                        
-                        const allText = document.body.textContent;
-                        for (const regex of dateRegexes) {
-                            const match = allText.match(regex);
-                            if (match) {
-                                return match[0];
-                            }
-                        }
-                        
-                        return null;
-                    }
-                ''')
-                if time_text:
-                    post_content["发布时间"] = time_text
-                    print(f"方法3获取到发布时间: {post_content['发布时间']}")
-                else:
-                    print("方法3未找到发布时间元素")
-            except Exception as e:
-                print(f"方法3获取发布时间出错: {str(e)}")
-        
-        # 获取帖子正文内容 - 方法1：使用精确的ID和class选择器
-        try:
-            print("尝试获取正文内容 - 方法1：使用精确的ID和class选择器")
-            
-            # 先明确标记评论区域
-            await main_page.evaluate('''
-                () => {
-                    const commentSelectors = [
-                        '.comments-container', 
-                        '.comment-list',
-                        '.feed-comment',
-                        'div[data-v-aed4aacc]',  // 根据您提供的评论HTML结构
-                        '.content span.note-text'  // 评论中的note-text结构
-                    ];
-                    
-                    for (const selector of commentSelectors) {
-                        const elements = document.querySelectorAll(selector);
-                        elements.forEach(el => {
-                            if (el) {
-                                el.setAttribute('data-is-comment', 'true');
-                                console.log('标记评论区域:', el.tagName, el.className);
-                            }
-                        });
-                    }
-                }
-            ''')
-            
-            # 先尝试获取detail-desc和note-text组合
-            content_element = await main_page.query_selector('#detail-desc .note-text')
-            if content_element:
-                # 检查是否在评论区域内
-                is_in_comment = await content_element.evaluate('(el) => !!el.closest("[data-is-comment=\'true\']") || false')
-                if not is_in_comment:
-                    content_text = await content_element.text_content()
-                    if content_text and len(content_text.strip()) > 50:  # 增加长度阈值
-                        post_content["内容"] = content_text.strip()
-                        print(f"方法1获取到正文内容，长度: {len(post_content['内容'])}")
-                    else:
-                        print(f"方法1获取到的内容太短: {len(content_text.strip() if content_text else 0)}")
-                        post_content["内容"] = "未能获取内容"
-                else:
-                    print("方法1找到的元素在评论区域内，跳过")
-                    post_content["内容"] = "未能获取内容"
-            else:
-                print("方法1未找到正文内容元素")
-                post_content["内容"] = "未能获取内容"
-        except Exception as e:
-            print(f"方法1获取正文内容出错: {str(e)}")
-            post_content["内容"] = "未能获取内容"
-        
-        # 获取帖子正文内容 - 方法2：使用XPath选择器
-        if post_content["内容"] == "未能获取内容":
-            try:
-                print("尝试获取正文内容 - 方法2：使用XPath选择器")
-                # 使用XPath获取笔记内容区域
-                content_text = await main_page.evaluate('''
-                    () => {
-                        const xpath = '//div[@id="detail-desc"]/span[@class="note-text"]';
-                        const result = document.evaluate(xpath, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null);
-                        const element = result.singleNodeValue;
-                        return element ? element.textContent.trim() : null;
-                    }
-                ''')
-                
-                if content_text and len(content_text) > 20:
-                    post_content["内容"] = content_text
-                    print(f"方法2获取到正文内容，长度: {len(post_content['内容'])}")
-                else:
-                    print(f"方法2获取到的内容太短或为空: {len(content_text) if content_text else 0}")
-            except Exception as e:
-                print(f"方法2获取正文内容出错: {str(e)}")
-        
-        # 获取帖子正文内容 - 方法3：使用JavaScript获取最长文本
-        if post_content["内容"] == "未能获取内容":
-            try:
-                print("尝试获取正文内容 - 方法3：使用JavaScript获取最长文本")
-                content_text = await main_page.evaluate('''
-                    () => {
-                        // 定义评论区域选择器
-                        const commentSelectors = [
-                            '.comments-container', 
-                            '.comment-list',
-                            '.feed-comment',
-                            'div[data-v-aed4aacc]',
-                            '.comment-item',
-                            '[data-is-comment="true"]'
-                        ];
-                        
-                        // 找到所有评论区域
-                        let commentAreas = [];
-                        for (const selector of commentSelectors) {
-                            const elements = document.querySelectorAll(selector);
-                            elements.forEach(el => commentAreas.push(el));
-                        }
-                        
-                        // 查找可能的内容元素，排除评论区
-                        const contentElements = Array.from(document.querySelectorAll('div#detail-desc, div.note-content, div.desc, span.note-text'))
-                            .filter(el => {
-                                // 检查是否在评论区域内
-                                const isInComment = commentAreas.some(commentArea => 
-                                    commentArea && commentArea.contains(el));
-                                
-                                if (isInComment) {
-                                    console.log('排除评论区域内容:', el.tagName, el.className);
-                                    return false;
-                                }
-                                
-                                const text = el.textContent.trim();
-                                return text.length > 100 && text.length < 10000;
-                            })
-                            .sort((a, b) => b.textContent.length - a.textContent.length);
-                        
-                        if (contentElements.length > 0) {
-                            console.log('找到内容元素:', contentElements[0].tagName, contentElements[0].className);
-                            return contentElements[0].textContent.trim();
-                        }
-                        
-                        return null;
-                    }
-                ''')
-                
-                if content_text and len(content_text) > 100:  # 增加长度阈值
-                    post_content["内容"] = content_text
-                    print(f"方法3获取到正文内容，长度: {len(post_content['内容'])}")
-                else:
-                    print(f"方法3获取到的内容太短或为空: {len(content_text) if content_text else 0}")
-            except Exception as e:
-                print(f"方法3获取正文内容出错: {str(e)}")
-        
-        # 获取帖子正文内容 - 方法4：区分正文和评论内容
-        if post_content["内容"] == "未能获取内容":
-            try:
-                print("尝试获取正文内容 - 方法4：区分正文和评论内容")
-                content_text = await main_page.evaluate('''
-                    () => {
-                        // 首先尝试获取note-content区域
-                        const noteContent = document.querySelector('.note-content');
-                        if (noteContent) {
-                            // 查找note-text，这通常包含主要内容
-                            const noteText = noteContent.querySelector('.note-text');
-                            if (noteText && noteText.textContent.trim().length > 50) {
-                                return noteText.textContent.trim();
-                            }
-                            
-                            // 如果没有找到note-text或内容太短，返回整个note-content
-                            if (noteContent.textContent.trim().length > 50) {
-                                return noteContent.textContent.trim();
-                            }
-                        }
-                        
-                        // 如果上面的方法都失败了，尝试获取所有段落并拼接
-                        const paragraphs = Array.from(document.querySelectorAll('p'))
-                            .filter(p => {
-                                // 排除评论区段落
-                                const isInComments = p.closest('.comments-container, .comment-list');
-                                return !isInComments && p.textContent.trim().length > 10;
-                            });
-                            
-                        if (paragraphs.length > 0) {
-                            return paragraphs.map(p => p.textContent.trim()).join('\n\n');
-                        }
-                        
-                        return null;
-                    }
-                ''')
-                
-                if content_text and len(content_text) > 50:
-                    post_content["内容"] = content_text
-                    print(f"方法4获取到正文内容，长度: {len(post_content['内容'])}")
-                else:
-                    print(f"方法4获取到的内容太短或为空: {len(content_text) if content_text else 0}")
-            except Exception as e:
-                print(f"方法4获取正文内容出错: {str(e)}")
-        
-        # 获取帖子正文内容 - 方法5：直接通过DOM结构定位
-        if post_content["内容"] == "未能获取内容":
-            try:
-                print("尝试获取正文内容 - 方法5：直接通过DOM结构定位")
-                content_text = await main_page.evaluate('''
-                    () => {
-                        // 根据您提供的HTML结构直接定位
-                        const noteContent = document.querySelector('div.note-content');
-                        if (noteContent) {
-                            const detailTitle = noteContent.querySelector('#detail-title');
-                            const detailDesc = noteContent.querySelector('#detail-desc');
-                            
-                            if (detailDesc) {
-                                const noteText = detailDesc.querySelector('span.note-text');
-                                if (noteText) {
-                                    return noteText.textContent.trim();
-                                }
-                                return detailDesc.textContent.trim();
-                            }
-                        }
-                        
-                        // 尝试其他可能的结构
-                        const descElements = document.querySelectorAll('div.desc');
-                        for (const desc of descElements) {
-                            // 检查是否在评论区
-                            const isInComment = desc.closest('.comments-container, .comment-list, .feed-comment');
-                            if (!isInComment && desc.textContent.trim().length > 100) {
-                                return desc.textContent.trim();
-                            }
-                        }
-                        
-                        return null;
-                    }
-                ''')
-                
-                if content_text and len(content_text) > 100:
-                    post_content["内容"] = content_text
-                    print(f"方法5获取到正文内容，长度: {len(post_content['内容'])}")
-                else:
-                    print(f"方法5获取到的内容太短或为空: {len(content_text) if content_text else 0}")
-            except Exception as e:
-                print(f"方法5获取正文内容出错: {str(e)}")
-        
-        # 格式化返回结果
-        result = f"标题: {post_content['标题']}\n"
-        result += f"作者: {post_content['作者']}\n"
-        result += f"发布时间: {post_content['发布时间']}\n"
-        result += f"链接: {url}\n\n"
-        result += f"内容:\n{post_content['内容']}"
-        
-        return result
+        return format_note_content(await fetch_note(url))
+    except Exception as e:
+        return f"获取笔记内容时出错: {str(e)}"
+
+async def do_get_note_content(main_page, url: str) -> str:
+    """
+    在指定页面上实际获取笔记内容。
+    """
+    try:
+        post_content = await extract_note_content(main_page, url)
+        return format_note_content(post_content)
     
     except Exception as e:
         return f"获取笔记内容时出错: {str(e)}"
 
-@mcp.tool()
+def format_note_content(post_content: Dict[str, Any]) -> str:
+    """把笔记字段格式化为 get_note_content 的文本结果"""
+    result = f"标题: {post_content['标题']}\n"
+    result += f"作者: {post_content['作者']}\n"
+    result += f"发布时间: {post_content['发布时间']}\n"
+    result += f"链接: {post_content['链接']}\n\n"
+    result += f"内容:\n{post_content['内容']}"
+    return result
+
 async def get_note_comments(url: str) -> str:
     """获取笔记评论
     
@@ -686,190 +463,270 @@ async def get_note_comments(url: str) -> str:
     if not login_status:
         return "请先登录小红书账号"
     
+    async with page_pool.lease() as page:
+        return await do_get_note_comments(page, url)
+
+async def do_get_note_comments(main_page, url: str) -> str:
+    """
+    在指定页面上实际获取笔记评论：按批流式提取并追加到评论文件，
+    结果文本只列出前 COMMENT_RESULT_LIMIT 条，其余在文件中
+    """
     try:
-        # 访问帖子链接
-        await main_page.goto(url, timeout=60000)
-        await asyncio.sleep(5)  # 等待页面加载
-        
-        # 先滚动到评论区
-        comment_section_locators = [
-            main_page.get_by_text("条评论", exact=False),
-            main_page.get_by_text("评论", exact=False),
-            main_page.locator("text=评论").first
-        ]
+        await open_note_page(main_page, url)
+        note_id = note_id_from_url(url) or note_id_from_url(main_page.url)
+        collected = await collect_comments(main_page, note_id, preview=COMMENT_RESULT_LIMIT)
+        return format_note_comments(collected["评论"], collected["评论数"], collected["文件"])
+    
+    except Exception as e:
+        return f"获取评论时出错: {str(e)}"
+
+def format_note_comments(comments: List[Dict[str, str]], total: Optional[int] = None,
+                         spool_path: Optional[str] = None) -> str:
+    """把评论列表格式化为 get_note_comments 的文本结果；total 超过列出的条数时注明其余评论所在文件"""
+    total = len(comments) if total is None else total
+    if comments:
+        parts = [f"共获取到 {total} 条评论：\n\n"]
+        for i, comment in enumerate(comments, 1):
+            parts.append(f"{i}. {comment['用户名']}（{comment['时间']}）: {comment['内容']}\n\n")
+        if total > len(comments):
+            parts.append(f"……其余 {total - len(comments)} 条评论已保存到 {spool_path}\n")
+        return "".join(parts)
+    else:
+        return "未找到任何评论，可能是帖子没有评论或评论区无法访问。"
+
+async def expand_comments(main_page, rounds: int = 8):
+    """
+    滚动到评论区，并按提取规则中的按钮文本点击“查看更多评论”，加载更多评论
+    """
+    await scroll_to_comments(main_page)
+    for i in range(rounds):
+        await load_more_comments(main_page)
+
+async def open_note_page(main_page, url: str):
+    """打开笔记页面，等正文渲染出来后上下滚动一遍，确保懒加载的图片加载完成"""
+    # 访问帖子链接，等待标题或正文出现（不再固定等待）
+    await goto_page(main_page, url)
+    await wait_for_note(main_page)
+    
+    # 滚到底部触发懒加载，等视口内图片加载完成后回到顶部
+    await main_page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
+    await wait_for_images(main_page)
+    await main_page.evaluate("window.scrollTo(0, 0)")
+    await wait_for_images(main_page)
+
+async def snapshot_note(main_page, url: str, with_comments: bool = True) -> Dict[str, Any]:
+    """
+    只导航一次，提取笔记的头部字段、正文、标签、图片和（可选）评论，返回一个结构化结果；
+    get_note_content / analyze_note 等都是它的投影
+    """
+    # 开启追踪时，抛出异常或没有取到正文的笔记保存追踪文件
+    async with tracer.note(browser_context, "snapshot", note_id_from_url(url)) as trace:
+        await open_note_page(main_page, url)
         
-        for locator in comment_section_locators:
+        # 需要评论时先展开评论区，再用一次 evaluate 取回全部字段和评论
+        if with_comments:
+            await expand_comments(main_page)
+        snapshot = await extract_page(main_page, comments=with_comments, tree=with_comments,
+                                      max_depth=MAX_DEPTH, max_fanout=MAX_FANOUT)
+        snapshot["链接"] = url
+        snapshot["笔记ID"] = note_id_from_url(url) or note_id_from_url(main_page.url)
+        empty = snapshot["标题"] == "未知标题" and snapshot["内容"] == "未能获取内容"
+        get_pacer(url).record_result(empty=empty)
+        if empty:
+            if await is_login_wall(main_page):
+                raise LoginWallError(f"打开笔记时遇到登录墙: {url}")
+            raise SelectorMiss(f"笔记页面没有提取到标题和正文: {url}")
+        if snapshot["内容"] == "未能获取内容":
+            trace.fail("no_content")
+    lifecycle.note_done(main_page)
+    if with_comments:
+        await post.run(save_comment_tree, snapshot["笔记ID"], snapshot.get("评论树") or [], label="comment_store")
+    # 开启归档时保存滚动加载完成后的 DOM，便于选择器失效后离线重新提取
+    await archive_page(main_page, url, snapshot["笔记ID"], source="snapshot")
+    # 发布时间和评论时间以本次抓取时间为参照规整为 UTC
+    annotate_times(snapshot, datetime.now())
+    metrics.inc("note_snapshots_total", with_comments=with_comments)
+    return snapshot
+
+def save_comment_tree(note_id: str, tree: List[Dict[str, Any]]):
+    """把抓到的评论树写入评论库（失败只记录日志，不影响抓取结果）"""
+    if not note_id or not tree:
+        return
+    try:
+        get_comment_store().save(note_id, tree)
+    except Exception as e:
+        print(f"[日志] 保存评论树失败: {e}")
+
+def append_comment_nodes(note_id: str, nodes: List[Dict[str, Any]], start_seq: int) -> int:
+    """
+    把流式抓取的一批评论树节点追加到评论库，start_seq 为 0 时先清空该笔记原有的评论树；
+    返回写入条数（失败只记录日志，返回 0）
+    """
+    try:
+        store = get_comment_store()
+        if start_seq == 0:
+            store.clear(note_id)
+        return store.append(note_id, nodes, start_seq)
+    except Exception as e:
+        print(f"[日志] 评论写入评论库失败: {e}")
+        return 0
+
+async def extract_note_content(main_page, url: str) -> Dict[str, Any]:
+    """打开笔记页面，返回不含评论的快照（出错时抛出异常）"""
+    return await snapshot_note(main_page, url, with_comments=False)
+
+async def extract_note_comments(main_page, url: str) -> List[Dict[str, str]]:
+    """打开笔记页面，返回评论列表（出错时抛出异常）"""
+    return (await snapshot_note(main_page, url, with_comments=True))["评论"]
+
+async def extract_note_full(main_page, url: str) -> Dict[str, Any]:
+    """打开笔记页面，返回包含评论的完整快照（出错时抛出异常）"""
+    return await snapshot_note(main_page, url, with_comments=True)
+
+# 整个站点共用的熔断器：失败集中出现时暂停所有页面抓取
+site_breaker = CircuitBreaker("xiaohongshu")
+
+# 轻量抓取不占用页面，可以比页面池高得多的并发同时进行
+fast_fetch_semaphore = asyncio.Semaphore(int(os.environ.get("XHS_FAST_FETCH_CONCURRENCY", 16)))
+
+async def fetch_note(url: str, with_comments: bool = False) -> Dict[str, Any]:
+    """
+    获取一条笔记：不需要评论时先走轻量抓取（解析内嵌初始状态，不渲染页面），
+    解析失败或需要评论时再租借页面做完整快照
+    """
+    if not with_comments:
+        try:
+            async with fast_fetch_semaphore, get_pacer(url).request() as outcome:
+                try:
+                    record = await fetch_note_fast(browser_context, url)
+                except FastFetchError as e:
+                    # 拿到了页面但没有可用数据计为空结果，HTTP 错误计为出错
+                    outcome.empty = not str(e).startswith(("HTTP", "请求失败"))
+                    raise
+            metrics.inc("note_fetch_total", path="fast")
+            return record
+        except FastFetchError as e:
+            print(f"[日志] 轻量抓取失败，退回页面抓取: {e}")
+            metrics.inc("note_fetch_total", path="fallback")
+    async def attempt():
+        async with page_pool.lease() as page:
+            return await snapshot_note(page, url, with_comments)
+    record = await call_with_retry(attempt, label=url, breaker=site_breaker)
+    record["抓取方式"] = "page"
+    metrics.inc("note_fetch_total", path="page")
+    return record
+
+async def fetch_note_comments(url: str) -> List[Dict[str, str]]:
+    """租借页面获取一条笔记的评论（失败时按错误类型重试）"""
+    async def attempt():
+        async with page_pool.lease() as page:
+            return await extract_note_comments(page, url)
+    return await call_with_retry(attempt, label=url, breaker=site_breaker)
+
+async def get_note_full(url: str) -> dict:
+    """一次页面加载获取笔记的完整信息：标题、作者、发布时间、正文、标签、图片和评论
+    
+    Args:
+        url: 笔记 URL
+    """
+    login_status = await ensure_browser()
+    if not login_status:
+        return {"error": "请先登录小红书账号"}
+    
+    async with page_pool.lease() as page:
+        try:
+            return await extract_note_full(page, url)
+        except Exception as e:
+            return {"error": f"获取笔记时出错: {str(e)}"}
+
+def normalize_note_url(item: str) -> str:
+    """批量工具的输入既可以是笔记链接也可以是笔记ID"""
+    item = (item or "").strip()
+    if item.startswith("http://") or item.startswith("https://"):
+        return item
+    return f"https://www.xiaohongshu.com/explore/{item}"
+
+async def run_batch(items: List[str], worker, concurrency: int = 0, item_timeout: float = 90,
+                    progress=None) -> Dict[str, Any]:
+    """
+    并发执行一批笔记任务：每条最多 item_timeout 秒，单条失败或超时不影响其他条目，
+    每完成一条调用一次 progress(已完成数, 总数, 说明)
+    
+    Args:
+        items: 笔记链接或笔记ID列表
+        worker: async (url) -> 结果数据
+        concurrency: 同时处理的条数上限，0 表示不另设上限；实际并发跟随站点节奏控制器的并发上限
+    """
+    total = len(items)
+    results: List[Optional[Dict[str, Any]]] = [None] * total
+    semaphore = AdaptiveLimit(lambda: min(concurrency or total, site_pacer.concurrency))
+    done_count = 0
+    
+    async def run_one(index: int, item: str):
+        nonlocal done_count
+        url = normalize_note_url(item)
+        start = time.monotonic()
+        entry: Dict[str, Any] = {"输入": item, "url": url}
+        async with semaphore:
             try:
-                if await locator.count() > 0:
-                    await locator.scroll_into_view_if_needed(timeout=5000)
-                    await asyncio.sleep(2)
-                    break
-            except Exception:
-                continue
-        
-        # 滚动页面以加载更多评论
-        for i in range(8):
+                entry["数据"] = await asyncio.wait_for(worker(url), item_timeout)
+                entry["状态"] = "ok"
+            except asyncio.TimeoutError:
+                entry["状态"] = "timeout"
+                entry["错误"] = f"超过 {item_timeout} 秒未完成"
+            except Exception as e:
+                entry["状态"] = "error"
+                entry["错误"] = str(e)
+        entry["耗时s"] = round(time.monotonic() - start, 2)
+        results[index] = entry
+        done_count += 1
+        metrics.inc("batch_items_total", status=entry["状态"])
+        if progress is not None:
             try:
-                await main_page.evaluate("window.scrollBy(0, 500)")
-                await asyncio.sleep(1)
-                
-                # 尝试点击"查看更多评论"按钮
-                more_comment_selectors = [
-                    "text=查看更多评论",
-                    "text=展开更多评论",
-                    "text=加载更多",
-                    "text=查看全部"
-                ]
-                
-                for selector in more_comment_selectors:
-                    try:
-                        more_btn = main_page.locator(selector).first
-                        if await more_btn.count() > 0 and await more_btn.is_visible():
-                            await more_btn.click()
-                            await asyncio.sleep(2)
-                    except Exception:
-                        continue
-            except Exception:
-                pass
-        
-        # 获取评论
-        comments = []
-        
-        # 使用特定评论选择器
-        comment_selectors = [
-            "div.comment-item", 
-            "div.commentItem",
-            "div.comment-content",
-            "div.comment-wrapper",
-            "section.comment",
-            "div.feed-comment"
-        ]
-        
-        for selector in comment_selectors:
-            comment_elements = main_page.locator(selector)
-            count = await comment_elements.count()
-            if count > 0:
-                for i in range(count):
-                    try:
-                        comment_element = comment_elements.nth(i)
-                        
-                        # 提取评论者名称
-                        username = "未知用户"
-                        username_selectors = ["span.user-name", "a.name", "div.username", "span.nickname", "a.user-nickname"]
-                        for username_selector in username_selectors:
-                            username_el = comment_element.locator(username_selector).first
-                            if await username_el.count() > 0:
-                                username = await username_el.text_content()
-                                username = username.strip()
-                                break
-                        
-                        # 如果没有找到，尝试通过用户链接查找
-                        if username == "未知用户":
-                            user_link = comment_element.locator('a[href*="/user/profile/"]').first
-                            if await user_link.count() > 0:
-                                username = await user_link.text_content()
-                                username = username.strip()
-                        
-                        # 提取评论内容
-                        content = "未知内容"
-                        content_selectors = ["div.content", "p.content", "div.text", "span.content", "div.comment-text"]
-                        for content_selector in content_selectors:
-                            content_el = comment_element.locator(content_selector).first
-                            if await content_el.count() > 0:
-                                content = await content_el.text_content()
-                                content = content.strip()
-                                break
-                        
-                        # 如果没有找到内容，可能内容就在评论元素本身
-                        if content == "未知内容":
-                            full_text = await comment_element.text_content()
-                            if username != "未知用户" and username in full_text:
-                                content = full_text.replace(username, "").strip()
-                            else:
-                                content = full_text.strip()
-                        
-                        # 提取评论时间
-                        time_location = "未知时间"
-                        time_selectors = ["span.time", "div.time", "span.date", "div.date", "time"]
-                        for time_selector in time_selectors:
-                            time_el = comment_element.locator(time_selector).first
-                            if await time_el.count() > 0:
-                                time_location = await time_el.text_content()
-                                time_location = time_location.strip()
-                                break
-                        
-                        # 如果内容有足够长度且找到用户名，添加评论
-                        if username != "未知用户" and content != "未知内容" and len(content) > 2:
-                            comments.append({
-                                "用户名": username,
-                                "内容": content,
-                                "时间": time_location
-                            })
-                    except Exception:
-                        continue
-                
-                # 如果找到了评论，就不继续尝试其他选择器了
-                if comments:
-                    break
-        
-        # 如果没有找到评论，尝试使用其他方法
-        if not comments:
-            # 获取所有用户名元素
-            username_elements = main_page.locator('a[href*="/user/profile/"]')
-            username_count = await username_elements.count()
-            
-            if username_count > 0:
-                for i in range(username_count):
-                    try:
-                        username_element = username_elements.nth(i)
-                        username = await username_element.text_content()
-                        
-                        # 尝试获取评论内容
-                        content = await main_page.evaluate('''
-                            (usernameElement) => {
-                                const parent = usernameElement.parentElement;
-                                if (!parent) return null;
-                                
-                                // 尝试获取同级的下一个元素
-                                let sibling = usernameElement.nextElementSibling;
-                                while (sibling) {
-                                    const text = sibling.textContent.trim();
-                                    if (text) return text;
-                                    sibling = sibling.nextElementSibling;
-                                }
-                                
-                                // 尝试获取父元素的文本，并过滤掉用户名
-                                const allText = parent.textContent.trim();
-                                if (allText && allText.includes(usernameElement.textContent.trim())) {
-                                    return allText.replace(usernameElement.textContent.trim(), '').trim();
-                                }
-                                
-                                return null;
-                            }
-                        ''', username_element)
-                        
-                        if username and content:
-                            comments.append({
-                                "用户名": username.strip(),
-                                "内容": content.strip(),
-                                "时间": "未知时间"
-                            })
-                    except Exception:
-                        continue
-        
-        # 格式化返回结果
-        if comments:
-            result = f"共获取到 {len(comments)} 条评论：\n\n"
-            for i, comment in enumerate(comments, 1):
-                result += f"{i}. {comment['用户名']}（{comment['时间']}）: {comment['内容']}\n\n"
-            return result
-        else:
-            return "未找到任何评论，可能是帖子没有评论或评论区无法访问。"
+                await progress(done_count, total, f"{entry['状态']}: {url}")
+            except Exception as e:
+                print(f"[日志] 发送进度通知失败: {e}")
     
-    except Exception as e:
-        return f"获取评论时出错: {str(e)}"
+    await asyncio.gather(*(run_one(i, item) for i, item in enumerate(items)))
+    succeeded = sum(1 for r in results if r and r["状态"] == "ok")
+    return {"总数": total, "成功数": succeeded, "失败数": total - succeeded, "结果": results}
+
+async def get_notes_batch(urls: List[str], concurrency: int = 0, item_timeout: float = 90,
+                          with_comments: bool = False, progress=None) -> dict:
+    """批量获取笔记内容，返回每条笔记的结构化结果（单条失败不影响其他条目）
+    
+    Args:
+        urls: 笔记链接或笔记ID列表
+        concurrency: 同时获取的笔记数上限，0 表示跟随站点节奏自动调整
+        item_timeout: 单条笔记的超时时间（秒）
+        with_comments: 是否在同一次页面加载中一并获取评论
+    """
+    if not await ensure_browser():
+        return {"error": "请先登录小红书账号"}
+    async def worker(url: str):
+        return await fetch_note(url, with_comments)
+    return await run_batch(urls, worker, concurrency, item_timeout, progress)
+
+async def get_comments_batch(urls: List[str], concurrency: int = 0, item_timeout: float = 90, progress=None) -> dict:
+    """批量获取笔记评论，返回每条笔记的评论列表（单条失败不影响其他条目）
+    
+    Args:
+        urls: 笔记链接或笔记ID列表
+        concurrency: 同时获取的笔记数上限，0 表示跟随站点节奏自动调整
+        item_timeout: 单条笔记的超时时间（秒）
+    """
+    if not await ensure_browser():
+        return {"error": "请先登录小红书账号"}
+    return await run_batch(urls, fetch_note_comments, concurrency, item_timeout, progress)
+
+def analyze_text(title: str, content: str):
+    """领域分类 + 关键词提取，返回 (领域详情, 关键词)"""
+    # 使用预编译的领域词典自动机检测帖子可能属于的领域（词典文件修改后自动热加载）
+    domain_details = get_classifier().classify(title, content)
+    # 中文分词后按语料 TF-IDF 排序，取前20个关键词
+    keywords = extract_keywords(title, content.replace("未能获取内容", ""), topk=20)
+    return domain_details, keywords
 
-@mcp.tool()
 async def analyze_note(url: str) -> dict:
     """获取并分析笔记内容，返回笔记的详细信息供AI生成评论
     
@@ -881,66 +738,13 @@ async def analyze_note(url: str) -> dict:
         return {"error": "请先登录小红书账号"}
     
     try:
-        # 直接调用get_note_content获取笔记内容
-        note_content_result = await get_note_content(url)
-        
-        # 检查是否获取成功
-        if note_content_result.startswith("请先登录") or note_content_result.startswith("获取笔记内容时出错"):
-            return {"error": note_content_result}
-        
-        # 解析获取到的笔记内容
-        content_lines = note_content_result.strip().split('\n')
-        post_content = {}
+        # 复用笔记记录（优先轻量抓取，必要时一次页面加载），不再解析 get_note_content 的文本结果
+        post_content = await fetch_note(url)
         
-        # 提取标题、作者、发布时间和内容
-        for i, line in enumerate(content_lines):
-            if line.startswith("标题:"):
-                post_content["标题"] = line.replace("标题:", "").strip()
-            elif line.startswith("作者:"):
-                post_content["作者"] = line.replace("作者:", "").strip()
-            elif line.startswith("发布时间:"):
-                post_content["发布时间"] = line.replace("发布时间:", "").strip()
-            elif line.startswith("内容:"):
-                # 内容可能有多行，获取剩余所有行
-                content_text = "\n".join(content_lines[i+1:]).strip()
-                post_content["内容"] = content_text
-                break
-        
-        # 如果没有提取到标题或内容，设置默认值
-        if "标题" not in post_content or not post_content["标题"]:
-            post_content["标题"] = "未知标题"
-        if "作者" not in post_content or not post_content["作者"]:
-            post_content["作者"] = "未知作者"
-        if "内容" not in post_content or not post_content["内容"]:
-            post_content["内容"] = "未能获取内容"
-        
-        # 简单分词
-        words = re.findall(r'\w+', f"{post_content.get('标题', '')} {post_content.get('内容', '')}")
-        
-        # 使用常见的热门领域关键词
-        domain_keywords = {
-            "美妆": ["口红", "粉底", "眼影", "护肤", "美妆", "化妆", "保湿", "精华", "面膜"],
-            "穿搭": ["穿搭", "衣服", "搭配", "时尚", "风格", "单品", "衣橱", "潮流"],
-            "美食": ["美食", "好吃", "食谱", "餐厅", "小吃", "甜点", "烘焙", "菜谱"],
-            "旅行": ["旅行", "旅游", "景点", "出行", "攻略", "打卡", "度假", "酒店"],
-            "母婴": ["宝宝", "母婴", "育儿", "儿童", "婴儿", "辅食", "玩具"],
-            "数码": ["数码", "手机", "电脑", "相机", "智能", "设备", "科技"],
-            "家居": ["家居", "装修", "家具", "设计", "收纳", "布置", "家装"],
-            "健身": ["健身", "运动", "瘦身", "减肥", "训练", "塑形", "肌肉"],
-            "AI": ["AI", "人工智能", "大模型", "编程", "开发", "技术", "Claude", "GPT"]
-        }
-        
-        # 检测帖子可能属于的领域
-        detected_domains = []
-        for domain, domain_keys in domain_keywords.items():
-            for key in domain_keys:
-                if key.lower() in post_content.get("标题", "").lower() or key.lower() in post_content.get("内容", "").lower():
-                    detected_domains.append(domain)
-                    break
-        
-        # 如果没有检测到明确的领域，默认为生活方式
-        if not detected_domains:
-            detected_domains = ["生活"]
+        # 领域分类和关键词提取在后处理线程池中执行
+        domain_details, keywords = await post.run(analyze_text, post_content.get("标题", ""),
+                                                  post_content.get("内容", ""), label="analyze")
+        detected_domains = [d["领域"] for d in domain_details]
         
         # 返回分析结果
         return {
@@ -949,13 +753,177 @@ async def analyze_note(url: str) -> dict:
             "作者": post_content.get("作者", "未知作者"),
             "内容": post_content.get("内容", "未能获取内容"),
             "领域": detected_domains,
-            "关键词": list(set(words))[:20]  # 取前20个不重复的词作为关键词
+            "领域详情": domain_details,
+            "关键词": keywords,
+            "标签": post_content.get("标签", []),
+            "图片": post_content.get("图片", [])
         }
     
     except Exception as e:
         return {"error": f"分析笔记内容时出错: {str(e)}"}
 
-@mcp.tool()
+def classify_all() -> dict:
+    """读取并分类全部笔记，统计各领域笔记数（同步，在后处理线程池中执行）"""
+    results = list(classify_corpus())
+    distribution = {}
+    for item in results:
+        for domain in item["领域"]:
+            distribution[domain] = distribution.get(domain, 0) + 1
+    return {"笔记数": len(results), "领域分布": distribution, "结果": results}
+
+async def classify_notes() -> dict:
+    """对已爬取的全部笔记批量做领域分类，返回每条笔记的领域及各领域笔记数"""
+    # 读文件和分类在后处理线程池中执行，不阻塞浏览器所在的事件循环
+    return await post.run(classify_all, label="classify")
+
+async def export_notes_dataset(fmt: str = "parquet", incremental: bool = True) -> dict:
+    """把已爬取的笔记、评论、标签导出为按抓取日期分区的 Parquet/CSV 数据集
+
+    Args:
+        fmt: 导出格式，parquet 或 csv
+        incremental: 是否只重写有笔记新增、修改或删除的日期分区
+    """
+    # pandas 只在导出时才导入
+    from dataset_export import export_dataset
+    try:
+        return await asyncio.to_thread(export_dataset, fmt, incremental)
+    except ValueError as e:
+        return {"error": str(e)}
+
+async def get_comment_threads(url: str, top_n: int = 10, replies_per_thread: int = 5) -> dict:
+    """按点赞数获取笔记评论区的前 N 个楼层，每个楼层带回复树（评论库中没有该笔记时先抓取一次）
+
+    Args:
+        url: 笔记链接或笔记ID
+        top_n: 返回的楼层数
+        replies_per_thread: 每个楼层最多返回的直接回复数
+    """
+    url = normalize_note_url(url)
+    note_id = note_id_from_url(url)
+    if not note_id:
+        return {"error": f"无法从链接中识别笔记ID: {url}"}
+    store = get_comment_store()
+    # 评论库查询在线程中执行，不阻塞浏览器所在的事件循环
+    if not await asyncio.to_thread(store.count, note_id):
+        if not await ensure_browser():
+            return {"error": "请先登录小红书账号"}
+        try:
+            await fetch_note_comments(url)
+        except Exception as e:
+            return {"error": f"获取评论时出错: {str(e)}"}
+    return {
+        "笔记ID": note_id,
+        "评论总数": await asyncio.to_thread(store.count, note_id),
+        "楼层": await asyncio.to_thread(store.top_threads, note_id, top_n, replies_per_thread),
+    }
+
+async def search_local(query: str, limit: int = 10, kind: str = "全部") -> dict:
+    """在本地已爬取的笔记和评论中全文检索（BM25 排序），不访问小红书
+
+    Args:
+        query: 检索词
+        limit: 返回结果数
+        kind: 全部、笔记 或 评论
+    """
+    if kind not in ("全部", KIND_NOTE, KIND_COMMENT):
+        return {"error": f"不支持的类型: {kind}"}
+    return await asyncio.to_thread(get_search_index().search, query, limit, None if kind == "全部" else kind)
+
+async def get_recent_notes(keyword: str = "", days: float = 7, limit: int = 50,
+                           with_comments: bool = False) -> dict:
+    """按发布时间查询本地已爬取的笔记：返回最近 days 天发布的笔记（可按搜索关键词过滤），不访问小红书
+
+    Args:
+        keyword: 抓取时使用的搜索关键词，留空表示全部
+        days: 最近多少天
+        limit: 最多返回的笔记数
+        with_comments: 是否同时返回这段时间内的评论
+    """
+    return await asyncio.to_thread(get_time_index().recent, keyword or None, days, limit, with_comments)
+
+async def capture_engagement(force: bool = False, concurrency: int = 0) -> dict:
+    """
+    对到了采样时间的跟踪笔记做一轮互动数采样：只走轻量抓取（页面快照里没有互动数），
+    成功的写入互动序列，失败的推迟到下一个采样间隔
+    """
+    store = get_engagement_store()
+    due = dict(store.due(force=force))
+    if not due:
+        return {"总数": 0, "成功数": 0, "失败数": 0, "失败": []}
+    async def worker(url: str):
+        async with fast_fetch_semaphore, get_pacer(url).request():
+            record = await fetch_note_fast(browser_context, url)
+        return record.get("互动") or {}
+    batch = await run_batch(list(due.values()), worker, concurrency, item_timeout=60)
+    now = int(time.time())
+    samples, failed = [], []
+    for note_id, entry in zip(due, batch["结果"]):
+        if entry["状态"] == "ok":
+            samples.append((note_id, now, entry["数据"]))
+        else:
+            failed.append(note_id)
+    await asyncio.to_thread(store.record, samples)
+    if failed:
+        store.mark_attempted(failed, now)
+    metrics.inc("engagement_samples_total", len(samples), status="ok")
+    metrics.inc("engagement_samples_total", len(failed), status="error")
+    return {"总数": batch["总数"], "成功数": len(samples), "失败数": len(failed),
+            "失败": [{"笔记ID": i, "错误": e.get("错误")} for i, e in zip(due, batch["结果"]) if e["状态"] != "ok"]}
+
+async def engagement_tracker_loop(tick: float = 60):
+    """每 tick 秒检查一次到期的跟踪笔记并采样，一直运行到被取消"""
+    while True:
+        try:
+            if get_engagement_store().due():
+                if await ensure_browser():
+                    result = await capture_engagement()
+                    print(f"[日志] 互动采样完成：成功 {result['成功数']}，失败 {result['失败数']}")
+                else:
+                    print("[日志] 未登录，跳过本轮互动采样")
+        except Exception as e:
+            print(f"[日志] 互动采样出错: {e}")
+        await asyncio.sleep(tick)
+
+def start_engagement_tracker():
+    """在后台事件循环中启动互动采样调度，不阻塞调用方"""
+    return asyncio.run_coroutine_threadsafe(engagement_tracker_loop(), get_background_loop())
+
+async def track_notes(urls: List[str], interval_minutes: float = DEFAULT_ENGAGEMENT_INTERVAL / 60) -> dict:
+    """登记要持续跟踪互动数（点赞、收藏、评论、分享）的笔记，按间隔自动采样
+
+    Args:
+        urls: 笔记链接或笔记ID列表
+        interval_minutes: 采样间隔（分钟）
+    """
+    interval = max(60, int(interval_minutes * 60))
+    note_ids = await asyncio.to_thread(get_engagement_store().track, urls, interval)
+    return {"已登记": note_ids, "采样间隔s": interval}
+
+async def untrack_notes(urls: List[str]) -> dict:
+    """停止跟踪笔记的互动数（已采集的数据保留）
+
+    Args:
+        urls: 笔记链接或笔记ID列表
+    """
+    return {"已停止": await asyncio.to_thread(get_engagement_store().untrack, urls)}
+
+async def get_engagement(urls: Optional[List[str]] = None, hours: float = 72, step_minutes: float = 60) -> dict:
+    """查询跟踪笔记的互动数时间序列（按步长降采样），不访问小红书
+
+    Args:
+        urls: 笔记链接或笔记ID列表，留空表示全部跟踪的笔记
+        hours: 最近多少小时
+        step_minutes: 降采样步长（分钟），每个步长取最后一次采样
+    """
+    store = get_engagement_store()
+    series = await asyncio.to_thread(store.series, urls or None, time.time() - hours * 3600, None,
+                                     max(1, int(step_minutes * 60)))
+    return {**store.summary(), "序列": series}
+
+async def get_metrics() -> dict:
+    """查看爬虫运行指标（页面回收、浏览器重启、内存等）"""
+    return metrics.snapshot()
+
 async def post_smart_comment(url: str, comment_type: str = "引流") -> dict:
     """
     根据帖子内容发布智能评论，增加曝光并引导用户关注或私聊
@@ -999,7 +967,6 @@ async def post_smart_comment(url: str, comment_type: str = "引流") -> dict:
 # 2. post_comment - 发布评论
 # 3. post_smart_comment - 结合前两个功能，使用MCP客户端的AI能力生成评论
 
-@mcp.tool()
 async def post_comment(url: str, comment: str) -> str:
     """发布评论到指定笔记
     
@@ -1011,9 +978,16 @@ async def post_comment(url: str, comment: str) -> str:
     if not login_status:
         return "请先登录小红书账号，才能发布评论"
     
+    async with page_pool.lease() as page:
+        return await do_post_comment(page, url, comment)
+
+async def do_post_comment(main_page, url: str, comment: str) -> str:
+    """
+    在指定页面上实际发布评论。
+    """
     try:
         # 访问帖子链接
-        await main_page.goto(url, timeout=60000)
+        await goto_page(main_page, url)
         await asyncio.sleep(5)  # 等待页面加载
         
         # 定位评论区域并滚动到该区域
@@ -1157,69 +1131,101 @@ async def post_comment(url: str, comment: str) -> str:
 
 async def get_note_links_by_keywords(main_page, keywords: str, limit: int = 5):
     """
-    用do_search_notes逻辑获取前limit条笔记的链接和标题
+    打开搜索结果页，按卡片提取规则获取前limit条笔记的链接和标题
     """
-    # 跳转到搜索页面
-    await main_page.goto(f"https://www.xiaohongshu.com/search_result?keyword={keywords}", timeout=60000)
-    await asyncio.sleep(5)
-    post_cards = await main_page.query_selector_all('section.note-item')
-    if not post_cards:
-        post_cards = await main_page.query_selector_all('div[data-v-a264b01a]')
-    post_links = []
-    post_titles = []
-    for card in post_cards:
+    await goto_page(main_page, search_url(keywords))
+    found = await wait_for_cards(main_page)
+    get_pacer(main_page.url).record_result(empty=not found)
+    posts = []
+    async for batch in stream_cards(main_page, limit):
+        posts.extend({"url": card["链接"], "title": card["标题"]} for card in batch)
+    return posts
+
+def index_note(md_filename: str, md_path: str, note_record: Dict[str, Any], complete: bool = True,
+               comment_total: Optional[int] = None):
+    """
+    把新保存的笔记增量写入各索引（在后处理线程中执行，单个索引失败只记录日志）；
+    comment_total 为这条笔记的评论总数，超过记录中的评论条数时说明记录里只是预览
+    """
+    md_mtime = os.path.getmtime(md_path)
+    if comment_total is not None and comment_total > len(note_record.get("评论") or []):
+        # 从已写完的 markdown 读回全部评论，增量更新与按语料重建的结果一致
         try:
-            link_element = await card.query_selector('a[href*="/explore/"]')
-            if not link_element:
-                continue
-            href = await link_element.get_attribute('href')
-            if href and '/explore/' in href:
-                full_url = f"https://www.xiaohongshu.com{href}"
-                post_links.append(full_url)
-                # 获取标题
-                title_element = await card.query_selector('a.title span')
-                if title_element:
-                    title = await title_element.text_content()
-                else:
-                    title = "未知标题"
-                post_titles.append(title)
-        except Exception:
-            continue
-    # 去重
-    unique_posts = []
-    seen_urls = set()
-    for url, title in zip(post_links, post_titles):
-        if url not in seen_urls:
-            seen_urls.add(url)
-            unique_posts.append({"url": url, "title": title})
-    unique_posts = unique_posts[:limit]
-    return unique_posts
-
-async def crawl_notes_by_click(main_page, keywords, note_limit, comment_limit):
+            note_record = {**note_record, "评论": load_note_file(md_path)["评论"]}
+        except (OSError, UnicodeDecodeError) as e:
+            print(f"[日志] 读取笔记全部评论失败 {md_path}: {e}")
+    # 增量更新关键词语料统计（话题标签同时进入用户词典）
+    try:
+        get_keyword_engine().add_note(md_filename, note_record, mtime=md_mtime)
+    except Exception as e:
+        print(f"[日志] 更新关键词统计失败: {e}")
+    # 增量更新 /stats 聚合
+    try:
+        get_note_stats().record_note(md_filename, note_record, mtime=md_mtime)
+    except Exception as e:
+        print(f"[日志] 更新统计聚合失败: {e}")
+    # 增量更新近重复索引（按笔记ID，文件名会在不同次爬取之间重复使用）
+    try:
+        get_dedup_index().add(doc_key(note_id_from_url(note_record.get("链接", "")), md_filename), note_record,
+                              complete=complete, file=md_filename)
+    except Exception as e:
+        print(f"[日志] 更新近重复索引失败: {e}")
+    # 增量更新本地全文索引
+    try:
+        get_search_index().add_note(md_filename, note_record)
+    except Exception as e:
+        print(f"[日志] 更新全文索引失败: {e}")
+    # 增量更新时间索引
+    try:
+        get_time_index().record_note(md_filename, note_record)
+    except Exception as e:
+        print(f"[日志] 更新时间索引失败: {e}")
+
+async def crawl_notes_by_click(main_page, keywords, note_limit, comment_limit, on_note=None):
+    """
+    在搜索结果页逐条点开笔记，保存为 markdown 并更新各索引，返回成功爬取的笔记数；
+    on_note 为 async (笔记记录) -> None，每保存一条笔记调用一次（批量爬取用它流式输出）
+    """
     print(f"[日志] 开始爬取，关键词: {keywords}, note_limit: {note_limit}, comment_limit: {comment_limit}")
-    await main_page.goto(f"https://www.xiaohongshu.com/search_result?keyword={keywords}", timeout=60000)
-    await asyncio.sleep(5)
+    listing_url = search_url(keywords)
+    await goto_page(main_page, listing_url)
+    await wait_for_cards(main_page)
     crawled_titles = set()
+    # 每张卡片（按标题）失败的次数；空字符串表示还没选中卡片就失败（搜索页本身有问题）
+    attempts: Dict[str, int] = {}
     success_count = 0
+    # 追踪文件按本次爬取任务归档
+    job = f"crawl_{keywords}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
     while success_count < note_limit:
+        await site_breaker.wait()
+        card_title = None
+        trace = await tracer.begin(browser_context, job)
         try:
-            cards = await main_page.query_selector_all('section.note-item, div[data-v-a264b01a]')
+            # 卡片、标题和链接的选择器都来自提取规则的 cards 段，与 stream_cards 一致
+            cards = await query_cards(main_page)
             print(f"[日志] 当前页面卡片数量: {len(cards)}")
+            if not cards:
+                raise SelectorMiss("搜索结果页没有笔记卡片")
             card_to_click = None
             card_title = None
             for card in cards:
-                title_el = await card.query_selector('a.title span, .title, h3, h2')
-                if title_el:
-                    t = await title_el.text_content()
-                    t = t.strip() if t else None
-                    if t and t not in crawled_titles:
-                        card_to_click = card
-                        card_title = t
-                        break
+                t = await read_card_title(card)
+                if t and t not in crawled_titles:
+                    card_to_click = card
+                    card_title = t
+                    break
             if not card_to_click:
                 print("[日志] 没有更多未爬取的卡片，提前结束")
+                await tracer.end(trace)
                 break
             print(f"[日志] 点击卡片: {card_title}")
+            # 记录卡片链接，用于生成笔记ID
+            note_url = ""
+            try:
+                note_url = await read_card_link(card_to_click)
+            except Exception:
+                pass
+            trace.note_id = note_id_from_url(note_url) or card_title
             try:
                 await card_to_click.click()
             except Exception as e:
@@ -1229,148 +1235,172 @@ async def crawl_notes_by_click(main_page, keywords, note_limit, comment_limit):
                     await asyncio.sleep(1)
                     await card_to_click.click()
                 except Exception as e2:
-                    print(f"[日志] 卡片点击重试失败: {e2}")
-                    break
-            await asyncio.sleep(3)
-            # 爬取详情页内容
-            title = card_title or "未知标题"
-            title_el = await main_page.query_selector('#detail-title, div.title, h1')
-            if title_el:
-                t = await title_el.text_content()
-                if t: title = t.strip()
-            author = "未知作者"
-            author_el = await main_page.query_selector('span.username, a.name, .author-wrapper .username, .info .name')
-            if author_el:
-                a = await author_el.text_content()
-                if a: author = a.strip()
-            pub_time = "未知"
-            time_el = await main_page.query_selector('span.date, .bottom-container .date, .date')
-            if time_el:
-                t = await time_el.text_content()
-                if t: pub_time = t.strip()
-            content = "未能获取内容"
-            content_el = await main_page.query_selector('#detail-desc .note-text, div.note-content .note-text, div.desc, span.note-text')
-            if content_el:
-                c = await content_el.text_content()
-                if c and len(c.strip()) > 10:
-                    content = c.strip()
-            tags = []
-            tag_els = await main_page.query_selector_all('.tag, .note-tag, .tag-item')
-            for tag_el in tag_els:
-                tag_text = await tag_el.text_content()
-                if tag_text:
-                    tags.append(tag_text.strip())
-            comments = []
-            await main_page.evaluate('window.scrollTo(0, document.body.scrollHeight)')
-            await asyncio.sleep(2)
-            for _ in range(5):
+                    raise SelectorMiss(f"卡片点击重试失败: {e2}")
+            # 等笔记弹窗的标题或正文渲染出来（不再固定等待）
+            await wait_for_note(main_page)
+            # 爬取详情页内容：先按提取规则一次取回头部字段和正文
+            fields = await extract_page(main_page)
+            title = fields["标题"] if fields["标题"] != "未知标题" else (card_title or "未知标题")
+            author = fields["作者"]
+            pub_time = fields["发布时间"]
+            content = fields["内容"]
+            tags = fields["标签"]
+            empty = fields["标题"] == "未知标题" and content == "未能获取内容"
+            get_pacer(main_page.url).record_result(empty=empty)
+            if empty:
+                if await is_login_wall(main_page):
+                    raise LoginWallError("笔记详情遇到登录墙")
+                raise SelectorMiss("笔记详情没有提取到标题和正文")
+            # 与已完整抓取的笔记近重复时，跳过评论展开和图片截图
+            duplicate = None
+            if SKIP_DUPLICATE_DETAILS:
                 try:
-                    more_btn = await main_page.query_selector('text="查看更多评论", text="展开更多评论", text="加载更多", text="查看全部"')
-                    if more_btn:
-                        await more_btn.click()
-                        await asyncio.sleep(2)
-                except Exception:
-                    pass
-            comment_els = await main_page.query_selector_all('div.comment-item, div.commentItem, div.comment-content, div.comment-wrapper, section.comment, div.feed-comment')
-            print(f"[日志] 本条评论数: {len(comment_els)}")
-            for j in range(min(comment_limit, len(comment_els))):
-                try:
-                    el = comment_els[j]
-                    username = "未知用户"
-                    username_el = await el.query_selector('span.user-name, a.name, div.username, span.nickname, a.user-nickname')
-                    if username_el:
-                        u = await username_el.text_content()
-                        if u: username = u.strip()
-                    content_txt = "未知内容"
-                    content_el2 = await el.query_selector('div.content, p.content, div.text, span.content, div.comment-text')
-                    if content_el2:
-                        c2 = await content_el2.text_content()
-                        if c2: content_txt = c2.strip()
-                    time_txt = "未知时间"
-                    time_el2 = await el.query_selector('span.time, div.time, span.date, div.date, time')
-                    if time_el2:
-                        t2 = await time_el2.text_content()
-                        if t2: time_txt = t2.strip()
-                    if username != "未知用户" and content_txt != "未知内容":
-                        comments.append({"用户名": username, "内容": content_txt, "时间": time_txt})
+                    duplicate = await post.run(complete_duplicate, {"标题": title, "内容": content, "标签": tags},
+                                               label="dedup")
                 except Exception as e:
-                    print(f"[日志] 评论解析异常: {e}")
-                    continue
-            md_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scraped_notes")
+                    print(f"[日志] 近重复检测失败: {e}")
+            # 内存里只保留前 COMMENT_RESULT_LIMIT 条评论（回调的预览），全部评论按批写入文件和评论库，
+            # 索引从写完的文件读回全部评论
+            comments: List[Dict[str, Any]] = []
+            comment_count = 0
+            if duplicate:
+                print(f"[日志] 与 {duplicate['文件']} 近重复（相似度 {duplicate['相似度']}），跳过评论和图片")
+                metrics.inc("duplicate_details_skipped_total")
+            md_dir = NOTES_DIR
             os.makedirs(md_dir, exist_ok=True)
             safe_title = re.sub(r'[^ -\x7f\w\u4e00-\u9fa5]+', '_', title)[:30]
-            md_filename = f"note_{safe_title}_{success_count+1}.md"
+            note_id = note_id_from_url(note_url) or note_id_from_url(main_page.url)
+            # 文件名带笔记ID（取不到时用进程号 + 序号）：批量爬取的多个子进程写同一个目录，不能只按序号区分
+            file_key = note_id or f"{os.getpid()}_{success_count+1}"
+            md_filename = f"note_{safe_title}_{file_key}.md"
             md_path = os.path.join(md_dir, md_filename)
-            # 截图正文主图区域（多重选择器兜底，优先主图）
-            img_filename = f"note_{safe_title}_{success_count+1}.png"
+            # 截图正文主图区域（提取规则 actions.main_image 的选择器依次兜底，优先主图）
+            img_filename = f"note_{safe_title}_{file_key}.png"
             img_path = os.path.join(md_dir, img_filename)
-            img_element = (
-                await main_page.query_selector('.swiper-slide-active img') or
-                await main_page.query_selector('.note-image img') or
-                await main_page.query_selector('.image-container img') or
-                await main_page.query_selector('.note-detail img') or
-                await main_page.query_selector('img')
-            )
+            img_element = None if duplicate else await query_main_image(main_page)
             if img_element:
-                await img_element.screenshot(path=img_path)
+                # 截图只取回字节，写文件放到后处理线程池
+                await post.run(write_file, img_path, await img_element.screenshot(), label="image")
                 print(f"[日志] 已截图保存图片: {img_filename}")
                 img_md = f"![](/notes_img/{img_filename})"
+            elif duplicate:
+                img_md = ""
             else:
                 print("[日志] 未找到主图区域，跳过截图")
                 img_md = "![](https://via.placeholder.com/300x200?text=No+Image)"
+            crawl_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            pub_epoch, pub_precision = normalize_time(pub_time, crawl_time)
             md_content = f"# {title}\n\n"
             md_content += f"- 作者：{author}\n"
             md_content += f"- 发布时间：{pub_time}\n"
+            md_content += f"- 搜索关键词：{keywords}\n"
+            md_content += f"- 链接：{note_url or main_page.url}\n"
+            md_content += f"- 抓取时间：{crawl_time}\n"
+            md_content += f"- 发布时间UTC：{format_utc(pub_epoch)}\n"
+            md_content += f"- 发布时间精度：{pub_precision}\n"
             md_content += f"- 标签：{'、'.join(tags) if tags else '无'}\n"
+            if duplicate:
+                md_content += f"- 重复于：{duplicate['文件']}\n"
             md_content += f"\n## 正文\n\n{content}\n\n"
             md_content += f"## 图片\n\n{img_md}\n\n"
-            if comments:
-                md_content += "## 评论\n\n"
-                for k, c in enumerate(comments, 1):
-                    md_content += f"{k}. {c['用户名']}（{c['时间']}）: {c['内容']}\n\n"
             print(f"[日志] 准备保存: {md_filename} 到 {md_path}")
-            with open(md_path, "w", encoding="utf-8") as f:
-                f.write(md_content)
+            # 先写头部、正文和图片，评论边提取边按批追加（每批 fsync）；中途退出时已抓到的评论仍在文件里
+            await post.run(write_file, md_path, md_content, False, True, label="markdown")
+            if not duplicate and comment_limit > 0:
+                await main_page.evaluate('window.scrollTo(0, document.body.scrollHeight)')
+                await asyncio.sleep(2)
+                # 评论树节点和扁平评论在同一次提取中取得，每批追加到评论库（替换该笔记原有的评论树）
+                stored = 0
+                async for batch, nodes in stream_comments(main_page, rounds=5, limit=comment_limit,
+                                                          tree=bool(note_id)):
+                    if batch:
+                        text = "".join(f"{k}. {c['用户名']}（{c['时间']}）: {c['内容']}\n\n"
+                                       for k, c in enumerate(batch, comment_count + 1))
+                        await post.run(write_file, md_path, ("" if comment_count else "## 评论\n\n") + text,
+                                       True, True, label="markdown")
+                        comment_count += len(batch)
+                        comments.extend(batch[:COMMENT_RESULT_LIMIT - len(comments)])
+                    if nodes:
+                        stored += await post.run(append_comment_nodes, note_id, nodes, stored, label="comment_store")
+            print(f"[日志] 本条评论数: {comment_count}")
             print(f"[日志] 已保存: {md_filename}")
+            await archive_page(main_page, note_url or main_page.url, note_id, source="crawl")
+            note_record = {
+                "标题": title, "作者": author, "发布时间": pub_time, "标签": tags, "内容": content,
+                "评论": comments, "搜索关键词": keywords, "链接": note_url or main_page.url, "抓取时间": crawl_time
+            }
+            # 各索引的增量更新排队到后处理线程池，不等待完成（队列满时在这里等待）
+            await post.submit(index_note, md_filename, md_path, note_record, duplicate is None, comment_count,
+                              label="index")
             crawled_titles.add(title)
+            crawled_titles.add(card_title)
+            # 先关闭弹窗再记成功：笔记已经保存，弹窗关不掉只需要重新打开搜索页，不算这条笔记失败
+            modal_closed = await close_modal(main_page)
             success_count += 1
-            # 关闭弹窗
-            close_btn = (
-                await main_page.query_selector('button[aria-label="关闭"]') or
-                await main_page.query_selector('.close') or
-                await main_page.query_selector('.icon-close') or
-                await main_page.query_selector('.modal-close') or
-                await main_page.query_selector('.note-dialog-close') or
-                await main_page.query_selector('.red-close') or
-                await main_page.query_selector('.close-btn')
-            )
-            if close_btn:
-                await close_btn.click()
-            else:
-                await main_page.keyboard.press('Escape')
-            await asyncio.sleep(2)
+            site_breaker.record_success()
+            if on_note is not None:
+                try:
+                    await on_note({**note_record, "笔记ID": note_id, "文件名": md_filename, "评论总数": comment_count,
+                                   "发布时间UTC": format_utc(pub_epoch), "发布时间精度": pub_precision,
+                                   "重复于": duplicate["文件"] if duplicate else ""})
+                except Exception as e:
+                    print(f"[日志] 笔记回调失败: {e}")
+            if content == "未能获取内容":
+                trace.fail("no_content")
+            if not modal_closed:
+                trace.fail(ModalStuck.kind)
+            await tracer.end(trace)
+            if not modal_closed:
+                print("[日志] 笔记已保存，但弹窗无法关闭，重新打开搜索页")
+                metrics.inc("crawl_recoveries_total", kind=ModalStuck.kind)
+                await goto_page(main_page, listing_url)
+                await wait_for_cards(main_page)
+            # 页面生命周期检查：回收或重启后回到搜索结果页继续
+            lifecycle.note_done(main_page)
+            checked_page = await page_checkpoint(main_page)
+            if checked_page is not main_page:
+                main_page = checked_page
+                await goto_page(main_page, listing_url)
+                await wait_for_cards(main_page)
+        except LoginWallError as e:
+            print(f"[日志] {e}，登录已失效，停止爬取")
+            mark_login_state(False, wall_session=await get_session_cookie())
+            metrics.inc("crawl_errors_total", kind=e.kind)
+            await tracer.end(trace, e.kind)
+            break
         except Exception as e:
-            print(f"[日志] 第{success_count+1}条爬取失败: {str(e)}")
-            # 尝试关闭弹窗，避免死循环
+            error = classify_error(e)
+            metrics.inc("crawl_errors_total", kind=error.kind)
+            site_breaker.record_failure()
+            await tracer.end(trace, error.kind)
+            key = card_title or ""
+            attempts[key] = attempts.get(key, 0) + 1
+            print(f"[日志] 第{success_count+1}条爬取失败（{error.kind}，第{attempts[key]}次）: {str(e)}")
+            if attempts[key] >= MAX_NOTE_ATTEMPTS:
+                metrics.inc("crawl_gave_up_total", kind=error.kind)
+                if not card_title:
+                    print("[日志] 搜索结果页反复失败，结束爬取")
+                    break
+                # 记为已处理，下一轮不会再选中这张卡片
+                print(f"[日志] 「{card_title}」已失败 {attempts[key]} 次，跳过")
+                crawled_titles.add(card_title)
+            # 恢复：弹窗关不掉、导航超时或页面上找不到卡片时重新打开搜索页，否则只关闭弹窗
             try:
-                close_btn = (
-                    await main_page.query_selector('button[aria-label="关闭"]') or
-                    await main_page.query_selector('.close') or
-                    await main_page.query_selector('.icon-close') or
-                    await main_page.query_selector('.modal-close') or
-                    await main_page.query_selector('.note-dialog-close') or
-                    await main_page.query_selector('.red-close') or
-                    await main_page.query_selector('.close-btn')
-                )
-                if close_btn:
-                    await close_btn.click()
-                else:
-                    await main_page.keyboard.press('Escape')
-                await asyncio.sleep(2)
+                if isinstance(error, (ModalStuck, NavigationTimeout)) or not card_title \
+                        or not await close_modal(main_page):
+                    await goto_page(main_page, listing_url)
+                    await wait_for_cards(main_page)
             except Exception as e2:
-                print(f"[日志] 异常关闭弹窗失败: {e2}")
+                print(f"[日志] 恢复搜索页失败: {e2}")
+            await asyncio.sleep(default_policy.delay(attempts[key]))
             continue
+        finally:
+            # 上面各分支都已结束追踪；任务被取消（CancelledError 不是 Exception）时在这里结束，释放 chunk 锁
+            await tracer.end(trace, "cancelled")
+    # 等排队的索引更新全部写完再返回
+    await post.drain()
     print("[日志] 全部爬取完成！")
+    return success_count
 
 def parse_user_input(user_input):
     """
@@ -1392,47 +1422,8 @@ def parse_user_input(user_input):
     else:
         return None, None, None
 
-# 直接启动API服务，无论如何运行都不会进入命令行交互模式
-
-app = Flask(__name__)
-CORS(app)
-
-@app.route('/crawl', methods=['POST'])
-def crawl():
-    try:
-        data = request.json
-        print('收到前端请求:', data)
-        keywords = data.get('keywords')
-        note_limit = int(data.get('note_limit', 5) or 5)
-        comment_limit = int(data.get('comment_limit', 1) or 1)
-        print(f'准备启动爬虫，关键词: {keywords}, 笔记数: {note_limit}, 评论数: {comment_limit}')
-        async def run_crawler():
-            print('ensure_browser 开始')
-            await ensure_browser()
-            print('ensure_browser 完成，开始爬取')
-            await crawl_notes_by_click(main_page, keywords, note_limit, comment_limit)
-            print('crawl_notes_by_click 完成')
-        asyncio.run(run_crawler())
-        print('爬虫任务已完成，准备返回响应')
-        return jsonify({'status': 'ok', 'msg': '爬虫任务已完成'})
-    except Exception as e:
-        print('后端异常:', e)
-        return jsonify({'status': 'error', 'msg': str(e)}), 500
-
-@app.route('/notes', methods=['GET'])
-def get_notes():
-    notes_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scraped_notes")
-    note_files = glob.glob(os.path.join(notes_dir, "*.md"))
-    notes = []
-    for file in note_files:
-        with open(file, "r", encoding="utf-8") as f:
-            notes.append({"filename": os.path.basename(file), "content": f.read()})
-    return jsonify(notes)
-
-@app.route('/notes_img/<filename>')
-def serve_note_image(filename):
-    notes_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scraped_notes")
-    return send_from_directory(notes_dir, filename)
 
 if __name__ == "__main__":
-    app.run(port=5001)
\ No newline at end of file
+    # 兼容旧的启动方式：直接运行本文件仍然启动 HTTP API
+    from http_api import main
+    main()